@@ -0,0 +1,247 @@
+"""
+Prueba de carga de punta a punta del backend v1.
+
+Cada sesión recorre el flujo real de la interfaz:
+    /api/analyze -> /api/chat/sessions + N turnos -> /api/generate -> /api/export-docx
+y se corren `--concurrencia` sesiones a la vez hasta completar `--sesiones`.
+Al final se informa, por endpoint, p50/p95/p99, máximo, errores y pedidos por
+segundo, y las sesiones completas por segundo.
+
+Pensado para usarse con el proveedor fake (AI_PROVIDER=fake, ver ia_fake.py),
+así no se gasta API y la latencia de la IA es controlable:
+
+    AI_PROVIDER=fake AI_FAKE_LATENCIA=lognormal:800,0.4 uvicorn main:app --port 8000
+    python backend/bench_carga.py --concurrencia 20 --sesiones 200
+
+Con --en-proceso la app se carga en este mismo proceso (httpx.ASGITransport),
+sin levantar uvicorn; si no se indicó otro proveedor se usa el fake.
+
+Por defecto cada sesión manda un contrato distinto (se le agrega una línea de
+referencia) para que /api/analyze no se resuelva desde el cache; con
+--repetir-contrato se manda siempre el mismo texto.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+import uuid
+from pathlib import Path
+
+import httpx
+
+RAIZ = Path(__file__).resolve().parent.parent
+
+
+def percentil(valores: list[float], p: float) -> float:
+    """Percentil por rango más cercano (valores ya ordenados)."""
+    if not valores:
+        return 0.0
+    k = max(0, min(len(valores) - 1, int(round(p / 100 * len(valores) + 0.5)) - 1))
+    return valores[k]
+
+
+class Mediciones:
+    def __init__(self):
+        self.tiempos: dict[str, list[float]] = {}
+        self.errores: dict[str, int] = {}
+        self.detalle_errores: dict[str, str] = {}
+        self.sesiones_ok = 0
+        self.sesiones_fallidas = 0
+
+    def registrar(self, endpoint: str, segundos: float, ok: bool, detalle: str = "") -> None:
+        self.tiempos.setdefault(endpoint, []).append(segundos)
+        if not ok:
+            self.errores[endpoint] = self.errores.get(endpoint, 0) + 1
+            self.detalle_errores.setdefault(endpoint, detalle[:200])
+
+    def resumen(self, duracion: float) -> dict:
+        endpoints = {}
+        for endpoint, tiempos in self.tiempos.items():
+            orden = sorted(tiempos)
+            endpoints[endpoint] = {
+                "pedidos": len(orden),
+                "errores": self.errores.get(endpoint, 0),
+                "p50_ms": round(percentil(orden, 50) * 1000, 1),
+                "p95_ms": round(percentil(orden, 95) * 1000, 1),
+                "p99_ms": round(percentil(orden, 99) * 1000, 1),
+                "max_ms": round(orden[-1] * 1000, 1),
+                "req_s": round(len(orden) / duracion, 2) if duracion else 0.0,
+            }
+        return {
+            "duracion_s": round(duracion, 2),
+            "sesiones_ok": self.sesiones_ok,
+            "sesiones_fallidas": self.sesiones_fallidas,
+            "sesiones_s": round(self.sesiones_ok / duracion, 2) if duracion else 0.0,
+            "endpoints": endpoints,
+            "primer_error": self.detalle_errores,
+        }
+
+
+class ErrorSesion(Exception):
+    pass
+
+
+async def _pedir(cliente: httpx.AsyncClient, med: Mediciones, endpoint: str, metodo: str,
+                 url: str, **kwargs) -> httpx.Response:
+    inicio = time.perf_counter()
+    try:
+        resp = await cliente.request(metodo, url, **kwargs)
+    except httpx.HTTPError as e:
+        med.registrar(endpoint, time.perf_counter() - inicio, False, f"{type(e).__name__}: {e}")
+        raise ErrorSesion(endpoint) from e
+    med.registrar(endpoint, time.perf_counter() - inicio, resp.status_code < 400,
+                  f"HTTP {resp.status_code}: {resp.text}")
+    if resp.status_code >= 400:
+        raise ErrorSesion(endpoint)
+    return resp
+
+
+async def _turno_stream(cliente: httpx.AsyncClient, med: Mediciones, url: str, mensaje: str) -> dict:
+    """Turno por SSE: registra el tiempo al primer token y el total."""
+    inicio = time.perf_counter()
+    primer_token = None
+    evento, final, error = "", None, ""
+    try:
+        async with cliente.stream("POST", url, json={"message": mensaje}) as resp:
+            if resp.status_code >= 400:
+                error = f"HTTP {resp.status_code}: {(await resp.aread()).decode('utf-8', 'replace')}"
+            else:
+                async for linea in resp.aiter_lines():
+                    if linea.startswith("event:"):
+                        evento = linea[6:].strip()
+                    elif linea.startswith("data:"):
+                        if evento == "token" and primer_token is None:
+                            primer_token = time.perf_counter() - inicio
+                        elif evento == "done":
+                            final = json.loads(linea[5:])
+                        elif evento == "error":
+                            error = linea[5:].strip()
+    except httpx.HTTPError as e:
+        error = f"{type(e).__name__}: {e}"
+
+    total = time.perf_counter() - inicio
+    ok = final is not None and not error
+    med.registrar("chat_stream", total, ok, error or "el stream terminó sin evento done")
+    if primer_token is not None:
+        med.registrar("chat_stream_ttft", primer_token, True)
+    if not ok:
+        raise ErrorSesion("chat_stream")
+    return final
+
+
+async def sesion(cliente: httpx.AsyncClient, med: Mediciones, plantilla: str, args) -> None:
+    texto = plantilla if args.repetir_contrato else f"{plantilla}\n\nRef. carga {uuid.uuid4().hex}\n"
+
+    resp = await _pedir(cliente, med, "analyze", "POST", "/api/analyze", json={"contract_text": texto})
+    variables = resp.json()["variables"]
+
+    resp = await _pedir(cliente, med, "chat_session", "POST", "/api/chat/sessions",
+                        json={"variables": variables})
+    session_id = resp.json()["session_id"]
+
+    collected = {}
+    for turno in range(args.turnos):
+        mensaje = f"Valor de prueba {turno + 1}"
+        url = f"/api/chat/sessions/{session_id}"
+        if args.stream:
+            respuesta = await _turno_stream(cliente, med, f"{url}/stream", mensaje)
+        else:
+            respuesta = (await _pedir(cliente, med, "chat", "POST", url, json={"message": mensaje})).json()
+        collected = respuesta["collected_data"]
+        if respuesta["is_complete"]:
+            break
+
+    # Lo que la entrevista no llegó a cubrir se completa para que generate reemplace todo
+    for v in variables:
+        if not collected.get(v["key"]):
+            collected[v["key"]] = f"Dato {v['key']}"
+
+    resp = await _pedir(cliente, med, "generate", "POST", "/api/generate", json={
+        "contract_template": texto, "variables": variables, "collected_data": collected,
+    })
+    preview_id = resp.json()["preview_id"]
+
+    await _pedir(cliente, med, f"export_{args.formato}", "POST", "/api/export-docx",
+                 json={"preview_id": preview_id, "format": args.formato})
+    await _pedir(cliente, med, "chat_session_delete", "DELETE", f"/api/chat/sessions/{session_id}")
+
+
+async def correr(cliente: httpx.AsyncClient, plantilla: str, args) -> dict:
+    med = Mediciones()
+    pendientes = iter(range(args.sesiones))
+
+    async def trabajador():
+        for _ in pendientes:
+            try:
+                await sesion(cliente, med, plantilla, args)
+                med.sesiones_ok += 1
+            except (ErrorSesion, KeyError, ValueError):
+                med.sesiones_fallidas += 1
+
+    inicio = time.perf_counter()
+    await asyncio.gather(*(trabajador() for _ in range(min(args.concurrencia, args.sesiones))))
+    return med.resumen(time.perf_counter() - inicio)
+
+
+async def main_async(args) -> dict:
+    plantilla = Path(args.plantilla).read_text(encoding="utf-8")
+    timeout = httpx.Timeout(args.timeout)
+    limites = httpx.Limits(max_connections=args.concurrencia * 2, max_keepalive_connections=args.concurrencia)
+
+    if not args.en_proceso:
+        async with httpx.AsyncClient(base_url=args.url, timeout=timeout, limits=limites) as cliente:
+            info = (await cliente.get("/api/info")).json()
+            print(f"Servidor {args.url}: proveedor {info.get('provider')} ({info.get('model')})")
+            return await correr(cliente, plantilla, args)
+
+    os.environ.setdefault("AI_PROVIDER", "fake")
+    os.environ.setdefault("LOG_LEVEL", "WARNING")   # sin la línea de acceso de cada pedido
+    sys.path.insert(0, str(RAIZ / "backend"))
+    import main  # noqa: E402
+    print(f"En proceso: proveedor {main.AI_PROVIDER} ({main.modelo_activo()})")
+    # ASGITransport no dispara los eventos de inicio y cierre de la app
+    async with main.app.router.lifespan_context(main.app):
+        transporte = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transporte, base_url="http://bench", timeout=timeout) as cliente:
+            return await correr(cliente, plantilla, args)
+
+
+def imprimir(resultado: dict, args) -> None:
+    print(f"\n{resultado['sesiones_ok']} sesiones completas, {resultado['sesiones_fallidas']} fallidas "
+          f"en {resultado['duracion_s']}s (concurrencia {args.concurrencia}) -> "
+          f"{resultado['sesiones_s']} sesiones/s\n")
+    print(f"{'endpoint':<22}{'pedidos':>8}{'errores':>8}{'p50 ms':>10}{'p95 ms':>10}"
+          f"{'p99 ms':>10}{'max ms':>10}{'req/s':>9}")
+    for endpoint, m in resultado["endpoints"].items():
+        print(f"{endpoint:<22}{m['pedidos']:>8}{m['errores']:>8}{m['p50_ms']:>10}{m['p95_ms']:>10}"
+              f"{m['p99_ms']:>10}{m['max_ms']:>10}{m['req_s']:>9}")
+    for endpoint, detalle in resultado["primer_error"].items():
+        print(f"\n[{endpoint}] primer error: {detalle}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Prueba de carga de punta a punta del backend v1")
+    parser.add_argument("--url", default="http://localhost:8000", help="servidor a probar")
+    parser.add_argument("--en-proceso", action="store_true",
+                        help="cargar la app en este proceso en vez de usar --url")
+    parser.add_argument("--concurrencia", type=int, default=10, help="sesiones simultáneas")
+    parser.add_argument("--sesiones", type=int, default=50, help="sesiones en total")
+    parser.add_argument("--turnos", type=int, default=8, help="turnos máximos de chat por sesión")
+    parser.add_argument("--stream", action="store_true",
+                        help="turnos por SSE; mide también el tiempo al primer token")
+    parser.add_argument("--formato", choices=("docx", "pdf"), default="docx")
+    parser.add_argument("--plantilla", default=str(RAIZ / "plantilla_vivienda.txt"))
+    parser.add_argument("--repetir-contrato", action="store_true",
+                        help="mismo contrato en todas las sesiones (analyze desde el cache)")
+    parser.add_argument("--timeout", type=float, default=120, help="segundos por pedido")
+    parser.add_argument("--json", metavar="ARCHIVO", help="guardar el resultado en JSON")
+    args = parser.parse_args()
+
+    resultado = asyncio.run(main_async(args))
+    imprimir(resultado, args)
+    if args.json:
+        Path(args.json).write_text(json.dumps(resultado, indent=2, ensure_ascii=False), encoding="utf-8")
+        print(f"\nResultado guardado en {args.json}")
@@ -0,0 +1,138 @@
+"""
+Cache persistente (SQLite) de resultados de /api/analyze.
+
+La clave combina el texto del contrato con espacios normalizados, el
+proveedor, el modelo y un hash del prompt de sistema: si cambia cualquiera
+de ellos la entrada anterior deja de usarse. Las entradas vencen por TTL y,
+si el total supera el límite de tamaño, se descartan las de acceso más viejo.
+
+Un hit no escribe: la hora de acceso queda pendiente en memoria y se vuelca
+en lote (al guardar, cada ACCESOS_POR_LOTE hits o al cerrar). Los métodos
+hacen I/O de disco: desde código async se llaman en un hilo.
+"""
+
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from pathlib import Path
+
+ACCESOS_POR_LOTE = 64
+
+
+def normalizar_texto(texto: str) -> str:
+    return " ".join(texto.split())
+
+
+def hash_prompt(system_prompt: str) -> str:
+    return hashlib.sha256(system_prompt.encode("utf-8")).hexdigest()[:16]
+
+
+class CacheAnalisis:
+    def __init__(self, ruta: Path, ttl_segundos: float, max_bytes: int):
+        self.ruta = Path(ruta)
+        self.ttl = ttl_segundos
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._accesos: dict[str, float] = {}   # clave -> último acceso aún no escrito
+
+        self.ruta.parent.mkdir(parents=True, exist_ok=True)
+        self._db = sqlite3.connect(str(self.ruta), check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("""
+            CREATE TABLE IF NOT EXISTS analisis (
+                clave     TEXT PRIMARY KEY,
+                valor     TEXT NOT NULL,
+                bytes     INTEGER NOT NULL,
+                creado    REAL NOT NULL,
+                accedido  REAL NOT NULL
+            )
+        """)
+        self._db.execute("CREATE INDEX IF NOT EXISTS idx_analisis_accedido ON analisis(accedido)")
+        self._db.commit()
+
+    @staticmethod
+    def clave(texto: str, proveedor: str, modelo: str, system_prompt: str) -> str:
+        base = "\x1f".join([proveedor, modelo, hash_prompt(system_prompt), normalizar_texto(texto)])
+        return hashlib.sha256(base.encode("utf-8")).hexdigest()
+
+    def obtener(self, clave: str):
+        ahora = time.time()
+        with self._lock:
+            fila = self._db.execute(
+                "SELECT valor, creado FROM analisis WHERE clave = ?", (clave,)
+            ).fetchone()
+            if fila is None or ahora - fila[1] > self.ttl:
+                if fila is not None:
+                    self._db.execute("DELETE FROM analisis WHERE clave = ?", (clave,))
+                    self._db.commit()
+                self.misses += 1
+                return None
+            self._accesos[clave] = ahora
+            if len(self._accesos) >= ACCESOS_POR_LOTE:
+                self._volcar_accesos()
+                self._db.commit()
+            self.hits += 1
+        return json.loads(fila[0])
+
+    def guardar(self, clave: str, valor) -> None:
+        datos = json.dumps(valor, ensure_ascii=False)
+        ahora = time.time()
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO analisis (clave, valor, bytes, creado, accedido) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (clave, datos, len(datos.encode("utf-8")), ahora, ahora),
+            )
+            self._accesos.pop(clave, None)
+            # El descarte por tamaño ordena por acceso: primero los pendientes
+            self._volcar_accesos()
+            self._purgar(ahora)
+            self._db.commit()
+
+    def _volcar_accesos(self) -> None:
+        if self._accesos:
+            self._db.executemany("UPDATE analisis SET accedido = ? WHERE clave = ?",
+                                 [(accedido, clave) for clave, accedido in self._accesos.items()])
+            self._accesos.clear()
+
+    def cerrar(self) -> None:
+        with self._lock:
+            self._volcar_accesos()
+            self._db.commit()
+            self._db.close()
+
+    def _purgar(self, ahora: float) -> None:
+        self._db.execute("DELETE FROM analisis WHERE creado < ?", (ahora - self.ttl,))
+        total = self._db.execute("SELECT COALESCE(SUM(bytes), 0) FROM analisis").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        # Descartar por acceso más viejo hasta volver bajo el límite
+        sobrante = total - self.max_bytes
+        filas = self._db.execute("SELECT clave, bytes FROM analisis ORDER BY accedido").fetchall()
+        borrar = []
+        for clave, tam in filas:
+            if sobrante <= 0:
+                break
+            borrar.append((clave,))
+            sobrante -= tam
+        self._db.executemany("DELETE FROM analisis WHERE clave = ?", borrar)
+
+    def stats(self) -> dict:
+        with self._lock:
+            entradas, total = self._db.execute(
+                "SELECT COUNT(*), COALESCE(SUM(bytes), 0) FROM analisis"
+            ).fetchone()
+        consultas = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / consultas, 3) if consultas else 0.0,
+            "entradas": entradas,
+            "bytes": total,
+            "max_bytes": self.max_bytes,
+            "ttl_segundos": self.ttl,
+        }
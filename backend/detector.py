@@ -0,0 +1,294 @@
+"""
+Detector local de variables en contratos.
+
+Encuentra los huecos mecánicos de una plantilla (puntos, guiones bajos,
+[CAMPO], {{X}}, <CAMPO>) y, cuando puede, los etiqueta sin IA a partir del
+rótulo que los precede ("DNI N° .....", "CUIT ....", "domicilio en ....") y
+de la parte a la que pertenecen (LOCADOR, LOCATARIO, GARANTE).
+
+Cada hueco lleva como placeholder el menor contexto literal alrededor que
+lo hace único en el contrato; `keep_prefix`/`keep_suffix` indican cuánto de
+ese contexto se conserva, para que /api/generate reemplace sólo los puntos
+aunque algún hueco quede vacío.
+
+Produce los mismos dicts de variable que /api/analyze. Los huecos que no
+puede resolver se devuelven como `pendientes`, con un fragmento de contexto
+breve para que el LLM sólo tenga que clasificar esos fragmentos.
+"""
+
+import re
+import unicodedata
+from dataclasses import dataclass, field
+
+DETECTOR_VERSION = "2"
+
+CONTEXTO_CHARS = 110
+# Contexto literal máximo que se antepone a un hueco para que su placeholder sea único
+CONTEXTO_UNICO_CHARS = 80
+
+# Marcadores explícitos: {{X}}, [CAMPO EN MAYÚSCULAS], <CAMPO EN MAYÚSCULAS>
+EXPLICITO_RE = re.compile(
+    r'\{\{\s*([^{}\n]{1,60}?)\s*\}\}'
+    r'|\[([A-ZÁÉÍÓÚÑ0-9_ ]{2,60})\]'
+    r'|<([A-ZÁÉÍÓÚÑ0-9_ ]{2,50})>'
+)
+
+# Huecos: cuatro o más puntos (admite espacios entre ellos), elipsis o guiones bajos.
+# No arranca pegado a una palabra, para no tomar el punto de "Sr." o "N°.".
+HUECO_RE = re.compile(r'(?<![\w°º])(?:\.[ \t]?){3,}\.|…{2,}|_{3,}')
+
+# (tipo, etiqueta, rótulo inmediatamente anterior al hueco). Todos dependen de la parte.
+ROTULOS = [
+    ("dni", "DNI", re.compile(
+        r'(D\.?\s?N\.?\s?I\.?|documento(?:\s+nacional\s+de\s+identidad)?)'
+        r'\s*(?:N[°º]\.?|Nro\.?|n[uú]mero)?\s*:?\s*$', re.I)),
+    ("cuit", "CUIT/CUIL", re.compile(
+        r'(C\.?\s?U\.?\s?I\.?\s?[TL]\.?)\s*(?:N[°º]\.?|Nro\.?)?\s*:?\s*$', re.I)),
+    ("domicilio", "Domicilio", re.compile(
+        r'(domicilio|domiciliad[oa]s?)(?:\s+(?:real|legal|especial|constituido))?'
+        r'(?:\s+en)?(?:\s+(?:la\s+)?calle)?\s*:?\s*$', re.I)),
+    ("nombre", "Nombre completo", re.compile(
+        r'(Sr\.|Sra\.|Srta\.|se[nñ]or(?:a)?|nombre(?:\s+y\s+apellido)?|apellido\s+y\s+nombres?)\s*:?\s*$', re.I)),
+    ("telefono", "Teléfono", re.compile(
+        r'(tel[eé]fono|tel\.|celular)\s*(?:N[°º]\.?)?\s*:?\s*$', re.I)),
+    ("email", "Correo electrónico", re.compile(
+        r'(e-?mail|correo\s+electr[oó]nico)\s*:?\s*$', re.I)),
+]
+
+ROL_RE = re.compile(
+    r'\b(LOCADOR(?:A|ES|AS)?|LOCATARI[OA]S?|GARANTES?|FIADOR(?:A|ES|AS)?|CODEUDOR(?:A|ES|AS)?)\b', re.I)
+EN_ADELANTE_RE = re.compile(r'en\s+adelante[^.;\n]{0,40}?' + ROL_RE.pattern, re.I)
+# Fin de oración: ';', salto de línea o punto seguido de mayúscula (salvo abreviaturas)
+FIN_ORACION_RE = re.compile(
+    r';|\n|(?<!\bSr)(?<!\bSra)(?<!\bSrta)(?<!\bDr)(?<!\bDra)(?<![Nnº°])\.\s+(?=[A-ZÁÉÍÓÚÑ"«])')
+
+
+@dataclass
+class Pendiente:
+    """Hueco que el detector no pudo etiquetar: se manda al LLM sólo su contexto."""
+    id: int
+    placeholder_text: str
+    contexto: str
+    tipo: str = "texto"
+    rol: str = ""
+    keep_prefix: int = 0
+    keep_suffix: int = 0
+
+
+@dataclass
+class Deteccion:
+    orden: list = field(default_factory=list)   # variables (dict) y Pendientes, en orden de aparición
+    pendientes: list[Pendiente] = field(default_factory=list)
+
+    @property
+    def resueltas(self) -> list[dict]:
+        return [item for item in self.orden if isinstance(item, dict)]
+
+
+def _sin_acentos(texto: str) -> str:
+    return "".join(c for c in unicodedata.normalize("NFD", texto) if unicodedata.category(c) != "Mn")
+
+
+def _camel(texto: str) -> str:
+    texto = texto.strip()
+    if re.fullmatch(r'[A-Za-z][A-Za-z0-9]*', texto) and not texto.isupper():
+        return texto[0].lower() + texto[1:]   # ya viene en camelCase
+    palabras = re.findall(r'[A-Za-z0-9]+', _sin_acentos(texto))
+    if not palabras:
+        return "campo"
+    return palabras[0].lower() + "".join(p.capitalize() for p in palabras[1:])
+
+
+def _rol_canonico(rol: str) -> str:
+    rol = rol.lower()
+    if rol.startswith("locador"):
+        return "locador"
+    if rol.startswith("locatari"):
+        return "locatario"
+    return "garante"
+
+
+def _tipo_por_nombre(nombre: str) -> str:
+    n = _sin_acentos(nombre).lower()
+    for tipo, claves in (("dni", ("dni", "documento")), ("cuit", ("cuit", "cuil")),
+                         ("monto", ("monto", "precio", "canon", "importe", "deposito")),
+                         ("fecha", ("fecha", "dia", "mes", "anio")),
+                         ("domicilio", ("domicilio", "direccion"))):
+        if any(c in n for c in claves):
+            return tipo
+    return "texto"
+
+
+def _rol_del_hueco(enmascarado: str, inicio: int, fin: int) -> str:
+    """
+    Parte a la que pertenece un hueco: la del próximo "en adelante EL X" dentro
+    de la misma oración o, si no hay, la última mencionada antes en esa oración.
+    """
+    ini_oracion = 0
+    for m in FIN_ORACION_RE.finditer(enmascarado, max(0, inicio - 400), inicio):
+        ini_oracion = m.end()
+    fin_oracion = FIN_ORACION_RE.search(enmascarado, fin)
+    fin_oracion = fin_oracion.start() if fin_oracion else len(enmascarado)
+
+    adelante = EN_ADELANTE_RE.search(enmascarado, fin, min(fin_oracion, fin + 400))
+    if adelante:
+        return _rol_canonico(adelante.group(1))
+    previos = list(ROL_RE.finditer(enmascarado, ini_oracion, inicio))
+    if previos:
+        return _rol_canonico(previos[-1].group(1))
+    return ""
+
+
+def _fragmento_unico(texto: str, inicio_frag: int, inicio: int, fin: int,
+                     limite: int, limite_der: int) -> tuple[str, int, int]:
+    """
+    Placeholder del hueco: se le agrega texto literal alrededor (de a una
+    palabra, primero hacia atrás y después hacia adelante, sin tocar otras
+    marcas) hasta que aparece una sola vez en el contrato. Devuelve el
+    fragmento y cuántos caracteres iniciales y finales son contexto a
+    conservar (`keep_prefix`, `keep_suffix`).
+    """
+    ini, fin_frag = inicio_frag, fin
+
+    def unico():
+        return texto.count(texto[ini:fin_frag]) == 1
+
+    while not unico() and ini > limite and inicio_frag - ini < CONTEXTO_UNICO_CHARS:
+        j = ini
+        while j > limite and texto[j - 1].isspace():
+            j -= 1
+        while j > limite and not texto[j - 1].isspace():
+            j -= 1
+        ini = j
+    while texto[ini].isspace():
+        ini += 1
+
+    while not unico() and fin_frag < limite_der and fin_frag - fin < CONTEXTO_UNICO_CHARS:
+        j = fin_frag
+        while j < limite_der and texto[j].isspace():
+            j += 1
+        while j < limite_der and not texto[j].isspace():
+            j += 1
+        fin_frag = j
+    while fin_frag > fin and texto[fin_frag - 1].isspace():
+        fin_frag -= 1
+
+    return texto[ini:fin_frag], inicio - ini, fin_frag - fin
+
+
+def _contexto(texto: str, inicio: int, fin: int) -> str:
+    antes = texto[max(0, inicio - CONTEXTO_CHARS):inicio]
+    despues = texto[fin:fin + CONTEXTO_CHARS]
+    return " ".join(f"{antes}⟦{texto[inicio:fin]}⟧{despues}".split())
+
+
+def detectar_variables(texto: str) -> Deteccion:
+    """Detecta los huecos del contrato; ver docstring del módulo."""
+    resultado = Deteccion()
+
+    # Explícitos: un mismo marcador repetido es una sola variable (replace_all)
+    explicitos = {}
+    for m in EXPLICITO_RE.finditer(texto):
+        nombre = next(g for g in m.groups() if g)
+        if m.group(0) in explicitos:
+            continue
+        var = {
+            "key": _camel(nombre),
+            "label": nombre.replace("_", " ").strip().capitalize(),
+            "placeholder_text": m.group(0),
+            "type": _tipo_por_nombre(nombre),
+            "description": "",
+            "example": "",
+        }
+        explicitos[m.group(0)] = var
+        resultado.orden.append((m.start(), var))
+
+    # Huecos: se enmascaran para que sus puntos no corten oraciones
+    huecos = list(HUECO_RE.finditer(texto))
+    enmascarado = list(texto)
+    for m in huecos:
+        enmascarado[m.start():m.end()] = "#" * (m.end() - m.start())
+    enmascarado = "".join(enmascarado)
+
+    # Límites de las otras marcas: el contexto de un hueco no las incluye
+    marcas = sorted([m.span() for m in huecos] + [m.span() for m in EXPLICITO_RE.finditer(texto)])
+
+    for m in huecos:
+        inicio, fin = m.span()
+        limite = max((f for _, f in marcas if f <= inicio), default=0)
+        limite_der = min((i for i, _ in marcas if i >= fin), default=len(texto))
+        previo = texto[max(0, inicio - 60):inicio]
+        tipo, etiqueta, inicio_frag = "texto", "", inicio
+        for t, et, rx in ROTULOS:
+            r = rx.search(previo)
+            if r:
+                tipo, etiqueta = t, et
+                inicio_frag = inicio - (len(previo) - r.start())
+                break
+
+        inicio_frag = max(inicio_frag, limite)
+        fragmento, keep_prefix, keep_suffix = _fragmento_unico(
+            texto, inicio_frag, inicio, fin, limite, limite_der)
+        rol = _rol_del_hueco(enmascarado, inicio, fin) if etiqueta else ""
+
+        if etiqueta and rol:
+            var = {
+                "key": tipo + rol.capitalize(),
+                "label": f"{etiqueta} del {rol.capitalize()}",
+                "placeholder_text": fragmento,
+                "type": tipo,
+                "description": "",
+                "example": "",
+                "replace_all": False,
+                # El rótulo y el contexto alrededor de los puntos se conservan
+                "keep_prefix": keep_prefix,
+                "keep_suffix": keep_suffix,
+            }
+            resultado.orden.append((inicio_frag, var))
+        else:
+            pendiente = Pendiente(
+                id=len(resultado.pendientes) + 1,
+                placeholder_text=fragmento,
+                contexto=_contexto(texto, inicio_frag, fin),
+                tipo=tipo,
+                rol=rol,
+                keep_prefix=keep_prefix,
+                keep_suffix=keep_suffix,
+            )
+            resultado.pendientes.append(pendiente)
+            resultado.orden.append((inicio_frag, pendiente))
+
+    resultado.orden = [item for _, item in sorted(resultado.orden, key=lambda x: x[0])]
+    return resultado
+
+
+def variables_en_orden(deteccion: Deteccion, clasificadas: dict[int, dict]) -> list[dict]:
+    """
+    Une las variables locales con las que clasificó el LLM (id de pendiente →
+    {key, label, type}), en orden de aparición y con keys únicas.
+    """
+    usadas: set[str] = set()
+    salida = []
+    for item in deteccion.orden:
+        if isinstance(item, Pendiente):
+            info = clasificadas.get(item.id) or {}
+            var = {
+                "key": _camel(str(info.get("key") or f"campo{item.id}")),
+                "label": info.get("label") or f"Campo {item.id}",
+                "placeholder_text": item.placeholder_text,
+                "type": info.get("type") or item.tipo,
+                "description": info.get("description", ""),
+                "example": "",
+                "replace_all": False,
+                "keep_prefix": item.keep_prefix,
+                "keep_suffix": item.keep_suffix,
+            }
+        else:
+            var = dict(item)
+        base, n = var["key"], 1
+        while var["key"] in usadas:
+            n += 1
+            var["key"] = f"{base}{n}"
+        usadas.add(var["key"])
+        salida.append(var)
+    return salida
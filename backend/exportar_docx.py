@@ -0,0 +1,157 @@
+"""
+Exportación del contrato a .docx.
+
+El esqueleto (márgenes, fuente y estilos de párrafo con nombre) se arma una
+sola vez al iniciar. Cada exportación sólo genera word/document.xml con un
+párrafo por línea que referencia esos estilos (sin formato run por run) y lo
+agrega al zip del esqueleto en modo append: el resto de las partes
+(styles.xml, theme, etc.) no se vuelve a comprimir.
+
+Los textos ya renderizados por /api/generate quedan en CachePreviews bajo un
+hash de su contenido, para que /api/export-docx no tenga que recalcularlos.
+El .docx resultante se guarda en el almacén de artefactos (shared/artifact_store.py).
+"""
+
+import hashlib
+import io
+import re
+import threading
+import zipfile
+from collections import OrderedDict
+from typing import Optional
+from xml.sax.saxutils import escape
+
+from docx import Document
+from docx.enum.style import WD_STYLE_TYPE
+from docx.enum.text import WD_ALIGN_PARAGRAPH
+from docx.shared import Inches, Pt
+
+DOCUMENT_PART = "word/document.xml"
+# Cambiarla si cambia el formato de salida: invalida los .docx ya guardados
+EXPORT_VERSION = "1"
+
+TITULO_RE = re.compile(r'^(?:(?:CLÁUSULA|ARTÍCULO|Cláusula|Artículo|TÍTULO|Título)\s+\w+|\d+[\.\-]\s+[A-Z])')
+# Caracteres de control que no pueden ir en XML
+_XML_INVALIDO_RE = re.compile(r'[\x00-\x08\x0b\x0c\x0e-\x1f]')
+
+
+def _crear_esqueleto() -> tuple[bytes, str, str, dict[str, str]]:
+    """
+    Devuelve (zip sin document.xml, XML previo al cuerpo, XML posterior,
+    ids de estilo por clave).
+    """
+    doc = Document()
+
+    normal = doc.styles['Normal']
+    normal.font.name = 'Times New Roman'
+    normal.font.size = Pt(11)
+    normal.paragraph_format.space_after = Pt(6)
+
+    for section in doc.sections:
+        section.top_margin = Inches(1)
+        section.bottom_margin = Inches(1)
+        section.left_margin = Inches(1.2)
+        section.right_margin = Inches(1.2)
+
+    texto = doc.styles.add_style('Contrato Texto', WD_STYLE_TYPE.PARAGRAPH)
+    texto.base_style = normal
+    texto.paragraph_format.alignment = WD_ALIGN_PARAGRAPH.JUSTIFY
+    texto.paragraph_format.first_line_indent = Inches(0.3)
+
+    titulo = doc.styles.add_style('Contrato Titulo', WD_STYLE_TYPE.PARAGRAPH)
+    titulo.base_style = normal
+    titulo.font.bold = True
+    titulo.paragraph_format.alignment = WD_ALIGN_PARAGRAPH.LEFT
+
+    centrado = doc.styles.add_style('Contrato Titulo Centrado', WD_STYLE_TYPE.PARAGRAPH)
+    centrado.base_style = titulo
+    centrado.paragraph_format.alignment = WD_ALIGN_PARAGRAPH.CENTER
+
+    buffer = io.BytesIO()
+    doc.save(buffer)
+
+    origen = zipfile.ZipFile(io.BytesIO(buffer.getvalue()))
+    document_xml = origen.read(DOCUMENT_PART).decode("utf-8")
+    corte = document_xml.index("<w:sectPr")
+
+    sin_documento = io.BytesIO()
+    with zipfile.ZipFile(sin_documento, "w", zipfile.ZIP_DEFLATED) as destino:
+        for info in origen.infolist():
+            if info.filename != DOCUMENT_PART:
+                destino.writestr(info, origen.read(info.filename))
+
+    estilos = {"texto": texto.style_id, "titulo": titulo.style_id, "centrado": centrado.style_id}
+    return sin_documento.getvalue(), document_xml[:corte], document_xml[corte:], estilos
+
+
+_ESQUELETO, _XML_INICIO, _XML_FIN, _ESTILOS = _crear_esqueleto()
+
+
+def _es_titulo(linea: str) -> bool:
+    return (
+        linea.isupper()
+        or TITULO_RE.match(linea) is not None
+        or (len(linea) < 80 and linea.endswith(':'))
+    )
+
+
+def _parrafo_xml(linea: str) -> str:
+    if not linea:
+        return "<w:p/>"
+    if _es_titulo(linea):
+        estilo = _ESTILOS["centrado"] if linea.isupper() else _ESTILOS["titulo"]
+    else:
+        estilo = _ESTILOS["texto"]
+    texto = escape(_XML_INVALIDO_RE.sub("", linea))
+    return (f'<w:p><w:pPr><w:pStyle w:val="{estilo}"/></w:pPr>'
+            f'<w:r><w:t xml:space="preserve">{texto}</w:t></w:r></w:p>')
+
+
+def construir_docx(contract_text: str) -> bytes:
+    """Arma el .docx del contrato sobre el esqueleto precargado."""
+    cuerpo = "".join(_parrafo_xml(linea.strip()) for linea in contract_text.split('\n'))
+    buffer = io.BytesIO(_ESQUELETO)
+    buffer.seek(0, io.SEEK_END)
+    with zipfile.ZipFile(buffer, "a", zipfile.ZIP_DEFLATED) as zf:
+        zf.writestr(DOCUMENT_PART, _XML_INICIO + cuerpo + _XML_FIN)
+    return buffer.getvalue()
+
+
+def hash_preview(texto: str) -> str:
+    return hashlib.sha256(texto.encode("utf-8")).hexdigest()[:32]
+
+
+class CachePreviews:
+    """Textos de contrato ya renderizados, en un LRU en memoria acotado por bytes."""
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self._textos: OrderedDict[str, str] = OrderedDict()
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def guardar(self, texto: str) -> str:
+        preview_id = hash_preview(texto)
+        with self._lock:
+            if preview_id in self._textos:
+                self._textos.move_to_end(preview_id)
+            else:
+                self._textos[preview_id] = texto
+                self._bytes += len(texto) * 2
+                # Nunca se descarta la entrada recién agregada
+                while self._bytes > self.max_bytes and len(self._textos) > 1:
+                    _, viejo = self._textos.popitem(last=False)
+                    self._bytes -= len(viejo) * 2
+        return preview_id
+
+    def obtener(self, preview_id: str) -> Optional[str]:
+        with self._lock:
+            texto = self._textos.get(preview_id)
+            if texto is not None:
+                self._textos.move_to_end(preview_id)
+                self.hits += 1
+            else:
+                self.misses += 1
+            return texto
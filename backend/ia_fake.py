@@ -0,0 +1,176 @@
+"""
+Proveedor de IA falso (AI_PROVIDER=fake) para pruebas de carga sin gastar API.
+
+Responde con respuestas grabadas (AI_FAKE_RESPUESTAS) o, si ninguna aplica,
+con plantillas que imitan lo que devuelve el modelo en cada endpoint:
+- clasificación de fragmentos del detector (/api/analyze),
+- análisis completo con huecos "....." / "____" (/api/analyze sin detector),
+- entrevista del chat: toma el último mensaje del usuario como valor de la
+  primera variable pendiente y pregunta por la siguiente.
+
+La latencia sale de una distribución configurable (AI_FAKE_LATENCIA):
+    fija:300                 300 ms
+    uniforme:200,1200        entre 200 y 1200 ms
+    normal:800,150           media 800 ms, desvío 150 ms
+    lognormal:800,0.5        mediana 800 ms, sigma 0.5 (colas largas, como una API real)
+En streaming esa latencia es la del primer fragmento y el resto llega a
+AI_FAKE_TOKENS_POR_SEG. AI_FAKE_ERRORES es la fracción de llamadas que fallan.
+"""
+
+import asyncio
+import json
+import math
+import os
+import random
+import re
+from pathlib import Path
+from typing import AsyncIterator, Optional
+
+HUECO_RE = re.compile(r'\.{4,}|_{4,}|…{2,}')
+FRAGMENTO_RE = re.compile(r'^(\d+):', re.MULTILINE)
+PENDIENTE_SESION_RE = re.compile(r'^- ([^:\n]+): ([^\n\[(]+)', re.MULTILINE)
+
+
+class ErrorFake(Exception):
+    """Falla simulada del proveedor (AI_FAKE_ERRORES)."""
+
+
+class LatenciaFake:
+    def __init__(self, spec: str, rng: random.Random):
+        self.spec = spec
+        self._rng = rng
+        tipo, _, params = spec.partition(":")
+        self.tipo = tipo.strip().lower()
+        self.params = [float(p) for p in params.split(",") if p.strip()]
+        if self.tipo not in ("fija", "uniforme", "normal", "lognormal") or not self.params:
+            raise ValueError(f"AI_FAKE_LATENCIA inválida: {spec!r}")
+
+    def muestra(self) -> float:
+        """Segundos de espera para una llamada."""
+        p = self.params
+        if self.tipo == "fija":
+            ms = p[0]
+        elif self.tipo == "uniforme":
+            ms = self._rng.uniform(p[0], p[1] if len(p) > 1 else p[0])
+        elif self.tipo == "normal":
+            ms = self._rng.gauss(p[0], p[1] if len(p) > 1 else 0)
+        else:
+            ms = self._rng.lognormvariate(math.log(p[0]), p[1] if len(p) > 1 else 0.5)
+        return max(ms, 0) / 1000
+
+
+def _cargar_respuestas(ruta: Optional[str]) -> list[dict]:
+    """JSON (lista) o JSONL de {"contiene": "...", "respuesta": "..."}."""
+    if not ruta:
+        return []
+    texto = Path(ruta).read_text(encoding="utf-8").strip()
+    if texto.startswith("["):
+        registros = json.loads(texto)
+    else:
+        registros = [json.loads(linea) for linea in texto.splitlines() if linea.strip()]
+    return [r for r in registros if "respuesta" in r]
+
+
+def _pendientes_chat(system_prompt: str) -> list[tuple[str, str]]:
+    """(key, label) de las variables pendientes, del prompt con o sin sesión."""
+    if "VARIABLES PENDIENTES" in system_prompt:
+        bloque = system_prompt.split("VARIABLES PENDIENTES", 1)[1].split("INSTRUCCIONES:", 1)[0]
+        bloque = bloque.split("RESUMEN DE LA CONVERSACIÓN", 1)[0]
+        return [(k.strip(), l.strip()) for k, l in PENDIENTE_SESION_RE.findall(bloque)]
+    try:
+        variables = json.loads(system_prompt.split("LISTA DE VARIABLES (TODAS DEBEN SER COMPLETADAS):", 1)[1]
+                               .split("DATOS ACTUALES:", 1)[0])
+        datos = json.loads(system_prompt.split("DATOS ACTUALES:", 1)[1].split("INSTRUCCIONES:", 1)[0])
+    except (IndexError, ValueError):
+        return []
+    return [(v["key"], v.get("label") or v["key"]) for v in variables
+            if isinstance(v, dict) and "key" in v and not datos.get(v["key"])]
+
+
+class ProveedorFake:
+    def __init__(self, latencia: str = "lognormal:800,0.4", respuestas: Optional[str] = None,
+                 tokens_por_segundo: float = 60, tasa_error: float = 0.0, semilla: Optional[int] = None):
+        self._rng = random.Random(semilla)
+        self.latencia = LatenciaFake(latencia, self._rng)
+        self.respuestas = _cargar_respuestas(respuestas)
+        self.tokens_por_segundo = tokens_por_segundo
+        self.tasa_error = tasa_error
+        self.llamadas = 0
+
+    @classmethod
+    def desde_entorno(cls) -> "ProveedorFake":
+        semilla = os.getenv("AI_FAKE_SEMILLA", "").strip()
+        return cls(
+            latencia=os.getenv("AI_FAKE_LATENCIA", "lognormal:800,0.4"),
+            respuestas=os.getenv("AI_FAKE_RESPUESTAS", "").strip() or None,
+            tokens_por_segundo=float(os.getenv("AI_FAKE_TOKENS_POR_SEG", "60")),
+            tasa_error=float(os.getenv("AI_FAKE_ERRORES", "0")),
+            semilla=int(semilla) if semilla else None,
+        )
+
+    def responder(self, system_prompt: str, user_message: str,
+                  messages_history: Optional[list] = None, json_mode: bool = False) -> str:
+        ultimo = user_message or ""
+        if messages_history:
+            # Sólo si el turno trae un mensaje nuevo del usuario
+            ultimo = messages_history[-1]["content"] if messages_history[-1].get("role") == "user" else ""
+
+        consulta = f"{system_prompt}\n{ultimo}"
+        for r in self.respuestas:
+            if r.get("contiene", "") in consulta:
+                return r["respuesta"] if isinstance(r["respuesta"], str) else json.dumps(r["respuesta"])
+
+        if "Clasifica estos fragmentos" in ultimo:
+            ids = FRAGMENTO_RE.findall(user_message.split("\n\n", 1)[-1])
+            return json.dumps({"variables": [
+                {"id": int(i), "key": f"dato{i}", "label": f"Dato {i}", "type": "texto"} for i in ids
+            ]})
+
+        if "Analiza este contrato" in ultimo:
+            huecos = list(dict.fromkeys(HUECO_RE.findall(ultimo)))
+            return json.dumps({
+                "variables": [{"key": f"dato{i}", "label": f"Dato {i}", "placeholder_text": h, "type": "texto"}
+                              for i, h in enumerate(huecos, 1)],
+                "analysis_notes": "Respuesta del proveedor fake",
+            }, ensure_ascii=False)
+
+        if '"reply"' in system_prompt:
+            pendientes = _pendientes_chat(system_prompt)
+            extraidos = {}
+            if ultimo and pendientes:
+                extraidos[pendientes[0][0]] = ultimo
+                pendientes = pendientes[1:]
+            reply = f"Gracias. ¿Cuál es el dato: {pendientes[0][1]}?" if pendientes else \
+                "Perfecto, ya tengo todos los datos del contrato."
+            return json.dumps({
+                "reply": reply,
+                "extracted_data": extraidos,
+                "is_complete": not pendientes,
+                "next_variable_key": pendientes[0][0] if pendientes else None,
+            }, ensure_ascii=False)
+
+        return "{}" if json_mode else "OK"
+
+    def _quizas_fallar(self):
+        if self.tasa_error and self._rng.random() < self.tasa_error:
+            raise ErrorFake("Error simulado del proveedor fake")
+
+    async def llamar(self, system_prompt: str, user_message: str,
+                     messages_history: Optional[list] = None, json_mode: bool = False) -> str:
+        self.llamadas += 1
+        await asyncio.sleep(self.latencia.muestra())
+        self._quizas_fallar()
+        return self.responder(system_prompt, user_message, messages_history, json_mode)
+
+    async def stream(self, system_prompt: str, user_message: str,
+                     messages_history: Optional[list] = None, json_mode: bool = False) -> AsyncIterator[str]:
+        self.llamadas += 1
+        texto = self.responder(system_prompt, user_message, messages_history, json_mode)
+        await asyncio.sleep(self.latencia.muestra())
+        self._quizas_fallar()
+        # ~4 caracteres por token
+        pausa = 1 / self.tokens_por_segundo if self.tokens_por_segundo > 0 else 0
+        for i in range(0, len(texto), 4):
+            yield texto[i:i + 4]
+            if pausa:
+                await asyncio.sleep(pausa)
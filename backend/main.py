@@ -6,21 +6,35 @@ Soporta: OpenAI (gpt-4o-mini) y Anthropic Claude
 
 import os
 import re
+import sys
 import json
 import io
-import traceback
-from typing import Any
+import shutil
+import asyncio
+import time
+from typing import Any, AsyncIterator
 from pathlib import Path
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Request
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import FileResponse, StreamingResponse
+from fastapi.responses import FileResponse, Response, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
+from starlette.concurrency import run_in_threadpool
 from pydantic import BaseModel
-from docx import Document
-from docx.shared import Pt, Inches
-from docx.enum.text import WD_ALIGN_PARAGRAPH
 from dotenv import load_dotenv
 
+# Módulos compartidos con v2 (ver shared/)
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from cache_analisis import CacheAnalisis
+from ia_fake import ProveedorFake
+from exportar_docx import EXPORT_VERSION, CachePreviews, construir_docx
+from detector import DETECTOR_VERSION, detectar_variables, variables_en_orden
+from sesiones import AlmacenSesiones, SesionChat
+from sustitucion import Reemplazo, aplicar_reemplazos
+from shared import metrics, profiling, structured_log
+from shared.artifact_store import ArtifactStore, artifact_key, serve_artifact
+from shared.pdf_pool import PdfConversionError, PdfPool, PdfUnavailable
+
 # Imports opcionales de proveedores
 try:
     import anthropic
@@ -28,15 +42,28 @@ except ImportError:
     anthropic = None
 
 try:
-    from openai import OpenAI
+    from openai import AsyncOpenAI
 except ImportError:
-    OpenAI = None
+    AsyncOpenAI = None
+
+try:
+    import httpx
+except ImportError:
+    httpx = None
 
 # Cargar .env con ruta absoluta basada en la ubicación de este archivo (backend/)
 BASE_DIR = Path(__file__).resolve().parent
 ENV_PATH = BASE_DIR / ".env"
 load_dotenv(dotenv_path=ENV_PATH, override=True)
 
+# Logging estructurado, con la escritura fuera del hilo del pedido (ver shared/structured_log.py)
+structured_log.configure("v1")
+log = structured_log.get_logger("api")
+log_analyze = structured_log.get_logger("analyze")
+log_chat = structured_log.get_logger("chat")
+log_generate = structured_log.get_logger("generate")
+log_export = structured_log.get_logger("export")
+
 
 # ─── Configuración unificada de proveedores ───────────────────────────────────
 AI_PROVIDER = os.getenv("AI_PROVIDER", "openai").lower().strip()
@@ -46,12 +73,53 @@ USED_KEY_NAME = "NONE"
 CLEAN_API_KEY = None
 claude_client = None
 openai_client = None
+fake_client = None
 CLAUDE_MODEL = "claude-3-5-sonnet-20240620"
 OPENAI_MODEL = "gpt-4o-mini"
 
+# ─── Pool HTTP compartido para las llamadas a IA ──────────────────────────────
+# Los clientes son asíncronos: un análisis de 30-60 s no ocupa un thread del
+# threadpool de Starlette, sólo una conexión del pool.
+LLM_TIMEOUT = float(os.getenv("LLM_TIMEOUT", "120"))
+LLM_CONNECT_TIMEOUT = float(os.getenv("LLM_CONNECT_TIMEOUT", "10"))
+LLM_MAX_CONNECTIONS = int(os.getenv("LLM_MAX_CONNECTIONS", "200"))
+LLM_MAX_KEEPALIVE = int(os.getenv("LLM_MAX_KEEPALIVE", "50"))
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "2"))
+
+http_client = None
+
+
+def crear_http_client():
+    """Cliente httpx con límites de conexiones y timeouts explícitos, compartido por los SDK."""
+    if not httpx:
+        raise RuntimeError("Instale httpx: pip install httpx")
+    return httpx.AsyncClient(
+        limits=httpx.Limits(
+            max_connections=LLM_MAX_CONNECTIONS,
+            max_keepalive_connections=LLM_MAX_KEEPALIVE,
+            keepalive_expiry=30.0,
+        ),
+        timeout=httpx.Timeout(LLM_TIMEOUT, connect=LLM_CONNECT_TIMEOUT),
+    )
+
+
+def _key_enmascarada() -> str:
+    return f"{CLEAN_API_KEY[:6]}...{CLEAN_API_KEY[-4:]}" if CLEAN_API_KEY and len(CLEAN_API_KEY) > 10 else "N/A"
+
+
 def inicializar_clientes():
-    global claude_client, openai_client, USED_KEY_NAME, CLEAN_API_KEY, CLAUDE_MODEL, OPENAI_MODEL
-    
+    global claude_client, openai_client, fake_client, http_client, USED_KEY_NAME, CLEAN_API_KEY, CLAUDE_MODEL, OPENAI_MODEL
+
+    if AI_PROVIDER == "fake":
+        # Pruebas de carga: respuestas grabadas o de plantilla, sin red (ver ia_fake.py)
+        fake_client = ProveedorFake.desde_entorno()
+        claude_client = openai_client = None
+        log.info("Proveedor fake inicializado", extra={"latencia": fake_client.latencia.spec})
+        return
+
+    if http_client is None:
+        http_client = crear_http_client()
+
     if AI_PROVIDER == "claude":
         if not anthropic:
             raise RuntimeError("Instale anthropic: pip install anthropic")
@@ -65,21 +133,33 @@ def inicializar_clientes():
         CLEAN_API_KEY = api_key.strip() if api_key else None
         CLAUDE_MODEL = os.getenv("CLAUDE_MODEL", "claude-3-5-sonnet-20240620").strip()
         
-        claude_client = anthropic.Anthropic(api_key=CLEAN_API_KEY)
+        claude_client = anthropic.AsyncAnthropic(
+            api_key=CLEAN_API_KEY,
+            http_client=http_client,
+            timeout=http_client.timeout,
+            max_retries=LLM_MAX_RETRIES,
+        )
         openai_client = None
-        print(f"[OK] Cliente Claude inicializado ({CLAUDE_MODEL})")
+        log.info("Cliente Claude inicializado", extra={"modelo": CLAUDE_MODEL, "variable_key": USED_KEY_NAME,
+                                                        "key": _key_enmascarada()})
     else:
-        if not OpenAI:
+        if not AsyncOpenAI:
             raise RuntimeError("Instale openai: pip install openai")
             
         openai_key = os.getenv("OPENAI_API_KEY")
         CLEAN_API_KEY = openai_key.strip() if openai_key else None
         USED_KEY_NAME = "OPENAI_API_KEY"
         
-        openai_client = OpenAI(api_key=CLEAN_API_KEY)
+        openai_client = AsyncOpenAI(
+            api_key=CLEAN_API_KEY,
+            http_client=http_client,
+            timeout=http_client.timeout,
+            max_retries=LLM_MAX_RETRIES,
+        )
         OPENAI_MODEL = os.getenv("OPENAI_MODEL", "gpt-4o-mini").strip()
         claude_client = None
-        print(f"[OK] Cliente OpenAI inicializado ({OPENAI_MODEL})")
+        log.info("Cliente OpenAI inicializado", extra={"modelo": OPENAI_MODEL, "variable_key": USED_KEY_NAME,
+                                                        "key": _key_enmascarada()})
 
 # Inicialización al arranque
 inicializar_clientes()
@@ -87,73 +167,231 @@ inicializar_clientes()
 
 # ─── Función unificada de llamada a IA ───────────────────────────────────────
 
-def llamar_ia(system_prompt: str, user_message: str,
+LLM_DURACION = metrics.REGISTRY.histogram(
+    "llm_request_duration_seconds", "Duración de las llamadas a la IA",
+    ("provider", "model", "mode"), metrics.LLM_BUCKETS)
+LLM_PRIMER_FRAGMENTO = metrics.REGISTRY.histogram(
+    "llm_stream_first_chunk_seconds", "Tiempo hasta el primer fragmento en streaming",
+    ("provider", "model"), metrics.LLM_BUCKETS)
+LLM_ERRORES = metrics.REGISTRY.counter(
+    "llm_errors_total", "Llamadas a la IA que fallaron", ("provider", "model", "error"))
+LLM_EN_CURSO = metrics.REGISTRY.gauge(
+    "llm_requests_in_flight", "Llamadas a la IA en curso", ("provider",))
+
+
+def _tipo_error(e: Exception) -> str:
+    return f"http_{e.status_code}" if isinstance(e, HTTPException) else type(e).__name__
+
+
+def _kwargs_claude(system_prompt: str, user_message: str, messages_history: list,
+                   json_mode: bool, temperature: float) -> dict:
+    msgs = []
+    if messages_history:
+        for m in messages_history:
+            msgs.append({"role": m["role"], "content": m["content"]})
+    else:
+        msgs.append({"role": "user", "content": user_message})
+
+    if json_mode:
+        system_prompt += "\n\nIMPORTANTE: Responde ÚNICAMENTE con JSON válido, sin texto adicional."
+
+    if not claude_client:
+         raise HTTPException(status_code=500, detail="El cliente de Claude no ha sido inicializado. Verifique su API Key.")
+
+    return {
+        "model": CLAUDE_MODEL,
+        "max_tokens": 8192,
+        "system": system_prompt,
+        "messages": msgs,
+        "temperature": temperature,
+    }
+
+
+def _error_claude(e: Exception) -> HTTPException:
+    # Manejo dinámico de excepciones de Anthropic sin depender del import estático
+    err_type = type(e).__name__
+    if err_type == 'NotFoundError':
+        return HTTPException(
+            status_code=404,
+            detail=f"Modelo '{CLAUDE_MODEL}' no encontrado o no habilitado para esta API Key. "
+                   "Verifique CLAUDE_MODEL en su .env."
+        )
+    elif err_type == 'AuthenticationError':
+        return HTTPException(
+            status_code=401,
+            detail="Error de autenticación con Anthropic. Verifique su API Key en el archivo .env."
+        )
+    return HTTPException(status_code=500, detail=f"Error en llamada a Claude: {str(e)}")
+
+
+def _kwargs_openai(system_prompt: str, user_message: str, messages_history: list,
+                   json_mode: bool, temperature: float) -> dict:
+    msgs = [{"role": "system", "content": system_prompt}]
+    if messages_history:
+        msgs.extend(messages_history)
+    else:
+        msgs.append({"role": "user", "content": user_message})
+
+    kwargs = {
+        "model": OPENAI_MODEL,
+        "messages": msgs,
+        "temperature": temperature,
+    }
+    if json_mode:
+        kwargs["response_format"] = {"type": "json_object"}
+    return kwargs
+
+
+async def llamar_ia(system_prompt: str, user_message: str,
               messages_history: list = None,
               json_mode: bool = False,
               temperature: float = 0.2) -> str:
     """
-    Llama al proveedor configurado (OpenAI o Claude) y devuelve el texto.
+    Llama al proveedor configurado (OpenAI, Claude o fake) y devuelve el texto.
     """
-    if AI_PROVIDER == "claude":
-        # ── Claude ──
-        msgs = []
-        if messages_history:
-            for m in messages_history:
-                msgs.append({"role": m["role"], "content": m["content"]})
-        else:
-            msgs.append({"role": "user", "content": user_message})
+    modelo = modelo_activo()
+    LLM_EN_CURSO.inc(AI_PROVIDER)
+    inicio = time.perf_counter()
+    try:
+        return await _llamar_proveedor(system_prompt, user_message, messages_history, json_mode, temperature)
+    except Exception as e:
+        LLM_ERRORES.inc(AI_PROVIDER, modelo, _tipo_error(e))
+        raise
+    finally:
+        LLM_EN_CURSO.dec(AI_PROVIDER)
+        LLM_DURACION.observe(time.perf_counter() - inicio, AI_PROVIDER, modelo, "completo")
 
-        if json_mode:
-            system_prompt += "\n\nIMPORTANTE: Responde ÚNICAMENTE con JSON válido, sin texto adicional."
 
-        if not claude_client:
-             raise HTTPException(status_code=500, detail="El cliente de Claude no ha sido inicializado. Verifique su API Key.")
+async def _llamar_proveedor(system_prompt: str, user_message: str, messages_history: list,
+                            json_mode: bool, temperature: float) -> str:
+    if AI_PROVIDER == "fake":
+        return await fake_client.llamar(system_prompt, user_message, messages_history, json_mode)
 
+    if AI_PROVIDER == "claude":
+        kwargs = _kwargs_claude(system_prompt, user_message, messages_history, json_mode, temperature)
         try:
-            response = claude_client.messages.create(
-                model=CLAUDE_MODEL,
-                max_tokens=8192,
-                system=system_prompt,
-                messages=msgs,
-                temperature=temperature
-            )
+            response = await claude_client.messages.create(**kwargs)
             return response.content[0].text
         except Exception as e:
-            # Manejo dinámico de excepciones de Anthropic sin depender del import estático
-            err_type = type(e).__name__
-            if err_type == 'NotFoundError':
-                raise HTTPException(
-                    status_code=404, 
-                    detail=f"Modelo '{CLAUDE_MODEL}' no encontrado o no habilitado para esta API Key. "
-                           "Verifique CLAUDE_MODEL en su .env."
-                )
-            elif err_type == 'AuthenticationError':
-                raise HTTPException(
-                    status_code=401,
-                    detail="Error de autenticación con Anthropic. Verifique su API Key en el archivo .env."
-                )
-            raise HTTPException(status_code=500, detail=f"Error en llamada a Claude: {str(e)}")
+            raise _error_claude(e)
 
     else:
-        # ── OpenAI ──
-        msgs = [{"role": "system", "content": system_prompt}]
-        if messages_history:
-            msgs.extend(messages_history)
-        else:
-            msgs.append({"role": "user", "content": user_message})
-
-        kwargs = {
-            "model": OPENAI_MODEL,
-            "messages": msgs,
-            "temperature": temperature,
-        }
-        if json_mode:
-            kwargs["response_format"] = {"type": "json_object"}
-
-        response = openai_client.chat.completions.create(**kwargs)
+        kwargs = _kwargs_openai(system_prompt, user_message, messages_history, json_mode, temperature)
+        response = await openai_client.chat.completions.create(**kwargs)
         return response.choices[0].message.content
 
 
+async def llamar_ia_stream(system_prompt: str, user_message: str,
+                           messages_history: list = None,
+                           json_mode: bool = False,
+                           temperature: float = 0.2) -> AsyncIterator[str]:
+    """
+    Igual que llamar_ia, pero devuelve los fragmentos de texto a medida que
+    el proveedor los genera.
+    """
+    modelo = modelo_activo()
+    LLM_EN_CURSO.inc(AI_PROVIDER)
+    inicio = time.perf_counter()
+    primero = True
+    try:
+        async for fragmento in _stream_proveedor(system_prompt, user_message, messages_history,
+                                                 json_mode, temperature):
+            if primero:
+                LLM_PRIMER_FRAGMENTO.observe(time.perf_counter() - inicio, AI_PROVIDER, modelo)
+                primero = False
+            yield fragmento
+    except Exception as e:
+        LLM_ERRORES.inc(AI_PROVIDER, modelo, _tipo_error(e))
+        raise
+    finally:
+        LLM_EN_CURSO.dec(AI_PROVIDER)
+        LLM_DURACION.observe(time.perf_counter() - inicio, AI_PROVIDER, modelo, "stream")
+
+
+async def _stream_proveedor(system_prompt: str, user_message: str, messages_history: list,
+                            json_mode: bool, temperature: float) -> AsyncIterator[str]:
+    if AI_PROVIDER == "fake":
+        async for fragmento in fake_client.stream(system_prompt, user_message, messages_history, json_mode):
+            yield fragmento
+        return
+
+    if AI_PROVIDER == "claude":
+        kwargs = _kwargs_claude(system_prompt, user_message, messages_history, json_mode, temperature)
+        try:
+            async with claude_client.messages.stream(**kwargs) as stream:
+                async for text in stream.text_stream:
+                    yield text
+        except Exception as e:
+            raise _error_claude(e)
+
+    else:
+        kwargs = _kwargs_openai(system_prompt, user_message, messages_history, json_mode, temperature)
+        stream = await openai_client.chat.completions.create(stream=True, **kwargs)
+        async for chunk in stream:
+            if chunk.choices and chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content
+
+
+class ExtractorCampoJSON:
+    """
+    Extrae incrementalmente el valor de un campo string de un objeto JSON que
+    llega por partes (ej. "reply"), decodificando los escapes a medida que
+    aparecen. `feed` devuelve el texto nuevo del campo en cada fragmento.
+    """
+
+    _ESCAPES = {'"': '"', '\\': '\\', '/': '/', 'b': '\b', 'f': '\f', 'n': '\n', 'r': '\r', 't': '\t'}
+
+    def __init__(self, campo: str):
+        self._inicio = re.compile(r'"%s"\s*:\s*"' % re.escape(campo))
+        self._buffer = ""
+        self._pos = None      # posición del próximo carácter del valor en _buffer
+        self.terminado = False
+
+    def feed(self, fragmento: str) -> str:
+        self._buffer += fragmento
+        if self.terminado:
+            return ""
+        if self._pos is None:
+            m = self._inicio.search(self._buffer)
+            if not m:
+                return ""
+            self._pos = m.end()
+
+        salida = []
+        buf, i = self._buffer, self._pos
+        while i < len(buf):
+            c = buf[i]
+            if c == '"':
+                self.terminado = True
+                i += 1
+                break
+            if c != '\\':
+                salida.append(c)
+                i += 1
+                continue
+            # Escape: esperar a tenerlo completo antes de decodificarlo
+            if i + 1 >= len(buf):
+                break
+            if buf[i + 1] == 'u':
+                if i + 6 > len(buf):
+                    break
+                codigo = int(buf[i + 2:i + 6], 16)
+                if 0xD800 <= codigo < 0xDC00:
+                    # Par sustituto (ej. emoji): decodificar las dos mitades juntas
+                    if i + 12 > len(buf):
+                        break
+                    salida.append(json.loads('"%s"' % buf[i:i + 12]))
+                    i += 12
+                else:
+                    salida.append(chr(codigo))
+                    i += 6
+            else:
+                salida.append(self._ESCAPES.get(buf[i + 1], buf[i + 1]))
+                i += 2
+        self._pos = i
+        return "".join(salida)
+
+
 def parsear_json(texto: str) -> dict:
     """Parsea JSON de la respuesta, tolerando texto alrededor."""
     texto = texto.strip()
@@ -191,6 +429,25 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+# Perfilado opt-in: sólo los pedidos con `X-Profile: <PROFILING_TOKEN>` (ver shared/profiling.py)
+PROFILING_TOKEN = os.getenv("PROFILING_TOKEN", "").strip()
+if PROFILING_TOKEN:
+    app.add_middleware(
+        profiling.ProfilingMiddleware,
+        token=PROFILING_TOKEN,
+        directory=Path(os.getenv("PROFILING_DIR", str(BASE_DIR / "cache" / "perfiles"))),
+        top=int(os.getenv("PROFILING_TOP", "25")),
+    )
+# Id de correlación por pedido y línea de acceso (ver shared/structured_log.py)
+app.add_middleware(structured_log.CorrelationMiddleware)
+# Latencia y pedidos en curso para /metrics (ver shared/metrics.py)
+app.add_middleware(metrics.MetricsMiddleware)
+
+@app.on_event("shutdown")
+async def cerrar_http_client():
+    if http_client is not None:
+        await http_client.aclose()
+
 
 frontend_path = os.path.join(os.path.dirname(__file__), "..", "frontend")
 if os.path.exists(frontend_path):
@@ -221,6 +478,17 @@ class ChatResponse(BaseModel):
     is_complete: bool
     next_variable: str | None = None
 
+class ChatSessionRequest(BaseModel):
+    variables: list[dict]
+    collected_data: dict[str, Any] = {}
+    messages: list[ChatMessage] = []
+
+class ChatSessionResponse(BaseModel):
+    session_id: str
+
+class ChatTurnRequest(BaseModel):
+    message: str | None = None
+
 class GenerateRequest(BaseModel):
     contract_template: str
     variables: list[dict]
@@ -229,6 +497,14 @@ class GenerateRequest(BaseModel):
 class GenerateResponse(BaseModel):
     contract_preview: str
     variables_applied: int
+    preview_id: str | None = None   # para /api/export-docx sin reenviar la plantilla
+
+class ExportRequest(BaseModel):
+    preview_id: str | None = None
+    format: str = "docx"            # "docx" o "pdf"
+    contract_template: str = ""
+    variables: list[dict] = []
+    collected_data: dict[str, Any] = {}
 
 
 # ─── Endpoints ───────────────────────────────────────────────────────────────
@@ -240,28 +516,11 @@ async def info():
     """Devuelve el proveedor de IA activo."""
     return {
         "provider": AI_PROVIDER,
-        "model": CLAUDE_MODEL if AI_PROVIDER == "claude" else OPENAI_MODEL
+        "model": modelo_activo()
     }
 
 
-@app.post("/api/analyze", response_model=AnalyzeResponse)
-def analyze_contract(request: AnalyzeRequest):
-    """
-    Analiza el texto del contrato y detecta variables a completar.
-    """
-    # Logs seguros de diagnóstico en cada llamada
-    masked_key = f"{CLEAN_API_KEY[:6]}...{CLEAN_API_KEY[-4:]}" if CLEAN_API_KEY and len(CLEAN_API_KEY) > 10 else "N/A"
-    print(f"\n[DIAGNOSTIC] Llamada a /api/analyze")
-    print(f" - Ruta .env: {ENV_PATH}")
-    print(f" - Proveedor: {AI_PROVIDER}")
-    print(f" - Variable: {USED_KEY_NAME}")
-    print(f" - Key (mask): {masked_key}")
-    print(f" - Modelo: {CLAUDE_MODEL if AI_PROVIDER == 'claude' else OPENAI_MODEL}")
-
-    if not request.contract_text or len(request.contract_text.strip()) < 50:
-        raise HTTPException(status_code=400, detail="El texto del contrato es demasiado corto.")
-
-    system_prompt = """Eres un experto legal argentino. Identifica variables en contratos de alquiler.
+ANALYZE_SYSTEM_PROMPT = """Eres un experto legal argentino. Identifica variables en contratos de alquiler.
 
 BUSCA: Locador, Locatario, Garante, Fiador, DNI, CUIT, Domicilios, Montos, Fechas.
 REGLA: El "placeholder_text" debe ser el fragmento EXACTO del contrato (ej: ".........." o "DNI N° .....").
@@ -275,9 +534,114 @@ Responde ÚNICAMENTE con este formato JSON:
   "analysis_notes": "Análisis rápido"
 }"""
 
+CLASIFICAR_SYSTEM_PROMPT = """Eres un experto legal argentino. Recibes fragmentos numerados de un contrato de alquiler.
+En cada fragmento, el dato a completar está marcado entre ⟦ ⟧.
+
+TAREA: Indica qué dato corresponde a cada hueco marcado (Locador, Locatario, Garante, DNI, CUIT, Domicilio, Monto, Fecha, etc.).
+
+Responde ÚNICAMENTE con este formato JSON:
+{
+  "variables": [
+    {"id": 1, "key": "dniGarante", "label": "DNI del Garante", "type": "dni"}
+  ]
+}"""
+
+# Detector local: resuelve los huecos mecánicos sin IA y sólo manda al LLM los
+# fragmentos que no puede etiquetar (ver detector.py)
+LOCAL_DETECTOR_ENABLED = os.getenv("ANALYZE_LOCAL_DETECTOR", "1").strip() not in ("0", "false", "no")
+
+# Cache de análisis: mismo contrato + proveedor + modelo + prompt → mismo resultado
+ANALYZE_CACHE_ENABLED = os.getenv("ANALYZE_CACHE", "1").strip() not in ("0", "false", "no")
+analyze_cache = CacheAnalisis(
+    ruta=Path(os.getenv("ANALYZE_CACHE_PATH", str(BASE_DIR / "cache" / "analisis.sqlite3"))),
+    ttl_segundos=float(os.getenv("ANALYZE_CACHE_TTL_HORAS", "168")) * 3600,
+    max_bytes=int(float(os.getenv("ANALYZE_CACHE_MAX_MB", "50")) * 1024 * 1024),
+) if ANALYZE_CACHE_ENABLED else None
+
+
+@app.on_event("shutdown")
+async def cerrar_analyze_cache():
+    # Escribe las horas de acceso que quedaron pendientes
+    if analyze_cache is not None:
+        await run_in_threadpool(analyze_cache.cerrar)
+
+
+def modelo_activo() -> str:
+    if AI_PROVIDER == "fake":
+        return "fake"
+    return CLAUDE_MODEL if AI_PROVIDER == "claude" else OPENAI_MODEL
+
+
+@app.get("/api/cache")
+async def cache_stats():
+    """Estadísticas del cache de análisis (hits, misses, tamaño)."""
+    if analyze_cache is None:
+        return {"enabled": False}
+    return {"enabled": True, **(await run_in_threadpool(analyze_cache.stats))}
+
+
+async def analizar_con_detector(deteccion) -> AnalyzeResponse:
+    """Variables del detector local; el LLM sólo clasifica los fragmentos pendientes."""
+    clasificadas = {}
+    if deteccion.pendientes:
+        fragmentos = "\n".join(f"{p.id}: {p.contexto}" for p in deteccion.pendientes)
+        raw = await llamar_ia(
+            system_prompt=CLASIFICAR_SYSTEM_PROMPT,
+            user_message=f"Clasifica estos fragmentos:\n\n{fragmentos}",
+            json_mode=True,
+            temperature=0.1
+        )
+        for v in parsear_json(raw).get("variables", []):
+            if isinstance(v, dict) and str(v.get("id", "")).isdigit():
+                clasificadas[int(v["id"])] = v
+
+    locales = len(deteccion.resueltas)
+    log_analyze.info("Detector local", extra={"resueltas": locales, "clasificadas_ia": len(deteccion.pendientes)})
+    return AnalyzeResponse(
+        variables=variables_en_orden(deteccion, clasificadas),
+        analysis_notes=f"Detección local: {locales} variable(s) resueltas sin IA; "
+                       f"{len(deteccion.pendientes)} clasificadas por IA."
+    )
+
+
+@app.post("/api/analyze", response_model=AnalyzeResponse)
+async def analyze_contract(request: AnalyzeRequest):
+    """
+    Analiza el texto del contrato y detecta variables a completar.
+    """
+    # El diagnóstico de configuración se loguea al inicializar los clientes;
+    # por llamada sólo con traza (LOG_LEVEL=DEBUG o LOG_SAMPLE)
+    if structured_log.trace_enabled():
+        log_analyze.debug("Diagnóstico", extra={
+            "env": str(ENV_PATH), "proveedor": AI_PROVIDER, "variable_key": USED_KEY_NAME,
+            "key": _key_enmascarada(), "modelo": modelo_activo(), "chars": len(request.contract_text),
+        })
+
+    if not request.contract_text or len(request.contract_text.strip()) < 50:
+        raise HTTPException(status_code=400, detail="El texto del contrato es demasiado corto.")
+
+    cache_key = None
+    if analyze_cache is not None:
+        prompt_version = ANALYZE_SYSTEM_PROMPT
+        if LOCAL_DETECTOR_ENABLED:
+            prompt_version += CLASIFICAR_SYSTEM_PROMPT + DETECTOR_VERSION
+        cache_key = CacheAnalisis.clave(request.contract_text, AI_PROVIDER, modelo_activo(), prompt_version)
+        # SQLite: fuera del event loop
+        cached = await run_in_threadpool(analyze_cache.obtener, cache_key)
+        if cached is not None:
+            log_analyze.info("Cache HIT", extra={"clave": cache_key[:12]})
+            return AnalyzeResponse(**cached)
+
     try:
-        raw = llamar_ia(
-            system_prompt=system_prompt,
+        deteccion = detectar_variables(request.contract_text) if LOCAL_DETECTOR_ENABLED else None
+        if deteccion is not None and deteccion.orden:
+            response = await analizar_con_detector(deteccion)
+            if cache_key is not None:
+                await run_in_threadpool(analyze_cache.guardar, cache_key, response.model_dump())
+            return response
+
+        raw = await llamar_ia(
+            system_prompt=ANALYZE_SYSTEM_PROMPT,
             user_message=f"Analiza este contrato completo:\n\n{request.contract_text}",
             json_mode=True,
             temperature=0.1
@@ -301,40 +665,30 @@ Responde ÚNICAMENTE con este formato JSON:
                         "example": v.get("example", "")
                     })
 
-        return AnalyzeResponse(
+        response = AnalyzeResponse(
             variables=clean_vars,
             analysis_notes=result.get("analysis_notes", "Análisis completado.")
         )
+        if cache_key is not None:
+            await run_in_threadpool(analyze_cache.guardar, cache_key, response.model_dump())
+        return response
 
     except HTTPException as e:
         # Re-lanzar HTTPExceptions (como el 401/404 que ya manejamos en llamar_ia)
         raise e
     except Exception as e:
-        print("\n[!!!] ERROR CRÍTICO EN /api/analyze")
-        print(f"Tipo de error: {type(e).__name__}")
-        
-        # Si el error tiene atributos de respuesta (como los de Anthropic/httpx)
-        if hasattr(e, 'status_code'):
-            print(f"Código HTTP real: {e.status_code}")
-        if hasattr(e, 'message'):
-            print(f"Mensaje exacto: {e.message}")
-        
-        # Imprimir traceback completo para diagnóstico
-        traceback.print_exc()
-        
+        # Si el error tiene atributos de respuesta (como los de Anthropic/httpx) van como campos
+        log_analyze.exception("Error crítico en /api/analyze", extra={
+            "tipo": type(e).__name__,
+            "codigo_http": getattr(e, "status_code", None),
+            "mensaje_proveedor": getattr(e, "message", None),
+        })
+
         raise HTTPException(status_code=500, detail=f"Error en el análisis: {str(e)}")
 
 
-@app.post("/api/chat", response_model=ChatResponse)
-def chat(request: ChatRequest):
-    """
-    Conversación guiada para recopilar datos de las variables.
-    """
-    variables = request.variables
-    collected = request.collected_data.copy()
-    pending_vars = [v for v in variables if v["key"] not in collected or not collected[v["key"]]]
-
-    system_prompt = f"""Eres AsistenteContrato, un asistente legal formal para completar contratos de alquiler en Argentina.
+def _prompt_chat(variables: list[dict], collected: dict) -> str:
+    return f"""Eres AsistenteContrato, un asistente legal formal para completar contratos de alquiler en Argentina.
 Tu único objetivo es preguntarle al usuario CADA UNA de las variables pendientes.
 
 LISTA DE VARIABLES (TODAS DEBEN SER COMPLETADAS):
@@ -350,7 +704,7 @@ INSTRUCCIONES:
 4. Si detectas un error de formato (ej: un DNI de 3 números), pide corregirlo amablemente.
 5. NO te saltes a los Garantes/Fiadores si están en la lista.
 
-Responde con JSON válido:
+Responde con JSON válido (el campo "reply" primero):
 {{
   "reply": "Tu mensaje al usuario",
   "extracted_data": {{"key_de_la_variable": "valor_extraido"}},
@@ -358,41 +712,245 @@ Responde con JSON válido:
   "next_variable_key": "key_de_la_siguiente"
 }}"""
 
+
+def _respuesta_chat(result: dict, variables: list[dict], collected: dict) -> ChatResponse:
+    extracted = result.get("extracted_data", {})
+    collected.update(extracted)
+
+    is_complete = result.get("is_complete", False)
+    if not is_complete:
+        still_pending = [v for v in variables if v["key"] not in collected or not collected[v["key"]]]
+        is_complete = len(still_pending) == 0
+
+    return ChatResponse(
+        reply=result.get("reply", "¿Podría repetir ese dato?"),
+        collected_data=collected,
+        is_complete=is_complete,
+        next_variable=result.get("next_variable_key")
+    )
+
+
+@app.post("/api/chat", response_model=ChatResponse)
+async def chat(request: ChatRequest):
+    """
+    Conversación guiada para recopilar datos de las variables.
+    """
+    variables = request.variables
+    collected = request.collected_data.copy()
+    system_prompt = _prompt_chat(variables, collected)
+
     try:
         history = [{"role": m.role, "content": m.content} for m in request.messages]
 
-        raw = llamar_ia(
+        raw = await llamar_ia(
             system_prompt=system_prompt,
             user_message="",
             messages_history=history,
             json_mode=True,
             temperature=0.3
         )
-        result = parsear_json(raw)
+        return _respuesta_chat(parsear_json(raw), variables, collected)
+
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error en el chat: {str(e)}")
 
-        extracted = result.get("extracted_data", {})
-        collected.update(extracted)
 
-        is_complete = result.get("is_complete", False)
-        if not is_complete:
-            still_pending = [v for v in variables if v["key"] not in collected or not collected[v["key"]]]
-            is_complete = len(still_pending) == 0
+def _evento_sse(evento: str, datos: dict) -> str:
+    return f"event: {evento}\ndata: {json.dumps(datos, ensure_ascii=False)}\n\n"
 
-        return ChatResponse(
-            reply=result.get("reply", "¿Podría repetir ese dato?"),
-            collected_data=collected,
-            is_complete=is_complete,
-            next_variable=result.get("next_variable_key")
-        )
 
+def _respuesta_sse(system_prompt: str, history: list, user_message: str, al_terminar) -> StreamingResponse:
+    """
+    Respuesta Server-Sent Events de un turno del chat: reenvía el texto de
+    "reply" a medida que llega del proveedor (eventos `token`) y al final
+    emite `done` con lo que devuelva `await al_terminar(resultado_json)`.
+    Ante un fallo se emite `error` con el detalle.
+    """
+    async def eventos():
+        extractor = ExtractorCampoJSON("reply")
+        partes = []
+        try:
+            async for fragmento in llamar_ia_stream(
+                system_prompt=system_prompt,
+                user_message=user_message,
+                messages_history=history,
+                json_mode=True,
+                temperature=0.3
+            ):
+                partes.append(fragmento)
+                texto = extractor.feed(fragmento)
+                if texto:
+                    yield _evento_sse("token", {"text": texto})
+
+            final = await al_terminar(parsear_json("".join(partes)))
+            yield _evento_sse("done", final.model_dump())
+        except HTTPException as e:
+            yield _evento_sse("error", {"detail": str(e.detail)})
+        except Exception as e:
+            yield _evento_sse("error", {"detail": f"Error en el chat: {str(e)}"})
+
+    return StreamingResponse(
+        eventos(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@app.post("/api/chat/stream")
+async def chat_stream(request: ChatRequest):
+    """Variante de /api/chat por Server-Sent Events (ver _respuesta_sse)."""
+    variables = request.variables
+    collected = request.collected_data.copy()
+    system_prompt = _prompt_chat(variables, collected)
+    history = [{"role": m.role, "content": m.content} for m in request.messages]
+
+    async def al_terminar(result: dict) -> ChatResponse:
+        return _respuesta_chat(result, variables, collected)
+
+    return _respuesta_sse(system_prompt, history, "", al_terminar)
+
+
+# ─── Sesiones de entrevista ──────────────────────────────────────────────────
+# El cliente manda sólo el mensaje nuevo; el servidor arma un prompt compacto
+# con las variables pendientes y una ventana acotada del historial.
+
+CHAT_HISTORIAL_VENTANA = int(os.getenv("CHAT_HISTORIAL_VENTANA", "4"))
+CHAT_RESUMEN_MAX_CHARS = int(os.getenv("CHAT_RESUMEN_MAX_CHARS", "600"))
+_sesiones_path = os.getenv("CHAT_SESSIONS_PATH", "").strip()
+chat_sessions = AlmacenSesiones(
+    ttl_segundos=float(os.getenv("CHAT_SESSIONS_TTL_HORAS", "24")) * 3600,
+    max_sesiones=int(os.getenv("CHAT_SESSIONS_MAX", "1000")),
+    ruta=Path(_sesiones_path) if _sesiones_path else None,
+)
+
+
+def _prompt_chat_sesion(sesion: SesionChat) -> str:
+    pendientes = sesion.pendientes()
+    lineas = []
+    for v in pendientes:
+        linea = f"- {v['key']}: {v.get('label') or v['key']}"
+        if v.get("type") and v["type"] != "texto":
+            linea += f" [{v['type']}]"
+        if v.get("example"):
+            linea += f" (ej: {v['example']})"
+        lineas.append(linea)
+    resumen = sesion.resumen(CHAT_RESUMEN_MAX_CHARS)
+    resumen = f"\nRESUMEN DE LA CONVERSACIÓN ANTERIOR:\n{resumen}\n" if resumen else ""
+
+    return f"""Eres AsistenteContrato, un asistente legal formal para completar contratos de alquiler en Argentina.
+Tu único objetivo es preguntarle al usuario CADA UNA de las variables pendientes.
+
+VARIABLES PENDIENTES ({len(pendientes)} de {len(sesion.variables)}; key: descripción):
+{chr(10).join(lineas) or "(ninguna)"}
+{resumen}
+INSTRUCCIONES:
+1. NO des por terminada la entrevista hasta que TODAS las variables pendientes tengan un valor.
+2. Haz UNA pregunta clara a la vez.
+3. Si el usuario da un dato que parece ser para otra variable pendiente, extráelo igual.
+4. Si detectas un error de formato (ej: un DNI de 3 números), pide corregirlo amablemente.
+5. NO te saltes a los Garantes/Fiadores si están en la lista.
+
+Responde con JSON válido (el campo "reply" primero):
+{{
+  "reply": "Tu mensaje al usuario",
+  "extracted_data": {{"key_de_la_variable": "valor_extraido"}},
+  "is_complete": false,
+  "next_variable_key": "key_de_la_siguiente"
+}}"""
+
+
+# Con CHAT_SESSIONS_PATH el almacén lee y escribe SQLite: se usa desde un hilo
+
+async def _preparar_turno(session_id: str, message: str | None) -> tuple[SesionChat, str, list]:
+    sesion = await run_in_threadpool(chat_sessions.obtener, session_id)
+    if sesion is None:
+        raise HTTPException(status_code=404, detail="Sesión de chat inexistente o vencida")
+    # El mensaje recién se guarda en la sesión cuando el turno termina bien
+    # (_cerrar_turno): si la IA falla, el reintento no lo duplica.
+    history = list(sesion.historial)
+    if message:
+        history = (history + [{"role": "user", "content": message}])[-CHAT_HISTORIAL_VENTANA:]
+    system_prompt = _prompt_chat_sesion(sesion)
+
+    # Instrumentación: prompt compacto vs. lo que mandaría /api/chat con todo el historial
+    chars = len(system_prompt) + sum(len(m["content"]) for m in history)
+    chars_sin_sesion = len(_prompt_chat(sesion.variables, sesion.collected)) + \
+        sesion.chars_historial + len(message or "")
+    chat_sessions.registrar_prompt(chars, chars_sin_sesion)
+    if structured_log.trace_enabled():
+        log_chat.debug("Turno de sesión", extra={
+            "sesion": sesion.id[:8], "turno": sesion.turnos + 1, "prompt_chars": chars,
+            "mensajes_ventana": len(history), "chars_sin_sesion": chars_sin_sesion,
+        })
+    return sesion, system_prompt, history
+
+
+async def _cerrar_turno(sesion: SesionChat, message: str | None, result: dict) -> ChatResponse:
+    respuesta = _respuesta_chat(result, sesion.variables, sesion.collected)
+    if message:
+        sesion.agregar("user", message, CHAT_HISTORIAL_VENTANA)
+    sesion.agregar("assistant", respuesta.reply, CHAT_HISTORIAL_VENTANA)
+    sesion.registrar_extraidos(result.get("extracted_data") or {})
+    sesion.turnos += 1
+    await run_in_threadpool(chat_sessions.guardar, sesion)
+    return respuesta
+
+
+@app.post("/api/chat/sessions", response_model=ChatSessionResponse)
+async def crear_sesion_chat(request: ChatSessionRequest):
+    """Crea una sesión de entrevista con las variables a completar."""
+    sesion = await run_in_threadpool(chat_sessions.crear, request.variables, request.collected_data)
+    if request.messages:
+        for m in request.messages:
+            sesion.agregar(m.role, m.content, CHAT_HISTORIAL_VENTANA)
+        await run_in_threadpool(chat_sessions.guardar, sesion)
+    return ChatSessionResponse(session_id=sesion.id)
+
+
+@app.get("/api/chat/sessions/stats")
+async def stats_sesiones_chat():
+    """Tamaño promedio del prompt por turno con sesión vs. sin sesión."""
+    return chat_sessions.stats()
+
+
+@app.post("/api/chat/sessions/{session_id}", response_model=ChatResponse)
+async def chat_sesion(session_id: str, request: ChatTurnRequest):
+    """Un turno de la entrevista: sólo viaja el mensaje nuevo del usuario."""
+    sesion, system_prompt, history = await _preparar_turno(session_id, request.message)
+    try:
+        raw = await llamar_ia(
+            system_prompt=system_prompt,
+            user_message="Comencemos.",
+            messages_history=history,
+            json_mode=True,
+            temperature=0.3
+        )
+        return await _cerrar_turno(sesion, request.message, parsear_json(raw))
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error en el chat: {str(e)}")
 
 
+@app.post("/api/chat/sessions/{session_id}/stream")
+async def chat_sesion_stream(session_id: str, request: ChatTurnRequest):
+    """Variante por Server-Sent Events de un turno de sesión."""
+    sesion, system_prompt, history = await _preparar_turno(session_id, request.message)
+    return _respuesta_sse(system_prompt, history, "Comencemos.",
+                          lambda result: _cerrar_turno(sesion, request.message, result))
+
+
+@app.delete("/api/chat/sessions/{session_id}")
+async def borrar_sesion_chat(session_id: str):
+    await run_in_threadpool(chat_sessions.borrar, session_id)
+    return {"deleted": session_id}
+
+
 @app.post("/api/generate", response_model=GenerateResponse)
-def generate_contract(request: GenerateRequest):
+async def generate_contract(request: GenerateRequest):
     """
-    Inyecta los datos en la plantilla. Sustitución en 3 capas para máxima confiabilidad.
+    Inyecta los datos en la plantilla: todos los placeholders se reemplazan en
+    una sola pasada (exactos y, si no aparecen, con espacios flexibles).
     Soporta replace_all por variable y distingue variables auto vs manuales.
     """
     try:
@@ -402,30 +960,30 @@ def generate_contract(request: GenerateRequest):
         skipped  = []
 
         raw_vars   = request.variables or []
-        count_auto   = sum(1 for v in raw_vars if not v.get("manual"))
-        count_manual = len(raw_vars) - count_auto
-
-        # ── Log de inicio ──────────────────────────────────────────────────────
-        print(f"\n[GENERATE] === INICIO ===")
-        print(f"[GENERATE] Variables recibidas: {len(raw_vars)} "
-              f"(auto: {count_auto}, manuales: {count_manual})")
-        print(f"[GENERATE] Claves collected_data : {list(request.collected_data.keys())}")
-        print(f"[GENERATE] Longitud template     : {len(contract)} chars")
-
-        # Muestra estructura de ejemplo (sin datos sensibles)
-        shown_auto = shown_manual = False
-        for v in raw_vars:
-            is_m = bool(v.get("manual"))
-            if not is_m and not shown_auto:
-                print(f"[GENERATE] Ejemplo AUTO  : keys={list(v.keys())} "
-                      f"| placeholder='{str(v.get('placeholder_text',''))[:40]}'")
-                shown_auto = True
-            elif is_m and not shown_manual:
-                print(f"[GENERATE] Ejemplo MANUAL: keys={list(v.keys())} "
-                      f"| placeholder='{str(v.get('placeholder_text','') or v.get('valor_original_detectado',''))[:40]}'")
-                shown_manual = True
-            if shown_auto and shown_manual:
-                break
+        traza      = structured_log.trace_enabled()
+
+        # ── Traza de inicio (sólo con LOG_LEVEL=DEBUG o pedido sorteado) ────────
+        if traza:
+            count_auto = sum(1 for v in raw_vars if not v.get("manual"))
+            log_generate.debug("Inicio", extra={
+                "variables": len(raw_vars), "auto": count_auto, "manuales": len(raw_vars) - count_auto,
+                "claves_collected": list(request.collected_data.keys()), "chars_template": len(contract),
+            })
+            # Estructura de ejemplo (sin datos sensibles)
+            shown_auto = shown_manual = False
+            for v in raw_vars:
+                is_m = bool(v.get("manual"))
+                if not is_m and not shown_auto:
+                    log_generate.debug("Ejemplo AUTO", extra={
+                        "claves": list(v.keys()), "placeholder": str(v.get('placeholder_text', ''))[:40]})
+                    shown_auto = True
+                elif is_m and not shown_manual:
+                    log_generate.debug("Ejemplo MANUAL", extra={
+                        "claves": list(v.keys()),
+                        "placeholder": str(v.get('placeholder_text', '') or v.get('valor_original_detectado', ''))[:40]})
+                    shown_manual = True
+                if shown_auto and shown_manual:
+                    break
 
         # ── Normalización defensiva ────────────────────────────────────────────
         # Convierte cada variable (cualquier estructura) a un dict canónico:
@@ -436,7 +994,8 @@ def generate_contract(request: GenerateRequest):
             try:
                 key = str(raw.get("key") or "").strip()
                 if not key:
-                    print(f"[GENERATE] SKIP variable sin 'key': {list(raw.keys())}")
+                    if traza:
+                        log_generate.debug("SKIP variable sin 'key'", extra={"claves": list(raw.keys())})
                     skipped.append("<sin-key>")
                     continue
 
@@ -460,97 +1019,72 @@ def generate_contract(request: GenerateRequest):
 
                 replace_all = bool(raw.get("replace_all", True))
                 is_manual   = bool(raw.get("manual", False))
+                # Caracteres iniciales del placeholder que son contexto (ver detector.py)
+                original    = str(raw.get("placeholder_text") or "")
+                keep_prefix = int(raw.get("keep_prefix") or 0) - (len(original) - len(original.lstrip()))
+                keep_suffix = int(raw.get("keep_suffix") or 0) - (len(original) - len(original.rstrip()))
+                if original.strip() != placeholder or keep_prefix + keep_suffix >= len(placeholder):
+                    keep_prefix = keep_suffix = 0
 
                 normalized.append({
                     "key":         key,
                     "placeholder": placeholder,
                     "value":       value,
                     "replace_all": replace_all,
+                    "keep_prefix": max(keep_prefix, 0),
+                    "keep_suffix": max(keep_suffix, 0),
                     "source_tag":  "[Manual]" if is_manual else "[Auto]  ",
                 })
             except Exception as norm_err:
-                print(f"[GENERATE] ERROR normalizando variable: {norm_err} | raw={raw}")
+                log_generate.warning("Error normalizando variable", extra={
+                    "error": str(norm_err), "claves": list(raw.keys()) if isinstance(raw, dict) else None})
                 skipped.append(str(raw.get("key", "<desconocido>")))
                 continue
 
-        print(f"[GENERATE] Normalizadas OK: {len(normalized)} | Saltadas: {len(skipped)}")
-        if skipped:
-            print(f"[GENERATE] Saltadas (keys): {skipped}")
-
-        # ── Loop de reemplazo ──────────────────────────────────────────────────
+        # ── Reemplazo en una sola pasada (ver sustitucion.py) ───────────────────
+        reemplazos = []
         for var in normalized:
-            key         = var["key"]
-            placeholder = var["placeholder"]
-            value       = var["value"]
-            replace_all = var["replace_all"]
-            source_tag  = var["source_tag"]
-
-            if not value:
-                print(f"[GENERATE] SKIP  {source_tag} '{key}' -- sin valor")
+            key, source_tag = var["key"], var["source_tag"]
+            if not var["value"]:
+                if traza:
+                    log_generate.debug("SKIP sin valor", extra={"origen": source_tag.strip(), "key": key})
                 continue
-            if not placeholder:
-                print(f"[GENERATE] SKIP  {source_tag} '{key}' -- sin placeholder_text")
+            if not var["placeholder"]:
+                if traza:
+                    log_generate.debug("SKIP sin placeholder_text", extra={"origen": source_tag.strip(), "key": key})
                 skipped.append(key)
                 continue
+            reemplazos.append((var, Reemplazo(key, var["placeholder"], var["value"],
+                                                var["replace_all"], var["keep_prefix"], var["keep_suffix"])))
+
+        with DOCX_DURACION.time("reemplazo"):
+            contract = aplicar_reemplazos(contract, [r for _, r in reemplazos])
 
-            replaced = False
-
-            # CAPA 1: coincidencia exacta
-            if placeholder in contract:
-                contract = (contract.replace(placeholder, value)
-                            if replace_all else
-                            contract.replace(placeholder, value, 1))
-                replaced = True
-
-            # CAPA 2: normalización de espacios
-            if not replaced:
-                ph_norm  = re.sub(r'\s+', ' ', placeholder)
-                ctx_norm = re.sub(r'\s+', ' ', contract)
-                if ph_norm in ctx_norm:
-                    contract = re.sub(r'\s+', ' ', contract)
-                    contract = (contract.replace(ph_norm, value)
-                                if replace_all else
-                                contract.replace(ph_norm, value, 1))
-                    replaced = True
-
-            # CAPA 3: regex flexible
-            if not replaced:
-                try:
-                    p_esc  = re.escape(placeholder)
-                    p_flex = re.sub(r'(\\\\.)+', r'[.\\-\\s]+', p_esc)
-                    p_flex = re.sub(r'\\_+',     r'[_\\s]+',    p_flex)
-                    p_flex = re.sub(r'\\ ',      r'\\s*',       p_flex)
-                    if re.search(p_flex, contract):
-                        cnt      = 0 if replace_all else 1
-                        contract = re.sub(p_flex, value, contract, count=cnt)
-                        replaced = True
-                except re.error as regex_err:
-                    print(f"[GENERATE] REGEX ERR {source_tag} '{key}': {regex_err}")
-
-            if replaced:
+        for var, r in reemplazos:
+            if r.aplicado:
                 applied += 1
-                preview = value[:30] + ('...' if len(value) > 30 else '')
-                print(f"[GENERATE] OK    {source_tag} '{key}' -> '{preview}'")
+                if traza:
+                    preview = r.value[:30] + ('...' if len(r.value) > 30 else '')
+                    log_generate.debug("OK", extra={"origen": var["source_tag"].strip(), "key": r.key,
+                                                    "valor": preview, "capa": r.capa})
             else:
-                no_match.append(key)
-                print(f"[GENERATE] MISS  {source_tag} '{key}' -- placeholder: '{placeholder[:60]}'")
+                no_match.append(r.key)
+                if traza:
+                    log_generate.debug("MISS", extra={"origen": var["source_tag"].strip(), "key": r.key,
+                                                      "placeholder": r.placeholder[:60]})
 
-        print(f"\n[GENERATE] Resultado: {applied}/{len(normalized)} aplicadas | "
-              f"sin-match: {len(no_match)} | saltadas: {len(skipped)}")
-        if no_match:
-            print(f"[GENERATE] Sin match: {no_match}")
+        log_generate.info("Resultado", extra={
+            "aplicadas": applied, "normalizadas": len(normalized), "sin_match": no_match, "saltadas": skipped,
+        })
 
         return GenerateResponse(
             contract_preview=contract,
-            variables_applied=applied
+            variables_applied=applied,
+            preview_id=preview_cache.guardar(contract)
         )
 
     except Exception as e:
-        print(f"\n[GENERATE] *** ERROR EN GENERACIÓN ***")
-        print(f"[GENERATE] Tipo  : {type(e).__name__}")
-        print(f"[GENERATE] Mensaje: {e}")
-        print(f"[GENERATE] Traceback completo:")
-        traceback.print_exc()
+        log_generate.exception("Error en generación", extra={"tipo": type(e).__name__})
         raise HTTPException(
             status_code=500,
             detail={"error": "generate_failed", "detail": str(e)}
@@ -558,60 +1092,142 @@ def generate_contract(request: GenerateRequest):
 
 
 
+# Textos renderizados por /api/generate, para exportarlos sin recalcular
+preview_cache = CachePreviews(max_bytes=int(float(os.getenv("PREVIEW_CACHE_MB", "64")) * 1024 * 1024))
+
+# Archivos generados en disco, por hash de contenido (ver shared/artifact_store.py)
+artefactos = ArtifactStore(
+    root=Path(os.getenv("ARTIFACTS_DIR", str(BASE_DIR / "cache" / "artefactos"))),
+    retention_seconds=float(os.getenv("ARTIFACTS_RETENCION_HORAS", "72")) * 3600,
+    max_bytes=int(float(os.getenv("ARTIFACTS_MAX_MB", "500")) * 1024 * 1024),
+)
+
+DOCX_MEDIA_TYPE = "application/vnd.openxmlformats-officedocument.wordprocessingml.document"
+PDF_MEDIA_TYPE = "application/pdf"
+
+# reemplazo: sustituir las variables en el texto (/api/generate); render: armar
+# el .docx; save: escribirlo en el almacén; pdf: convertirlo
+DOCX_DURACION = metrics.REGISTRY.histogram(
+    "docx_stage_duration_seconds", "Duración de cada etapa de la exportación",
+    ("stage",), metrics.DOCX_BUCKETS)
+metrics.cache_metrics(lambda: {
+    "analisis": analyze_cache, "previews": preview_cache, "artefactos": artefactos,
+})
+
+# Conversores .docx -> .pdf precalentados (ver shared/pdf_pool.py); PDF_WORKERS=0 los desactiva
+conversor_pdf = PdfPool(
+    workers=int(os.getenv("PDF_WORKERS", "2")),
+    timeout=float(os.getenv("PDF_TIMEOUT", "60")),
+    max_jobs=int(os.getenv("PDF_MAX_TRABAJOS", "200")),
+    queue_timeout=float(os.getenv("PDF_COLA_TIMEOUT", "30")),
+    start_timeout=float(os.getenv("PDF_ARRANQUE_TIMEOUT", "60")),
+    python=os.getenv("PDF_PYTHON", "").strip() or sys.executable,
+    soffice=os.getenv("SOFFICE_PATH", "").strip() or shutil.which("soffice") or "soffice",
+)
+_arranque_pdf = None
+
+
+@app.on_event("startup")
+async def limpiar_artefactos():
+    await run_in_threadpool(artefactos.sweep)
+
+
+@app.on_event("startup")
+async def iniciar_conversor_pdf():
+    # En segundo plano: soffice tarda en arrancar y no debe demorar el inicio de la API
+    global _arranque_pdf
+    _arranque_pdf = asyncio.create_task(conversor_pdf.start())
+
+
+@app.on_event("shutdown")
+async def cerrar_conversor_pdf():
+    await conversor_pdf.close()
+
+
+async def _docx_exportado(texto: str, preview_id: str) -> tuple[str, Path]:
+    clave = artifact_key("docx", EXPORT_VERSION, preview_id)
+    ruta = artefactos.get(clave, "docx")
+    if ruta is None:
+        with DOCX_DURACION.time("render"):
+            data = await run_in_threadpool(profiling.in_thread(construir_docx), texto)
+        with DOCX_DURACION.time("save"):
+            ruta = await run_in_threadpool(profiling.in_thread(artefactos.put), clave, "docx", [data])
+    return clave, ruta
+
+
+async def _pdf_exportado(texto: str, preview_id: str) -> tuple[str, Path]:
+    clave = artifact_key("pdf", EXPORT_VERSION, preview_id)
+    ruta = artefactos.get(clave, "pdf")
+    if ruta is None:
+        _, ruta_docx = await _docx_exportado(texto, preview_id)
+        try:
+            with DOCX_DURACION.time("pdf"):
+                pdf = await conversor_pdf.convert(await run_in_threadpool(ruta_docx.read_bytes))
+        except PdfUnavailable as e:
+            raise HTTPException(status_code=503, detail=f"Conversión a PDF no disponible: {e}")
+        except PdfConversionError as e:
+            log_export.error("Error al convertir a PDF", extra={"error": str(e)})
+            raise HTTPException(status_code=500, detail=f"Error al convertir a PDF: {e}")
+        with DOCX_DURACION.time("save"):
+            ruta = await run_in_threadpool(artefactos.put, clave, "pdf", [pdf])
+    return clave, ruta
+
+
 @app.post("/api/export-docx")
-def export_docx(request: GenerateRequest):
+async def export_docx(request: ExportRequest, http_request: Request):
     """
-    Genera el contrato como .DOCX profesional.
+    Genera el contrato como .DOCX profesional (o .PDF con `format="pdf"`). Con
+    `preview_id` (devuelto por /api/generate) se usa el texto ya renderizado;
+    si no está en cache y se mandó la plantilla completa, se vuelve a generar.
+    Un archivo ya exportado se sirve desde disco (ETag, If-None-Match y Range).
     """
-    gen_response = generate_contract(request)
-    contract_text = gen_response.contract_preview
-
-    doc = Document()
+    formato = request.format.lower().strip()
+    if formato not in ("docx", "pdf"):
+        raise HTTPException(status_code=400, detail="Formato inválido: use 'docx' o 'pdf'.")
+
+    preview_id = request.preview_id
+    texto = preview_cache.obtener(preview_id) if preview_id else None
+    if texto is None:
+        if not request.contract_template:
+            raise HTTPException(status_code=404, detail="La vista previa ya no está disponible. "
+                                                        "Genere el contrato nuevamente.")
+        gen_response = await generate_contract(request)
+        texto, preview_id = gen_response.contract_preview, gen_response.preview_id
+
+    if formato == "pdf":
+        clave, ruta = await _pdf_exportado(texto, preview_id)
+        media_type = PDF_MEDIA_TYPE
+    else:
+        clave, ruta = await _docx_exportado(texto, preview_id)
+        media_type = DOCX_MEDIA_TYPE
 
-    style = doc.styles['Normal']
-    style.font.name = 'Times New Roman'
-    style.font.size = Pt(11)
+    return serve_artifact(http_request, ruta, clave, media_type, f"contrato_alquiler.{formato}",
+                            headers={"X-Artifact-Id": clave})
 
-    for section in doc.sections:
-        section.top_margin = Inches(1)
-        section.bottom_margin = Inches(1)
-        section.left_margin = Inches(1.2)
-        section.right_margin = Inches(1.2)
 
-    for para_text in contract_text.split('\n'):
-        para_text = para_text.strip()
-        if not para_text:
-            doc.add_paragraph()
+@app.get("/api/artifacts/{clave}")
+async def descargar_artefacto(clave: str, request: Request):
+    """Vuelve a descargar un artefacto ya generado (admite Range e If-None-Match)."""
+    if not re.fullmatch(r'[0-9a-f]{64}', clave):
+        raise HTTPException(status_code=404, detail="Artefacto inexistente")
+    for extension, media_type in (("docx", DOCX_MEDIA_TYPE), ("pdf", PDF_MEDIA_TYPE)):
+        if not artefactos.path(clave, extension).exists():
             continue
+        ruta = artefactos.get(clave, extension)
+        if ruta is not None:
+            return serve_artifact(request, ruta, clave, media_type, f"contrato_alquiler.{extension}")
+    raise HTTPException(status_code=404, detail="Artefacto inexistente o vencido")
 
-        is_title = (
-            para_text.isupper() or
-            re.match(r'^(CLÁUSULA|ARTÍCULO|Cláusula|Artículo|TÍTULO|Título)\s+\w+', para_text) or
-            re.match(r'^\d+[\.\-]\s+[A-Z]', para_text) or
-            (len(para_text) < 80 and para_text.endswith(':'))
-        )
-
-        para = doc.add_paragraph()
-        run = para.add_run(para_text)
 
-        if is_title:
-            run.bold = True
-            para.alignment = WD_ALIGN_PARAGRAPH.CENTER if para_text.isupper() else WD_ALIGN_PARAGRAPH.LEFT
-        else:
-            para.alignment = WD_ALIGN_PARAGRAPH.JUSTIFY
-            para.paragraph_format.first_line_indent = Inches(0.3)
+@app.get("/api/artifacts")
+async def stats_artefactos():
+    return {**artefactos.stats(), "pdf": conversor_pdf.stats()}
 
-        para.paragraph_format.space_after = Pt(6)
 
-    buffer = io.BytesIO()
-    doc.save(buffer)
-    buffer.seek(0)
-
-    return StreamingResponse(
-        buffer,
-        media_type="application/vnd.openxmlformats-officedocument.wordprocessingml.document",
-        headers={"Content-Disposition": "attachment; filename=contrato_alquiler.docx"}
-    )
+@app.get("/metrics", include_in_schema=False)
+async def metrics_endpoint():
+    """Métricas del proceso en formato de texto de Prometheus (ver shared/metrics.py)."""
+    return Response(metrics.REGISTRY.expose(), media_type=metrics.MEDIA_TYPE)
 
 
 @app.get("/")
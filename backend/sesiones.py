@@ -0,0 +1,175 @@
+"""
+Sesiones de entrevista del chat guardadas en el servidor.
+
+El cliente crea la sesión una vez (variables + datos ya cargados) y después
+manda sólo el mensaje nuevo de cada turno. El historial se conserva acotado:
+de los mensajes que salen de la ventana sólo queda un resumen (cuántos
+fueron y los datos que el usuario confirmó), de tamaño máximo fijo, para
+que el prompt no crezca con cada turno.
+
+Las sesiones viven en memoria (LRU con TTL); si se indica una ruta se
+persisten además en SQLite y sobreviven a un reinicio del servidor.
+"""
+
+import json
+import sqlite3
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from dataclasses import asdict, dataclass, field
+from pathlib import Path
+from typing import Any, Optional
+
+VALOR_RESUMEN_MAX = 60
+
+
+@dataclass
+class SesionChat:
+    id: str
+    variables: list[dict]
+    collected: dict[str, Any]
+    historial: list[dict] = field(default_factory=list)   # ventana reciente {role, content}
+    extraidos: dict[str, Any] = field(default_factory=dict)  # datos confirmados en el chat, en orden
+    mensajes_resumidos: int = 0                            # mensajes que salieron de la ventana
+    turnos: int = 0
+    chars_historial: int = 0                               # total enviado sin compactar
+    creado: float = field(default_factory=time.time)
+    actualizado: float = field(default_factory=time.time)
+
+    def pendientes(self) -> list[dict]:
+        return [v for v in self.variables if not self.collected.get(v["key"])]
+
+    def agregar(self, role: str, content: str, ventana: int) -> None:
+        """Agrega un mensaje; lo que excede la ventana queda sólo en el resumen."""
+        self.historial.append({"role": role, "content": content})
+        self.chars_historial += len(content)
+        while len(self.historial) > ventana:
+            self.historial.pop(0)
+            self.mensajes_resumidos += 1
+        self.actualizado = time.time()
+
+    def registrar_extraidos(self, datos: dict) -> None:
+        for key, valor in datos.items():
+            if valor:
+                self.extraidos.pop(key, None)     # al final: lo más reciente
+                self.extraidos[key] = valor
+
+    def resumen(self, max_chars: int) -> str:
+        """
+        Resumen de lo que ya no está en la ventana: cuántos mensajes hubo y
+        qué datos confirmó el usuario (los más recientes, hasta max_chars).
+        """
+        if not self.mensajes_resumidos:
+            return ""
+        etiquetas = {v["key"]: v.get("label") or v["key"] for v in self.variables}
+        lineas = []
+        total = 0
+        for key, valor in reversed(self.extraidos.items()):
+            valor = " ".join(str(valor).split())
+            if len(valor) > VALOR_RESUMEN_MAX:
+                valor = valor[:VALOR_RESUMEN_MAX - 1] + "…"
+            linea = f"- {etiquetas.get(key, key)}: {valor}"
+            if total + len(linea) > max_chars:
+                break
+            lineas.append(linea)
+            total += len(linea) + 1
+        cabecera = f"Ya se intercambiaron {self.mensajes_resumidos} mensajes anteriores."
+        if not lineas:
+            return cabecera
+        return cabecera + " Datos ya confirmados por el usuario:\n" + "\n".join(reversed(lineas))
+
+
+class AlmacenSesiones:
+    def __init__(self, ttl_segundos: float, max_sesiones: int, ruta: Optional[Path] = None):
+        self.ttl = ttl_segundos
+        self.max_sesiones = max_sesiones
+        self._sesiones: OrderedDict[str, SesionChat] = OrderedDict()
+        self._lock = threading.Lock()
+        self._db = None
+
+        # Instrumentación: tamaño del prompt compacto vs. el que mandaría /api/chat
+        self.prompt_turnos = 0
+        self.prompt_chars = 0
+        self.prompt_chars_sin_sesion = 0
+
+        if ruta:
+            ruta = Path(ruta)
+            ruta.parent.mkdir(parents=True, exist_ok=True)
+            self._db = sqlite3.connect(str(ruta), check_same_thread=False)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("""
+                CREATE TABLE IF NOT EXISTS sesiones (
+                    id           TEXT PRIMARY KEY,
+                    datos        TEXT NOT NULL,
+                    actualizado  REAL NOT NULL
+                )
+            """)
+            self._db.commit()
+
+    def crear(self, variables: list[dict], collected: dict[str, Any]) -> SesionChat:
+        sesion = SesionChat(id=uuid.uuid4().hex, variables=variables, collected=dict(collected))
+        self.guardar(sesion)
+        return sesion
+
+    def obtener(self, sesion_id: str) -> Optional[SesionChat]:
+        ahora = time.time()
+        with self._lock:
+            sesion = self._sesiones.get(sesion_id)
+            if sesion is None and self._db is not None:
+                fila = self._db.execute(
+                    "SELECT datos FROM sesiones WHERE id = ?", (sesion_id,)
+                ).fetchone()
+                if fila:
+                    sesion = SesionChat(**json.loads(fila[0]))
+                    self._sesiones[sesion_id] = sesion
+            if sesion is None:
+                return None
+            if ahora - sesion.actualizado > self.ttl:
+                self._borrar(sesion_id)
+                return None
+            self._sesiones.move_to_end(sesion_id)
+            return sesion
+
+    def guardar(self, sesion: SesionChat) -> None:
+        with self._lock:
+            self._sesiones[sesion.id] = sesion
+            self._sesiones.move_to_end(sesion.id)
+            while len(self._sesiones) > self.max_sesiones:
+                self._sesiones.popitem(last=False)   # queda en SQLite si hay persistencia
+            if self._db is not None:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO sesiones (id, datos, actualizado) VALUES (?, ?, ?)",
+                    (sesion.id, json.dumps(asdict(sesion), ensure_ascii=False), sesion.actualizado),
+                )
+                self._db.execute("DELETE FROM sesiones WHERE actualizado < ?", (time.time() - self.ttl,))
+                self._db.commit()
+
+    def borrar(self, sesion_id: str) -> None:
+        with self._lock:
+            self._borrar(sesion_id)
+
+    def _borrar(self, sesion_id: str) -> None:
+        self._sesiones.pop(sesion_id, None)
+        if self._db is not None:
+            self._db.execute("DELETE FROM sesiones WHERE id = ?", (sesion_id,))
+            self._db.commit()
+
+    def registrar_prompt(self, chars: int, chars_sin_sesion: int) -> None:
+        with self._lock:
+            self.prompt_turnos += 1
+            self.prompt_chars += chars
+            self.prompt_chars_sin_sesion += chars_sin_sesion
+
+    def stats(self) -> dict:
+        with self._lock:
+            turnos = self.prompt_turnos
+            return {
+                "sesiones_en_memoria": len(self._sesiones),
+                "persistencia": self._db is not None,
+                "turnos": turnos,
+                "prompt_chars_promedio": round(self.prompt_chars / turnos) if turnos else 0,
+                "prompt_chars_promedio_sin_sesion": round(self.prompt_chars_sin_sesion / turnos) if turnos else 0,
+                "ahorro": round(1 - self.prompt_chars / self.prompt_chars_sin_sesion, 3)
+                          if self.prompt_chars_sin_sesion else 0.0,
+            }
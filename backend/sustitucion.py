@@ -0,0 +1,179 @@
+"""
+Motor de sustitución de /api/generate.
+
+Todos los placeholders se compilan en una sola expresión (un trie, ver
+_regex_trie) y el contrato se recorre una vez, reemplazando cada
+coincidencia por el valor que le corresponde. El texto fuera de las
+coincidencias queda intacto, incluidos espacios y saltos de línea.
+
+Se mantienen las reglas del reemplazo anterior:
+- Primero se busca el placeholder exacto.
+- Las variables que no aparecen exactas se buscan en una segunda pasada con
+  los espacios flexibles (cualquier cantidad de blancos entre palabras), sólo
+  sobre el texto original: nunca dentro de un valor ya insertado.
+- Con `replace_all` una variable reemplaza todas las apariciones; sin él
+  consume sólo una. Varias variables con el mismo placeholder se reparten
+  las apariciones en el orden en que llegan.
+- `keep_prefix`/`keep_suffix`: los primeros/últimos caracteres del
+  placeholder son contexto (un rótulo como "DNI N° " o las palabras que
+  hacen único a un hueco "......" del detector) y quedan en el texto; sólo
+  se reemplaza lo que está entre ellos.
+"""
+
+import re
+from dataclasses import dataclass
+
+
+@dataclass
+class Reemplazo:
+    key: str
+    placeholder: str
+    value: str
+    replace_all: bool = True
+    keep_prefix: int = 0     # caracteres iniciales del placeholder que son contexto y se conservan
+    keep_suffix: int = 0     # ídem, al final
+    aplicado: int = 0        # cantidad de apariciones reemplazadas
+    capa: str = ""           # "exacta" o "espacios"
+
+
+class _Insertado(str):
+    """Valor ya insertado: las pasadas siguientes no buscan dentro de él."""
+
+
+class _Cola:
+    """Variables que comparten un mismo placeholder, en orden de llegada."""
+
+    def __init__(self):
+        self.variables: list[Reemplazo] = []
+        self.pos = 0
+
+    def siguiente(self):
+        while self.pos < len(self.variables):
+            var = self.variables[self.pos]
+            if var.replace_all or var.aplicado == 0:
+                return var
+            self.pos += 1
+        return None
+
+
+def _regex_trie(textos: list[str], token) -> str:
+    """
+    Expresión equivalente a la alternancia de `textos`, pero armada como un
+    trie: en cada posición el motor sigue una sola rama en vez de probar
+    cada placeholder. Los opcionales son codiciosos, así que gana el más largo.
+    """
+    raiz: dict = {}
+    for texto in textos:
+        nodo = raiz
+        for c in texto:
+            nodo = nodo.setdefault(c, {})
+        nodo[""] = True
+
+    def armar(nodo) -> str:
+        partes = []
+        # Cadenas sin bifurcaciones: se concatenan sin agrupar
+        while len(nodo) == 1 and "" not in nodo:
+            c, nodo = next(iter(nodo.items()))
+            partes.append(token(c))
+        ramas = [token(c) + armar(hijo) for c, hijo in nodo.items() if c != ""]
+        if ramas:
+            cuerpo = ramas[0] if len(ramas) == 1 else "(?:" + "|".join(ramas) + ")"
+            partes.append(f"(?:{cuerpo})?" if "" in nodo else cuerpo)
+        return "".join(partes)
+
+    return armar(raiz)
+
+
+def _token_flexible(c: str) -> str:
+    return r'\s*' if c == " " else re.escape(c)
+
+
+def _sin_espacios(texto: str) -> str:
+    return "".join(texto.split())
+
+
+def _largo_flexible(encontrado: str, contexto: str) -> int:
+    """Caracteres de `encontrado` que cubren `contexto` cuando los blancos difieren."""
+    restantes = len(_sin_espacios(contexto))
+    i = 0
+    while i < len(encontrado) and restantes:
+        if not encontrado[i].isspace():
+            restantes -= 1
+        i += 1
+    while i < len(encontrado) and encontrado[i].isspace():
+        i += 1
+    return i
+
+
+def _contexto_conservado(var: Reemplazo, encontrado: str) -> tuple[str, str]:
+    """Partes inicial y final de la coincidencia que son contexto (`keep_prefix`/`keep_suffix`)."""
+    prefijo = sufijo = ""
+    if var.keep_prefix > 0:
+        contexto = var.placeholder[:var.keep_prefix]
+        n = len(contexto) if encontrado.startswith(contexto) else _largo_flexible(encontrado, contexto)
+        prefijo = encontrado[:n]
+    if var.keep_suffix > 0:
+        contexto = var.placeholder[-var.keep_suffix:]
+        n = len(contexto) if encontrado.endswith(contexto) else \
+            _largo_flexible(encontrado[::-1], contexto[::-1])
+        sufijo = encontrado[len(encontrado) - n:]
+    return prefijo, sufijo
+
+
+def _pasada(piezas: list[str], variables: list[Reemplazo], flexible: bool, capa: str) -> list[str]:
+    # Exacta: se agrupa por el placeholder tal cual. Flexible: por sus palabras
+    # separadas con un espacio, y cualquier cantidad de blancos las separa en el texto.
+    colas: dict[str, _Cola] = {}
+    for var in variables:
+        clave = " ".join(var.placeholder.split()) if flexible else var.placeholder
+        colas.setdefault(clave, _Cola()).variables.append(var)
+    if not colas:
+        return piezas
+
+    if flexible:
+        matcher = re.compile(_regex_trie(list(colas), _token_flexible))
+        candidatas: dict[str, list] = {}
+        for clave in colas:
+            candidatas.setdefault(_sin_espacios(clave), []).append(
+                (re.compile(_regex_trie([clave], _token_flexible)), colas[clave]))
+
+        def cola_de(encontrado: str):
+            for patron, cola in candidatas[_sin_espacios(encontrado)]:
+                if patron.fullmatch(encontrado):
+                    return cola
+    else:
+        matcher = re.compile(_regex_trie(list(colas), re.escape))
+        cola_de = colas.get
+
+    salida = []
+    for pieza in piezas:
+        if isinstance(pieza, _Insertado):
+            salida.append(pieza)
+            continue
+        ultimo = 0
+        for m in matcher.finditer(pieza):
+            cola = cola_de(m.group(0))
+            var = cola.siguiente() if cola else None
+            if var is None:
+                continue
+            prefijo, sufijo = _contexto_conservado(var, m.group(0))
+            salida.append(pieza[ultimo:m.start()] + prefijo)
+            salida.append(_Insertado(var.value))
+            salida.append(_Insertado(sufijo))
+            var.aplicado += 1
+            var.capa = var.capa or capa
+            ultimo = m.end()
+        salida.append(pieza[ultimo:])
+    return salida
+
+
+def aplicar_reemplazos(texto: str, variables: list[Reemplazo]) -> str:
+    """
+    Aplica todas las variables (con valor y placeholder) sobre `texto` y
+    devuelve el resultado; cada Reemplazo queda con `aplicado` y `capa`.
+    """
+    activas = [v for v in variables if v.value and v.placeholder]
+    piezas = _pasada([texto], activas, False, "exacta")
+    sin_match = [v for v in activas if not v.aplicado]
+    piezas = _pasada(piezas, sin_match, True, "espacios")
+    return "".join(piezas)
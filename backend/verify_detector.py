@@ -0,0 +1,57 @@
+import sys
+import os
+
+# Ejecutar desde la raíz del repo: python backend/verify_detector.py
+sys.path.append(os.path.join(os.getcwd(), 'backend'))
+from detector import detectar_variables, variables_en_orden
+from sustitucion import Reemplazo, aplicar_reemplazos
+
+CONTRATO = (
+    "En la ciudad de .........., a los ..... días del mes de ..........., "
+    "entre el Sr. ....................., DNI N° ............, en adelante EL LOCADOR, "
+    "y el Sr. ....................., DNI N° ............, en adelante EL LOCATARIO. "
+    "PRIMERA: el precio es de $ ........ mensuales, pagaderos en .........."
+)
+
+
+def generar(texto, variables, valores):
+    reemplazos = [
+        Reemplazo(v["key"], v["placeholder_text"], valores.get(v["key"], ""),
+                  v.get("replace_all", True), v.get("keep_prefix", 0), v.get("keep_suffix", 0))
+        for v in variables
+    ]
+    return aplicar_reemplazos(texto, reemplazos)
+
+
+def test_placeholders_unicos():
+    variables = variables_en_orden(detectar_variables(CONTRATO), {})
+    for v in variables:
+        assert CONTRATO.count(v["placeholder_text"]) == 1, v["placeholder_text"]
+    print(f"{len(variables)} huecos, todos con placeholder único")
+    return variables
+
+
+def test_hueco_vacio_no_corre_los_demas():
+    variables = test_placeholders_unicos()
+    valores = {v["key"]: f"<{v['key']}>" for v in variables}
+    ciudad = variables[0]["key"]
+    valores[ciudad] = ""          # el primer hueco queda sin completar
+
+    resultado = generar(CONTRATO, variables, valores)
+    print(f"Resultado:\n{resultado}")
+
+    assert "ciudad de .........." in resultado          # el hueco vacío queda intacto
+    precio = next(v["key"] for v in variables if "$" in v["placeholder_text"])
+    assert f"$ <{precio}> mensuales" in resultado       # el precio va a su lugar
+    assert "DNI N° <dniLocador>" in resultado            # el rótulo se conserva
+    assert "DNI N° <dniLocatario>" in resultado
+    assert "Sr. <nombreLocador>" in resultado
+
+
+if __name__ == "__main__":
+    try:
+        test_hueco_vacio_no_corre_los_demas()
+        print("\n¡Verificación del detector exitosa!")
+    except AssertionError as e:
+        print(f"\nError en la verificación: {e}")
+        sys.exit(1)
@@ -7,12 +7,26 @@ Usa IA (Claude o OpenAI) para marcar variables con {{NOMBRE_VARIABLE}}.
 Uso:
     python convertir_pdf.py "contrato vivienda.pdf" --tipo vivienda
     python convertir_pdf.py "contrato local.docx" --tipo comercial
+    python convertir_pdf.py "contrato.pdf" --workers 4 --sin-cache
+    python convertir_pdf.py contratos/ --lote-workers 3        (carpeta o glob: en lote)
+    python convertir_pdf.py bandeja/ --vigilar --intervalo 10   (convierte lo que va llegando)
+
+Las paginas de un PDF se extraen en paralelo (un pool de procesos) y el
+texto de cada una queda en cache por (hash del archivo, numero de pagina):
+volver a convertir el mismo PDF no vuelve a extraer nada.
 """
 
 import sys
 import os
 import re
+import time
+import json
+import glob
+import hashlib
 import argparse
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from typing import Optional
 
 # Cargar .env
 try:
@@ -23,6 +37,24 @@ except ImportError:
 
 AI_PROVIDER = os.getenv("AI_PROVIDER", "openai").lower().strip()
 
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+CACHE_PAGINAS_DIR = os.getenv("CONVERTIR_CACHE_DIR", os.path.join(BASE_DIR, "cache", "paginas"))
+# Cambiarla si cambia la forma de extraer: invalida el texto ya guardado
+EXTRACCION_VERSION = "1"
+
+# Contratos largos: tamaño maximo de cada parte, contexto que se repite de la
+# parte anterior y llamadas a la IA en simultaneo
+MAX_PARTE = int(os.getenv("CONVERTIR_MAX_PARTE", "14000"))
+SOLAPAMIENTO = int(os.getenv("CONVERTIR_SOLAPAMIENTO", "400"))
+IA_WORKERS = int(os.getenv("CONVERTIR_IA_WORKERS", "8"))
+
+# OCR: una pagina con menos caracteres que esto en su capa de texto se trata
+# como imagen. El texto reconocido queda en cache por hash de la pagina.
+OCR_IDIOMA = os.getenv("OCR_IDIOMA", "spa")
+OCR_DPI = int(os.getenv("OCR_DPI", "300"))
+OCR_MIN_CHARS = int(os.getenv("OCR_MIN_CHARS", "20"))
+OCR_VERSION = "1"
+
 # ─── Instalar pdfplumber solo si se necesita ─────────────────────────────────
 try:
     import pdfplumber
@@ -30,48 +62,241 @@ try:
 except ImportError:
     PDF_OK = False
 
+# OCR local para paginas escaneadas (opcional): pytesseract + Tesseract instalado
+try:
+    import pytesseract
+    if os.getenv("TESSERACT_CMD"):
+        pytesseract.pytesseract.tesseract_cmd = os.getenv("TESSERACT_CMD")
+    OCR_OK = True
+except ImportError:
+    OCR_OK = False
+
 # ─── Configurar cliente de IA ────────────────────────────────────────────────
-if AI_PROVIDER == "claude":
-    try:
-        import anthropic
-        ai_client = anthropic.Anthropic(api_key=os.getenv("CLAUDE_API_KEY"))
-        AI_MODEL = os.getenv("CLAUDE_MODEL", "claude-sonnet-4-5")
-        print(f"[IA] Claude / {AI_MODEL}")
-    except ImportError:
-        print("Falta instalar anthropic: backend\\venv\\Scripts\\pip install anthropic")
-        sys.exit(1)
-else:
-    try:
-        from openai import OpenAI
-        ai_client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
-        AI_MODEL = os.getenv("OPENAI_MODEL", "gpt-4o")
-        print(f"[IA] OpenAI / {AI_MODEL}")
-    except ImportError:
-        print("Falta instalar openai: backend\\venv\\Scripts\\pip install openai")
-        sys.exit(1)
+# Se configura desde main(): los procesos del pool de extraccion importan
+# este modulo y no necesitan (ni deben anunciar) un cliente propio.
+ai_client = None
+AI_MODEL = ""
+
+
+def configurar_ia():
+    global ai_client, AI_MODEL
+    if AI_PROVIDER == "claude":
+        try:
+            import anthropic
+            ai_client = anthropic.Anthropic(api_key=os.getenv("CLAUDE_API_KEY"))
+            AI_MODEL = os.getenv("CLAUDE_MODEL", "claude-sonnet-4-5")
+            print(f"[IA] Claude / {AI_MODEL}")
+        except ImportError:
+            print("Falta instalar anthropic: backend\\venv\\Scripts\\pip install anthropic")
+            sys.exit(1)
+    else:
+        try:
+            from openai import OpenAI
+            ai_client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+            AI_MODEL = os.getenv("OPENAI_MODEL", "gpt-4o")
+            print(f"[IA] OpenAI / {AI_MODEL}")
+        except ImportError:
+            print("Falta instalar openai: backend\\venv\\Scripts\\pip install openai")
+            sys.exit(1)
 
 
 # ─── Extraccion de texto ─────────────────────────────────────────────────────
 
-def extraer_texto_pdf(ruta: str) -> str:
+class ErrorConversion(Exception):
+    """Un archivo que no se puede convertir (formato, dependencia faltante, PDF sin texto)."""
+
+
+# En modo lote varios archivos avanzan a la vez: no se muestran lineas de progreso
+MOSTRAR_PROGRESO = True
+
+
+class Progreso:
+    """Linea de progreso con porcentaje, velocidad y tiempo restante estimado."""
+
+    def __init__(self, total: int, etiqueta: str):
+        self.total = total
+        self.etiqueta = etiqueta
+        self.hechas = 0
+        self.inicio = time.monotonic()
+
+    def avanzar(self, n: int = 1):
+        self.hechas += n
+        if not MOSTRAR_PROGRESO:
+            return
+        transcurrido = time.monotonic() - self.inicio
+        linea = f"      {self.etiqueta} {self.hechas}/{self.total} ({self.hechas * 100 // max(self.total, 1)}%)"
+        if transcurrido > 0 and self.hechas:
+            velocidad = self.hechas / transcurrido
+            restante = (self.total - self.hechas) / velocidad
+            linea += f" - {velocidad:.1f}/s - faltan ~{restante:.0f}s"
+        print(linea.ljust(72), end="\r", flush=True)
+
+    def terminar(self):
+        if MOSTRAR_PROGRESO:
+            print()
+
+
+def hash_archivo(ruta: str) -> str:
+    h = hashlib.sha256()
+    with open(ruta, "rb") as f:
+        for bloque in iter(lambda: f.read(1024 * 1024), b""):
+            h.update(bloque)
+    return h.hexdigest()
+
+
+def _ruta_cache_pagina(dir_cache: str, numero: int) -> str:
+    return os.path.join(dir_cache, f"{numero:05d}.txt")
+
+
+def _leer_cache_pagina(dir_cache: str, numero: int) -> Optional[str]:
+    try:
+        with open(_ruta_cache_pagina(dir_cache, numero), "r", encoding="utf-8") as f:
+            return f.read()
+    except FileNotFoundError:
+        return None
+
+
+def _guardar_cache_pagina(dir_cache: str, numero: int, texto: str):
+    ruta = _ruta_cache_pagina(dir_cache, numero)
+    temporal = f"{ruta}.{os.getpid()}.tmp"
+    with open(temporal, "w", encoding="utf-8") as f:
+        f.write(texto)
+    os.replace(temporal, ruta)
+
+
+def _extraer_paginas(ruta: str, numeros: list[int]) -> list[tuple[int, str]]:
+    """Se ejecuta en el pool: abre el PDF una vez y extrae un bloque de paginas."""
+    with pdfplumber.open(ruta) as pdf:
+        return [(n, pdf.pages[n - 1].extract_text() or "") for n in numeros]
+
+
+def _huella_pagina(pagina) -> str:
+    """Hash de los streams de contenido e imagenes de la pagina (no depende del archivo)."""
+    h = hashlib.sha256()
+    for stream in pagina.page_obj.contents or []:
+        h.update(stream.get_rawdata() or b"")
+    for imagen in pagina.images:
+        h.update(imagen["stream"].get_rawdata() or b"")
+    return h.hexdigest()
+
+
+def ocr_disponible() -> bool:
+    if not OCR_OK:
+        return False
+    try:
+        pytesseract.get_tesseract_version()
+        return True
+    except (pytesseract.TesseractNotFoundError, OSError):
+        return False
+
+
+def _ocr_paginas(ruta: str, numeros: list[int], dir_cache: Optional[str]) -> list[tuple[int, str]]:
+    """Se ejecuta en el pool: rasteriza y reconoce paginas, con cache por hash de pagina."""
+    # Un hilo de Tesseract por proceso: el paralelismo lo da el pool
+    os.environ["OMP_THREAD_LIMIT"] = "1"
+    resultado = []
+    with pdfplumber.open(ruta) as pdf:
+        for n in numeros:
+            pagina = pdf.pages[n - 1]
+            ruta_cache = None
+            if dir_cache:
+                huella = _huella_pagina(pagina)
+                ruta_cache = os.path.join(dir_cache, huella[:2], f"{huella}.txt")
+                try:
+                    with open(ruta_cache, "r", encoding="utf-8") as f:
+                        resultado.append((n, f.read()))
+                    continue
+                except FileNotFoundError:
+                    pass
+            imagen = pagina.to_image(resolution=OCR_DPI).original
+            texto = pytesseract.image_to_string(imagen, lang=OCR_IDIOMA).strip()
+            if ruta_cache:
+                os.makedirs(os.path.dirname(ruta_cache), exist_ok=True)
+                temporal = f"{ruta_cache}.{os.getpid()}.tmp"
+                with open(temporal, "w", encoding="utf-8") as f:
+                    f.write(texto)
+                os.replace(temporal, ruta_cache)
+            resultado.append((n, texto))
+    return resultado
+
+
+def _en_paralelo(funcion, ruta: str, bloques: list[list[int]], workers: int, registrar, *extra):
+    """Reparte los bloques de paginas en un pool de procesos (o en este proceso si workers == 1)."""
+    if workers == 1:
+        for bloque in bloques:
+            registrar(funcion(ruta, bloque, *extra))
+        return
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futuros = [pool.submit(funcion, ruta, bloque, *extra) for bloque in bloques]
+        for futuro in as_completed(futuros):
+            registrar(futuro.result())
+
+
+def extraer_texto_pdf(ruta: str, workers: Optional[int] = None, usar_cache: bool = True,
+                      huella: Optional[str] = None, usar_ocr: bool = True) -> str:
     if not PDF_OK:
-        print("Falta pdfplumber: backend\\venv\\Scripts\\pip install pdfplumber")
-        sys.exit(1)
+        raise ErrorConversion("Falta pdfplumber: backend\\venv\\Scripts\\pip install pdfplumber")
     print(f"[PDF] Leyendo: {ruta}")
-    partes = []
     with pdfplumber.open(ruta) as pdf:
         total = len(pdf.pages)
-        print(f"      {total} pagina(s)")
-        for i, pag in enumerate(pdf.pages, 1):
-            t = pag.extract_text()
-            if t:
-                partes.append(t)
-            print(f"      Pagina {i}/{total}...", end="\r")
-    print()
-    texto = "\n".join(partes)
+    print(f"      {total} pagina(s)")
+
+    dir_cache = os.path.join(CACHE_PAGINAS_DIR, f"v{EXTRACCION_VERSION}", huella or hash_archivo(ruta))
+    paginas: dict[int, str] = {}
+    if usar_cache:
+        os.makedirs(dir_cache, exist_ok=True)
+        for n in range(1, total + 1):
+            texto = _leer_cache_pagina(dir_cache, n)
+            if texto is not None:
+                paginas[n] = texto
+        if paginas:
+            print(f"      {len(paginas)} pagina(s) ya extraidas (cache)")
+    pendientes = [n for n in range(1, total + 1) if n not in paginas]
+
+    if pendientes:
+        workers = max(1, min(workers or os.cpu_count() or 1, len(pendientes)))
+        progreso = Progreso(len(pendientes), "Pagina")
+        # Bloques chicos para que el progreso avance seguido; cada bloque abre el PDF una vez
+        tam_bloque = max(1, min(8, -(-len(pendientes) // (workers * 4))))
+        bloques = [pendientes[i:i + tam_bloque] for i in range(0, len(pendientes), tam_bloque)]
+
+        def registrar(resultado):
+            for n, texto in resultado:
+                paginas[n] = texto
+                if usar_cache:
+                    _guardar_cache_pagina(dir_cache, n, texto)
+            progreso.avanzar(len(resultado))
+
+        _en_paralelo(_extraer_paginas, ruta, bloques, workers, registrar)
+        progreso.terminar()
+
+    # Paginas sin capa de texto (escaneadas): OCR solo para esas
+    sin_texto = [n for n in range(1, total + 1) if len(paginas[n].strip()) < OCR_MIN_CHARS]
+    if sin_texto and usar_ocr and ocr_disponible():
+        print(f"[OCR] {len(sin_texto)} pagina(s) sin texto, reconociendo ({OCR_IDIOMA}, {OCR_DPI} dpi)...")
+        dir_ocr = os.path.join(CACHE_PAGINAS_DIR, "ocr", f"v{OCR_VERSION}-{OCR_IDIOMA}-{OCR_DPI}") \
+            if usar_cache else None
+        workers_ocr = max(1, min(workers or os.cpu_count() or 1, len(sin_texto)))
+        progreso = Progreso(len(sin_texto), "Pagina OCR")
+
+        def registrar_ocr(resultado):
+            for n, texto in resultado:
+                if len(texto.strip()) > len(paginas[n].strip()):
+                    paginas[n] = texto
+            progreso.avanzar(len(resultado))
+
+        # De a una pagina: cada una tarda segundos y asi el progreso es real
+        _en_paralelo(_ocr_paginas, ruta, [[n] for n in sin_texto], workers_ocr, registrar_ocr, dir_ocr)
+        progreso.terminar()
+    elif sin_texto and usar_ocr:
+        print(f"[OCR] {len(sin_texto)} pagina(s) sin texto; OCR no disponible "
+              f"(backend\\venv\\Scripts\\pip install pytesseract y Tesseract con idioma '{OCR_IDIOMA}')")
+
+    # Se rearma en el orden de las paginas, no en el que terminaron los workers
+    texto = "\n".join(paginas[n] for n in range(1, total + 1) if paginas[n])
     if not texto.strip():
-        print("El PDF parece ser una imagen escaneada. Necesita OCR.")
-        sys.exit(1)
+        raise ErrorConversion("El PDF parece ser una imagen escaneada. Necesita OCR: instale "
+                              "pytesseract y Tesseract (TESSERACT_CMD si no esta en el PATH).")
     print(f"[OK] {len(texto):,} caracteres extraidos")
     return texto
 
@@ -80,8 +305,7 @@ def extraer_texto_docx(ruta: str) -> str:
     try:
         from docx import Document as DocxDoc
     except ImportError:
-        print("Falta python-docx: backend\\venv\\Scripts\\pip install python-docx")
-        sys.exit(1)
+        raise ErrorConversion("Falta python-docx: backend\\venv\\Scripts\\pip install python-docx")
     print(f"[DOCX] Leyendo: {ruta}")
     doc = DocxDoc(ruta)
     partes = [p.text for p in doc.paragraphs if p.text.strip()]
@@ -95,10 +319,11 @@ def extraer_texto_docx(ruta: str) -> str:
     return texto
 
 
-def extraer_texto(ruta: str) -> str:
+def extraer_texto(ruta: str, workers: Optional[int] = None, usar_cache: bool = True,
+                  huella: Optional[str] = None, usar_ocr: bool = True) -> str:
     ext = os.path.splitext(ruta)[1].lower()
     if ext == ".pdf":
-        return extraer_texto_pdf(ruta)
+        return extraer_texto_pdf(ruta, workers, usar_cache, huella, usar_ocr)
     elif ext in (".docx", ".doc"):
         return extraer_texto_docx(ruta)
     elif ext == ".txt":
@@ -107,13 +332,12 @@ def extraer_texto(ruta: str) -> str:
         print(f"[OK] {len(texto):,} caracteres leidos")
         return texto
     else:
-        print(f"Formato no soportado: {ext}")
-        sys.exit(1)
+        raise ErrorConversion(f"Formato no soportado: {ext}")
 
 
 # ─── Llamada a IA ─────────────────────────────────────────────────────────────
 
-def llamar_ia(system_prompt: str, user_message: str) -> str:
+def llamar_ia(system_prompt: str, user_message: str, json_mode: bool = False) -> str:
     if AI_PROVIDER == "claude":
         r = ai_client.messages.create(
             model=AI_MODEL,
@@ -130,14 +354,168 @@ def llamar_ia(system_prompt: str, user_message: str) -> str:
                 {"role": "system", "content": system_prompt},
                 {"role": "user", "content": user_message}
             ],
-            temperature=0.1
+            temperature=0.1,
+            **({"response_format": {"type": "json_object"}} if json_mode else {})
         )
         return r.choices[0].message.content
 
 
+# ─── Division en partes ───────────────────────────────────────────────────────
+#
+# Las partes se cortan en limites de clausula (encabezados CLAUSULA, ARTICULO,
+# PRIMERA:, "3." ...) o en lineas en blanco, nunca en medio de una palabra o
+# de un dato. Cada parte (salvo la primera) lleva como referencia el final de
+# la anterior; si la IA propone ediciones ahi, coinciden con las de la parte
+# anterior y se aplican una sola vez.
+
+ENCABEZADO_RE = re.compile(
+    r'^[ \t]*(?:'
+    r'(?:CL[ÁA]USULA|ART[ÍI]CULO|T[ÍI]TULO|ANEXO|Cl[áa]usula|Art[íi]culo|T[íi]tulo|Anexo)\b'
+    r'|(?:PRIMER[AO]|SEGUND[AO]|TERCER[AO]|CUART[AO]|QUINT[AO]|SEXT[AO]|S[ÉE]PTIM[AO]|OCTAV[AO]'
+    r'|NOVEN[AO]|D[ÉE]CIM[AO]|UND[ÉE]CIM[AO]|DUOD[ÉE]CIM[AO])\b[^\n]{0,30}?[:.\-]'
+    r'|\d{1,3}[.\-)]\s)',
+    re.MULTILINE,
+)
+LINEA_EN_BLANCO_RE = re.compile(r'\n[ \t]*\n\s*')
+
+
+def _cortes_naturales(texto: str) -> list[int]:
+    cortes = {0, len(texto)}
+    cortes.update(m.start() for m in ENCABEZADO_RE.finditer(texto))
+    cortes.update(m.end() for m in LINEA_EN_BLANCO_RE.finditer(texto))
+    return sorted(cortes)
+
+
+def _cortar_largo(segmento: str, maximo: int) -> list[str]:
+    """Una clausula mas larga que el maximo: se corta en saltos de linea, fin de oracion o espacios."""
+    partes = []
+    while len(segmento) > maximo:
+        ventana = segmento[:maximo]
+        corte = ventana.rfind("\n") + 1
+        if corte < maximo // 2:
+            corte = max(ventana.rfind(". ") + 2, corte)
+        if corte < maximo // 2:
+            corte = max(ventana.rfind(" ") + 1, corte)
+        if corte <= 0:
+            corte = maximo
+        partes.append(segmento[:corte])
+        segmento = segmento[corte:]
+    partes.append(segmento)
+    return partes
+
+
+def dividir_en_clausulas(texto: str, maximo: int = MAX_PARTE) -> list[str]:
+    """Agrupa clausulas enteras en partes de hasta `maximo` caracteres; "".join(partes) == texto."""
+    cortes = _cortes_naturales(texto)
+    partes = []
+    actual = ""
+    for inicio, fin in zip(cortes, cortes[1:]):
+        segmento = texto[inicio:fin]
+        if len(actual) + len(segmento) <= maximo:
+            actual += segmento
+            continue
+        if actual:
+            partes.append(actual)
+        trozos = _cortar_largo(segmento, maximo)
+        partes.extend(trozos[:-1])
+        actual = trozos[-1]
+    if actual:
+        partes.append(actual)
+    return partes
+
+
+def _contexto_previo(parte: str, largo: int) -> str:
+    """Final de `parte` de hasta `largo` caracteres, empezando en un inicio de linea si se puede."""
+    if largo <= 0 or not parte.strip():
+        return ""
+    cola = parte.rstrip()[-largo:]
+    salto = cola.find("\n")
+    if 0 <= salto < len(cola) - 1:
+        return cola[salto + 1:]
+    espacio = cola.find(" ")
+    return cola[espacio + 1:] if espacio >= 0 else cola
+
+
 # ─── Marcado de variables ─────────────────────────────────────────────────────
+#
+# La IA no devuelve el contrato: devuelve una lista de ediciones (fragmento
+# del original que ubica el dato, el dato y el marcador) y las ediciones se
+# aplican aca sobre el texto extraido. La respuesta son unos cientos de tokens
+# aunque el contrato sea largo, y todo lo que no es un dato queda identico
+# byte a byte: la IA no puede reescribir clausulas. Solo se reemplaza dentro
+# de los fragmentos que indico la IA (una edicion por aparicion): un dato que
+# tambien figura en texto fijo ("Buenos Aires" en la clausula de jurisdiccion)
+# no se toca ahi.
+
+
+def _patron_flexible(texto: str) -> str:
+    """El texto con cualquier blanco entre palabras (el PDF corta lineas donde quiere)."""
+    return r'\s+'.join(re.escape(p) for p in texto.split())
 
-def marcar_variables(texto: str, tipo: str) -> str:
+
+def _nombre_marcador(marcador: str) -> str:
+    return re.sub(r'[^A-Z0-9_]', '', marcador.strip().strip("{}").strip().upper().replace(" ", "_"))
+
+
+def parsear_ediciones(respuesta: str) -> list[dict]:
+    """Acepta {"ediciones": [...]} o una lista, con o sin bloque ```json."""
+    texto = re.sub(r'^\s*```(?:json)?|```\s*$', '', respuesta.strip())
+    inicio = min((i for i in (texto.find("{"), texto.find("[")) if i >= 0), default=-1)
+    try:
+        datos = json.loads(texto[inicio:]) if inicio >= 0 else None
+    except json.JSONDecodeError:
+        datos = None
+    if isinstance(datos, dict):
+        datos = datos.get("ediciones")
+    if not isinstance(datos, list):
+        raise ErrorConversion("La IA no devolvio una lista de ediciones valida")
+    return [e for e in datos if isinstance(e, dict)]
+
+
+def aplicar_ediciones(texto: str, ediciones: list[dict]) -> tuple[str, list[dict]]:
+    """
+    Reemplaza cada dato por {{MARCADOR}} y devuelve (texto marcado, ediciones
+    que no se encontraron). El dato se busca como palabra completa dentro de
+    cada aparicion del fragmento ("2" no toca el "20" de un DNI); si aparece
+    mas de una vez en el fragmento se toma la ultima. El resto del texto no
+    se toca.
+    """
+    tramos = []           # (inicio, fin, marcador)
+    no_encontradas = []
+    for edicion in ediciones:
+        valor = str(edicion.get("valor") or "").strip()
+        fragmento = str(edicion.get("fragmento") or "").strip() or valor
+        marcador = _nombre_marcador(str(edicion.get("marcador") or ""))
+        if not valor or not marcador:
+            no_encontradas.append(edicion)
+            continue
+
+        patron_valor = re.compile(r'(?<!\w)' + _patron_flexible(valor) + r'(?!\w)')
+        antes = len(tramos)
+        for m in re.finditer(_patron_flexible(fragmento), texto):
+            apariciones = list(patron_valor.finditer(m.group(0)))
+            if apariciones:
+                v = apariciones[-1]
+                tramos.append((m.start() + v.start(), m.start() + v.end(), marcador))
+        if len(tramos) == antes:
+            no_encontradas.append(edicion)
+
+    # Una sola pasada en orden; ante superposiciones gana el tramo que empieza
+    # antes y, si empiezan juntos, el mas largo
+    tramos.sort(key=lambda t: (t[0], t[0] - t[1]))
+    salida = []
+    pos = 0
+    for inicio, fin, marcador in tramos:
+        if inicio < pos:
+            continue
+        salida.append(texto[pos:inicio])
+        salida.append("{{" + marcador + "}}")
+        pos = fin
+    salida.append(texto[pos:])
+    return "".join(salida), no_encontradas
+
+
+def marcar_variables(texto: str, tipo: str, ia_workers: Optional[int] = None) -> str:
     contextos = {
         "vivienda":  "contrato de alquiler de vivienda residencial",
         "comercial": "contrato de alquiler de local comercial",
@@ -149,44 +527,250 @@ def marcar_variables(texto: str, tipo: str) -> str:
 
 Recibes el texto de un {ctx} con datos REALES ya escritos.
 
-TAREA: Reemplaza cada dato variable con {{{{NOMBRE_EN_MAYUSCULAS}}}} y devuelve el contrato COMPLETO.
+TAREA: Identifica cada dato variable y devuelve SOLO un JSON con la lista de
+ediciones a aplicar. NO devuelvas el contrato.
+
+FORMATO (JSON):
+{{"ediciones": [
+  {{"fragmento": "Sr. Juan Carlos Perez, DNI N° 20.123.456", "valor": "20.123.456", "marcador": "DNI_LOCADOR"}}
+]}}
 
 REGLAS CRITICAS:
-- Preserva EXACTAMENTE la redaccion, puntuacion y estructura original
-- NO resumas, NO reescribas, NO modifiques clausulas
-- NO agregues texto que no exista en el original
-- Si un dato aparece varias veces, usa SIEMPRE el mismo marcador
-- Devuelve SOLO el texto del contrato marcado, sin explicaciones
+- "fragmento": texto copiado EXACTO del contrato que contiene el dato y algunas palabras alrededor, para ubicarlo sin ambiguedad (maximo ~80 caracteres)
+- "valor": el dato EXACTO tal cual aparece dentro del fragmento; solo eso se reemplaza
+- "marcador": NOMBRE_EN_MAYUSCULAS, sin llaves
+- Si un dato aparece varias veces, incluye UNA EDICION POR CADA APARICION, cada una con su propio fragmento, y usa SIEMPRE el mismo marcador. Solo se reemplaza lo que indiques
+- NO incluyas texto legal fijo, solo datos de este contrato en particular
 
 VARIABLES TIPICAS A IDENTIFICAR:
-- Nombres completos          -> {{{{NOMBRE_LOCADOR}}}}, {{{{NOMBRE_LOCATARIO}}}}
-- DNI / CUIT                 -> {{{{DNI_LOCADOR}}}}, {{{{DNI_LOCATARIO}}}}
-- Domicilios reales          -> {{{{DOMICILIO_LOCADOR}}}}, {{{{DOMICILIO_LOCATARIO}}}}
-- Direccion del inmueble     -> {{{{DIRECCION_INMUEBLE}}}}
-- Ciudad / Provincia         -> {{{{CIUDAD}}}}, {{{{PROVINCIA}}}}
-- Fechas (inicio/firma)      -> {{{{FECHA_INICIO}}}}, {{{{DIA_FIRMA}}}}, {{{{MES_FIRMA}}}}, {{{{ANIO_FIRMA}}}}
-- Duracion / vencimiento     -> {{{{DURACION_MESES}}}}, {{{{FECHA_VENCIMIENTO}}}}
-- Montos en numeros          -> {{{{MONTO_ALQUILER_NUMEROS}}}}, {{{{MONTO_DEPOSITO}}}}
-- Montos en letras           -> {{{{MONTO_ALQUILER_LETRAS}}}}
-- Estado civil               -> {{{{ESTADO_CIVIL_LOCADOR}}}}, {{{{ESTADO_CIVIL_LOCATARIO}}}}
-- Nacionalidad               -> {{{{NACIONALIDAD_LOCATARIO}}}}
-- Garante (si hay)           -> {{{{NOMBRE_GARANTE}}}}, {{{{DNI_GARANTE}}}}, {{{{DOMICILIO_GARANTE}}}}
-- Local comercial (si aplica)-> {{{{RUBRO_COMERCIAL}}}}, {{{{SUPERFICIE_M2}}}}, {{{{CONDICION_AFIP}}}}"""
+- Nombres completos          -> NOMBRE_LOCADOR, NOMBRE_LOCATARIO
+- DNI / CUIT                 -> DNI_LOCADOR, DNI_LOCATARIO
+- Domicilios reales          -> DOMICILIO_LOCADOR, DOMICILIO_LOCATARIO
+- Direccion del inmueble     -> DIRECCION_INMUEBLE
+- Ciudad / Provincia         -> CIUDAD, PROVINCIA
+- Fechas (inicio/firma)      -> FECHA_INICIO, DIA_FIRMA, MES_FIRMA, ANIO_FIRMA
+- Duracion / vencimiento     -> DURACION_MESES, FECHA_VENCIMIENTO
+- Montos en numeros          -> MONTO_ALQUILER_NUMEROS, MONTO_DEPOSITO
+- Montos en letras           -> MONTO_ALQUILER_LETRAS
+- Estado civil               -> ESTADO_CIVIL_LOCADOR, ESTADO_CIVIL_LOCATARIO
+- Nacionalidad               -> NACIONALIDAD_LOCATARIO
+- Garante (si hay)           -> NOMBRE_GARANTE, DNI_GARANTE, DOMICILIO_GARANTE
+- Local comercial (si aplica)-> RUBRO_COMERCIAL, SUPERFICIE_M2, CONDICION_AFIP"""
 
     print("[IA] Analizando y marcando variables...")
-    print("     (puede tardar 20-40 segundos)")
 
-    MAX = 14000
-    if len(texto) <= MAX:
-        return llamar_ia(system_prompt, f"Aqui esta el contrato:\n\n{texto}")
+    partes = dividir_en_clausulas(texto, MAX_PARTE)
+    contextos_previos = [""] + [_contexto_previo(p, SOLAPAMIENTO) for p in partes[:-1]]
+    workers = max(1, min(ia_workers or IA_WORKERS, len(partes)))
+    if len(partes) > 1:
+        print(f"     Contrato largo ({len(texto):,} chars): {len(partes)} partes, {workers} en simultaneo...")
+
+    def mensaje(idx: int) -> str:
+        if len(partes) == 1:
+            return f"Aqui esta el contrato:\n\n{texto}"
+        encabezado = f"PARTE {idx + 1}/{len(partes)}"
+        if not contextos_previos[idx]:
+            return f"{encabezado}:\n\n{partes[idx]}"
+        return (f"{encabezado}. Lo que esta entre <<<CONTEXTO y CONTEXTO>>> es el final de la parte "
+                f"anterior, solo como referencia.\n\n"
+                f"<<<CONTEXTO\n{contextos_previos[idx]}\nCONTEXTO>>>\n\n{partes[idx]}")
+
+    respuestas = [""] * len(partes)
+    progreso = Progreso(len(partes), "Parte")
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futuros = {pool.submit(llamar_ia, system_prompt, mensaje(i), True): i for i in range(len(partes))}
+        for futuro in as_completed(futuros):
+            respuestas[futuros[futuro]] = futuro.result()
+            progreso.avanzar()
+    progreso.terminar()
+
+    # Ediciones en el orden de las partes; las repetidas (del contexto compartido) una sola vez
+    unicas = {}
+    for r in respuestas:
+        for e in parsear_ediciones(r):
+            unicas.setdefault((e.get("fragmento"), e.get("valor"), e.get("marcador")), e)
+    ediciones = list(unicas.values())
+    marcado, no_encontradas = aplicar_ediciones(texto, ediciones)
+    print(f"     {len(ediciones)} ediciones ({sum(len(r) for r in respuestas):,} chars de respuesta)")
+    for e in no_encontradas:
+        print(f"     [AVISO] No se encontro en el texto: {e.get('fragmento') or e.get('valor')!r} "
+              f"-> {e.get('marcador')}")
+    return marcado
+
+
+# ─── Lotes y carpeta vigilada ────────────────────────────────────────────────
+#
+# Un directorio o glob se procesa con una cantidad acotada de archivos en
+# simultaneo. El manifiesto (manifiesto.json en la carpeta de salida) guarda
+# por hash de archivo el resultado de cada conversion y se reescribe despues
+# de cada una: un archivo sin cambios se saltea y una corrida interrumpida
+# retoma desde donde quedo. Con --vigilar la carpeta se revisa cada
+# --intervalo segundos y se convierten los archivos nuevos.
+
+EXTENSIONES = (".pdf", ".docx", ".txt")
+MANIFIESTO = "manifiesto.json"
+
+
+class Manifiesto:
+    def __init__(self, ruta: str):
+        self.ruta = ruta
+        self._lock = threading.Lock()
+        # salida -> archivo de las conversiones en curso (todavia sin entrada)
+        self._reservadas: dict[str, str] = {}
+        try:
+            with open(ruta, "r", encoding="utf-8") as f:
+                self.archivos: dict[str, dict] = json.load(f)
+        except FileNotFoundError:
+            self.archivos = {}
+
+    def vigente(self, huella: str, tipo: str) -> bool:
+        """True si el archivo ya se convirtio con este tipo y la plantilla sigue en disco."""
+        datos = self.archivos.get(huella)
+        return (datos is not None and datos.get("estado") == "ok" and datos.get("tipo") == tipo
+                and os.path.exists(datos.get("salida", "")))
+
+    def salida_para(self, ruta: str, huella: str, destino: str) -> str:
+        """
+        Nombre_PLANTILLA.txt; si otro archivo ya usa ese nombre (registrado o
+        convirtiendose en este momento), se agrega el hash. El nombre queda
+        reservado hasta que registrar() anota la conversion.
+        """
+        base = os.path.splitext(os.path.basename(ruta))[0]
+        archivo = os.path.abspath(ruta)
+        with self._lock:
+            ocupadas = {os.path.normcase(s): a for s, a in self._reservadas.items()}
+            for d in self.archivos.values():
+                ocupadas.setdefault(os.path.normcase(d.get("salida", "")), d.get("archivo"))
+            salida = os.path.join(destino, f"{base}_PLANTILLA.txt")
+            if ocupadas.get(os.path.normcase(salida), archivo) != archivo:
+                salida = os.path.join(destino, f"{base}_{huella[:8]}_PLANTILLA.txt")
+            self._reservadas[salida] = archivo
+        return salida
+
+    def registrar(self, huella: str, datos: dict):
+        with self._lock:
+            # Una version anterior del mismo archivo deja de tener entrada propia
+            for vieja in [h for h, d in self.archivos.items() if d.get("archivo") == datos["archivo"]]:
+                del self.archivos[vieja]
+            self.archivos[huella] = datos
+            self._reservadas.pop(datos["salida"], None)
+            temporal = f"{self.ruta}.tmp"
+            with open(temporal, "w", encoding="utf-8") as f:
+                json.dump(self.archivos, f, ensure_ascii=False, indent=2)
+            os.replace(temporal, self.ruta)
+
+
+def listar_entrada(entrada: str) -> list[str]:
+    if os.path.isdir(entrada):
+        rutas = [os.path.join(entrada, n) for n in os.listdir(entrada)]
+    elif glob.has_magic(entrada):
+        rutas = glob.glob(entrada, recursive=True)
     else:
-        print(f"     Contrato largo ({len(texto):,} chars), procesando en partes...")
-        chunks = [texto[i:i+MAX] for i in range(0, len(texto), MAX)]
-        partes = []
-        for idx, chunk in enumerate(chunks, 1):
-            print(f"     Parte {idx}/{len(chunks)}...")
-            partes.append(llamar_ia(system_prompt, f"PARTE {idx}/{len(chunks)}:\n\n{chunk}"))
-        return "\n".join(partes)
+        rutas = [entrada]
+    return sorted(
+        r for r in rutas
+        if os.path.isfile(r) and r.lower().endswith(EXTENSIONES) and not r.endswith("_PLANTILLA.txt")
+    )
+
+
+def convertir_archivo(ruta: str, tipo: str, salida: str, workers: Optional[int] = None,
+                      usar_cache: bool = True, ia_workers: Optional[int] = None,
+                      huella: Optional[str] = None, usar_ocr: bool = True) -> list[str]:
+    """Extrae, marca y guarda la plantilla; devuelve las variables marcadas."""
+    texto = extraer_texto(ruta, workers, usar_cache, huella, usar_ocr)
+    texto_marcado = marcar_variables(texto, tipo, ia_workers)
+    with open(salida, "w", encoding="utf-8") as f:
+        f.write(texto_marcado)
+    return sorted(set(re.findall(r'\{\{([A-Z0-9_]+)\}\}', texto_marcado)))
+
+
+class Lote:
+    """Convierte archivos con a lo sumo `workers` en simultaneo, registrando cada uno en el manifiesto."""
+
+    def __init__(self, destino: str, tipo: str, workers: int, usar_cache: bool,
+                 ia_workers: Optional[int], usar_ocr: bool = True):
+        os.makedirs(destino, exist_ok=True)
+        self.destino = destino
+        self.tipo = tipo
+        self.usar_cache = usar_cache
+        self.ia_workers = ia_workers
+        self.usar_ocr = usar_ocr
+        self.manifiesto = Manifiesto(os.path.join(destino, MANIFIESTO))
+        self.pool = ThreadPoolExecutor(max_workers=workers)
+        # Cada conversion extrae con su parte de los CPUs
+        self.workers_extraccion = max(1, (os.cpu_count() or 1) // workers)
+        self.en_curso: set[str] = set()
+        self.futuros = []
+        self.convertidos = self.salteados = self.errores = 0
+        self._lock = threading.Lock()
+
+    def agregar(self, ruta: str) -> bool:
+        """Encola `ruta` si cambio desde la ultima conversion; False si se saltea."""
+        huella = hash_archivo(ruta)
+        with self._lock:
+            if huella in self.en_curso or self.manifiesto.vigente(huella, self.tipo):
+                self.salteados += 1
+                return False
+            self.en_curso.add(huella)
+        self.futuros.append(self.pool.submit(self._convertir, ruta, huella))
+        return True
+
+    def _convertir(self, ruta: str, huella: str):
+        salida = self.manifiesto.salida_para(ruta, huella, self.destino)
+        datos = {"archivo": os.path.abspath(ruta), "tipo": self.tipo, "salida": salida}
+        inicio = time.monotonic()
+        try:
+            variables = convertir_archivo(ruta, self.tipo, salida, self.workers_extraccion,
+                                          self.usar_cache, self.ia_workers, huella, self.usar_ocr)
+            datos.update(estado="ok", variables=len(variables))
+            with self._lock:
+                self.convertidos += 1
+            print(f"[LOTE] OK    {os.path.basename(ruta)} -> {os.path.basename(salida)} "
+                  f"({len(variables)} variables)")
+        except Exception as e:
+            datos.update(estado="error", error=str(e))
+            with self._lock:
+                self.errores += 1
+            print(f"[LOTE] ERROR {os.path.basename(ruta)}: {e}")
+        finally:
+            datos.update(segundos=round(time.monotonic() - inicio, 1),
+                         fecha=time.strftime("%Y-%m-%d %H:%M:%S"))
+            self.manifiesto.registrar(huella, datos)
+            with self._lock:
+                self.en_curso.discard(huella)
+
+    def esperar(self):
+        for futuro in self.futuros:
+            futuro.result()
+        self.futuros = [f for f in self.futuros if not f.done()]
+
+    def cerrar(self):
+        self.pool.shutdown(wait=True, cancel_futures=True)
+
+    def resumen(self) -> str:
+        return (f"{self.convertidos} convertido(s), {self.salteados} sin cambios, "
+                f"{self.errores} con error")
+
+
+def vigilar(carpeta: str, lote: Lote, intervalo: float):
+    """Revisa `carpeta` cada `intervalo` segundos; un archivo se encola cuando deja de crecer."""
+    print(f"[VIGILAR] {carpeta} (cada {intervalo:g}s, Ctrl+C para salir)")
+    vistos: dict[str, tuple] = {}
+    procesados: dict[str, tuple] = {}
+    while True:
+        for ruta in listar_entrada(carpeta):
+            try:
+                st = os.stat(ruta)
+            except FileNotFoundError:
+                continue
+            firma = (st.st_size, st.st_mtime)
+            # Igual que en la revision anterior: ya termino de copiarse
+            if vistos.get(ruta) == firma and procesados.get(ruta) != firma:
+                procesados[ruta] = firma
+                lote.agregar(ruta)
+            vistos[ruta] = firma
+        lote.futuros = [f for f in lote.futuros if not f.done()]
+        time.sleep(intervalo)
 
 
 # ─── Main ─────────────────────────────────────────────────────────────────────
@@ -195,34 +779,59 @@ def main():
     parser = argparse.ArgumentParser(
         description="Convierte un contrato (PDF/DOCX/TXT) a plantilla con {{variables}}"
     )
-    parser.add_argument("archivo", help="Ruta al archivo del contrato")
+    parser.add_argument("archivo", help="Archivo del contrato, o carpeta / glob para convertir en lote")
     parser.add_argument(
         "--tipo",
         choices=["vivienda", "comercial", "auto"],
         default="auto",
         help="Tipo de contrato (default: auto)"
     )
-    parser.add_argument("--salida", help="Archivo de salida (default: nombre_PLANTILLA.txt)")
+    parser.add_argument("--salida", help="Archivo de salida (default: nombre_PLANTILLA.txt); "
+                                         "en lote, carpeta de salida (default: <carpeta>/plantillas)")
+    parser.add_argument("--workers", type=int, help="Procesos para extraer paginas del PDF (default: CPUs)")
+    parser.add_argument("--ia-workers", type=int, help=f"Partes de un contrato largo que se mandan a la IA en simultaneo (default: {IA_WORKERS})")
+    parser.add_argument("--sin-cache", action="store_true", help="Extraer de nuevo aunque el PDF ya este en cache")
+    parser.add_argument("--sin-ocr", action="store_true", help="No reconocer las paginas escaneadas (sin capa de texto)")
+    parser.add_argument("--lote-workers", type=int, default=2, help="Archivos que se convierten en simultaneo en lote (default: 2)")
+    parser.add_argument("--vigilar", action="store_true", help="Quedarse vigilando la carpeta y convertir los archivos nuevos")
+    parser.add_argument("--intervalo", type=float, default=5, help="Segundos entre revisiones con --vigilar (default: 5)")
     args = parser.parse_args()
 
-    if not os.path.exists(args.archivo):
+    en_lote = args.vigilar or os.path.isdir(args.archivo) or glob.has_magic(args.archivo)
+    if not en_lote and not os.path.exists(args.archivo):
         print(f"No se encontro: {args.archivo}")
         sys.exit(1)
+    if args.vigilar and not os.path.isdir(args.archivo):
+        print(f"--vigilar necesita una carpeta: {args.archivo}")
+        sys.exit(1)
 
     print("=" * 52)
     print("  AutoContract - Convertidor de Plantillas")
     print("=" * 52)
     print()
+    configurar_ia()
+
+    if en_lote:
+        main_lote(args)
+        return
 
     # 1. Extraer texto
-    texto = extraer_texto(args.archivo)
+    try:
+        texto = extraer_texto(args.archivo, args.workers, not args.sin_cache, usar_ocr=not args.sin_ocr)
+    except ErrorConversion as e:
+        print(e)
+        sys.exit(1)
 
     # 2. Marcar variables
     print()
-    texto_marcado = marcar_variables(texto, args.tipo)
+    try:
+        texto_marcado = marcar_variables(texto, args.tipo, args.ia_workers)
+    except ErrorConversion as e:
+        print(e)
+        sys.exit(1)
 
     # 3. Listar variables detectadas
-    variables = sorted(set(re.findall(r'\{\{([A-Z_]+)\}\}', texto_marcado)))
+    variables = sorted(set(re.findall(r'\{\{([A-Z0-9_]+)\}\}', texto_marcado)))
     print()
     print(f"[OK] Variables marcadas: {len(variables)}")
     for v in variables:
@@ -244,5 +853,30 @@ def main():
     print()
 
 
+def main_lote(args):
+    global MOSTRAR_PROGRESO
+    MOSTRAR_PROGRESO = False
+    base = args.archivo if os.path.isdir(args.archivo) else os.path.dirname(args.archivo) or "."
+    destino = args.salida or os.path.join(base, "plantillas")
+    lote = Lote(destino, args.tipo, max(1, args.lote_workers), not args.sin_cache, args.ia_workers,
+                not args.sin_ocr)
+
+    archivos = listar_entrada(args.archivo)
+    print(f"[LOTE] {len(archivos)} archivo(s) -> {destino}")
+    try:
+        for ruta in archivos:
+            lote.agregar(ruta)
+        lote.esperar()
+        if args.vigilar:
+            print(f"[LOTE] {lote.resumen()}")
+            vigilar(args.archivo, lote, args.intervalo)
+    except KeyboardInterrupt:
+        print("\n[LOTE] Interrumpido: lo pendiente se retoma en la proxima corrida")
+    finally:
+        lote.cerrar()
+    print(f"[LOTE] {lote.resumen()}")
+    print(f"[LOTE] Manifiesto: {lote.manifiesto.ruta}")
+
+
 if __name__ == "__main__":
     main()
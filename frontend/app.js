@@ -13,6 +13,8 @@ const state = {
   manualVariables: [],     // variables agregadas manualmente
   collectedData: {},
   chatHistory: [],
+  chatSessionId: null,     // sesión de entrevista en el servidor
+  previewId: null,         // contrato renderizado en el servidor (para exportar)
   currentStep: 1,
   isTyping: false,
   allVariablesComplete: false,
@@ -472,7 +474,7 @@ async function startInterview(pendingVars) {
   state.chatHistory.push({ role: 'assistant', content: welcome });
 
   try {
-    const res = await fetch(`${API_BASE}/api/chat`, {
+    const res = await fetch(`${API_BASE}/api/chat/sessions`, {
       method: 'POST',
       headers: { 'Content-Type': 'application/json' },
       body: JSON.stringify({
@@ -481,15 +483,14 @@ async function startInterview(pendingVars) {
         collected_data: state.collectedData,
       }),
     });
-    if (res.ok) {
-      const data = await res.json();
-      removeTypingIndicator();
-      addBotMessage(data.reply);
-      state.chatHistory.push({ role: 'assistant', content: data.reply });
-      state.collectedData = { ...state.collectedData, ...data.collected_data };
-      setInputEnabled(true);
-      $('chat-input').focus();
-    }
+    if (!res.ok) throw new Error('No se pudo iniciar la entrevista');
+    state.chatSessionId = (await res.json()).session_id;
+
+    const data = await streamChat({});
+    state.chatHistory.push({ role: 'assistant', content: data.reply });
+    state.collectedData = { ...state.collectedData, ...data.collected_data };
+    setInputEnabled(true);
+    $('chat-input').focus();
   } catch (err) {
     addBotMessage(`Lo siento, hubo un error: ${err.message}`);
     setInputEnabled(true);
@@ -520,35 +521,18 @@ async function handleUserSend() {
   addUserMessage(text);
   state.chatHistory.push({ role: 'user', content: text });
 
-  await sendToBotApi();
+  await sendToBotApi(text);
 }
 
-async function sendToBotApi() {
+async function sendToBotApi(message) {
   setInputEnabled(false);
   showTypingIndicator();
   state.isTyping = true;
 
   try {
-    const res = await fetch(`${API_BASE}/api/chat`, {
-      method: 'POST',
-      headers: { 'Content-Type': 'application/json' },
-      body: JSON.stringify({
-        messages: state.chatHistory,
-        variables: state.variables,
-        collected_data: state.collectedData,
-      }),
-    });
-
-    if (!res.ok) {
-      const err = await res.json();
-      throw new Error(err.detail || 'Error en el servidor');
-    }
-
-    const data = await res.json();
+    // El historial y las variables ya están en la sesión: sólo viaja el mensaje nuevo
+    const data = await streamChat({ message });
 
-    removeTypingIndicator();
-
-    addBotMessage(data.reply);
     state.chatHistory.push({ role: 'assistant', content: data.reply });
     state.collectedData = { ...state.collectedData, ...data.collected_data };
 
@@ -575,6 +559,69 @@ async function sendToBotApi() {
   state.isTyping = false;
 }
 
+// Envía el turno a la sesión de entrevista y va mostrando la respuesta del bot
+// a medida que llega (Server-Sent Events). Devuelve el evento final `done`,
+// con la misma forma que la respuesta de /api/chat.
+async function streamChat(body) {
+  const res = await fetch(`${API_BASE}/api/chat/sessions/${state.chatSessionId}/stream`, {
+    method: 'POST',
+    headers: { 'Content-Type': 'application/json' },
+    body: JSON.stringify(body),
+  });
+
+  if (!res.ok) {
+    const err = await res.json();
+    throw new Error(err.detail || 'Error en el servidor');
+  }
+
+  const reader = res.body.getReader();
+  const decoder = new TextDecoder();
+  let buffer = '';
+  let reply = '';
+  let bubble = null;
+
+  const showReply = (text) => {
+    if (!bubble) {
+      removeTypingIndicator();
+      bubble = addBotMessage(text);
+    } else {
+      bubble.innerHTML = formatMessage(text);
+      scrollToBottom();
+    }
+  };
+
+  while (true) {
+    const { value, done } = await reader.read();
+    if (done) break;
+    buffer += decoder.decode(value, { stream: true });
+
+    let sep;
+    while ((sep = buffer.indexOf('\n\n')) !== -1) {
+      const raw = buffer.slice(0, sep);
+      buffer = buffer.slice(sep + 2);
+
+      let event = 'message';
+      let data = '';
+      for (const line of raw.split('\n')) {
+        if (line.startsWith('event:')) event = line.slice(6).trim();
+        else if (line.startsWith('data:')) data += line.slice(5).trim();
+      }
+      const payload = data ? JSON.parse(data) : {};
+
+      if (event === 'token') {
+        reply += payload.text;
+        showReply(reply);
+      } else if (event === 'done') {
+        showReply(payload.reply);
+        return payload;
+      } else if (event === 'error') {
+        throw new Error(payload.detail || 'Error en el servidor');
+      }
+    }
+  }
+  throw new Error('La respuesta del servidor se interrumpió');
+}
+
 // ─── Mensajes del chat ────────────────────────────────────────────────────────
 function addBotMessage(text) {
   const container = $('chat-messages');
@@ -586,6 +633,7 @@ function addBotMessage(text) {
   `;
   container.appendChild(div);
   scrollToBottom();
+  return div.querySelector('.msg-bubble');
 }
 
 function addUserMessage(text) {
@@ -666,6 +714,7 @@ async function handleGenerateContract() {
     hideLoading();
 
     $('contract-preview').textContent = data.contract_preview;
+    state.previewId = data.preview_id;
 
     // Progreso 100%
     updateProgressStats(allVars.length, allVars.length);
@@ -687,15 +736,20 @@ async function handleDownloadDocx() {
   const allVars = [...state.variables, ...state.manualVariables];
 
   try {
-    const res = await fetch(`${API_BASE}/api/export-docx`, {
+    // Primero se pide por preview_id (el texto ya renderizado queda en el
+    // servidor); si expiró, se reenvía la plantilla completa.
+    const fullBody = {
+      contract_template: state.contractTemplate,
+      variables: allVars,
+      collected_data: state.collectedData,
+    };
+    const exportDocx = (body) => fetch(`${API_BASE}/api/export-docx`, {
       method: 'POST',
       headers: { 'Content-Type': 'application/json' },
-      body: JSON.stringify({
-        contract_template: state.contractTemplate,
-        variables: allVars,
-        collected_data: state.collectedData,
-      }),
+      body: JSON.stringify(body),
     });
+    let res = state.previewId ? await exportDocx({ preview_id: state.previewId }) : null;
+    if (!res || res.status === 404) res = await exportDocx(fullBody);
 
     if (!res.ok) throw new Error('Error al generar el DOCX');
 
@@ -733,6 +787,8 @@ function handleNewContract() {
   state.collectedData = {};
   state.manualVariables = [];
   state.chatHistory = [];
+  state.chatSessionId = null;
+  state.previewId = null;
   state.allVariablesComplete = false;
   goToStep(2);
   renderVariables(state.variables, null);
@@ -747,6 +803,8 @@ function handleReset() {
   state.manualVariables = [];
   state.collectedData = {};
   state.chatHistory = [];
+  state.chatSessionId = null;
+  state.previewId = null;
   state.allVariablesComplete = false;
 
   $('contract-input').value = '';
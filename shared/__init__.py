@@ -0,0 +1,6 @@
+"""
+Módulos comunes a los dos backends (backend/ y v2/backend/).
+
+Cada main.py agrega la raíz del repositorio a sys.path y los importa como
+`shared.<módulo>`: así una corrección se hace una sola vez.
+"""
@@ -0,0 +1,130 @@
+"""
+Almacén en disco de documentos generados, direccionado por contenido.
+
+La clave es el hash de lo que determina el archivo (en v1 el texto del
+contrato y la versión del exportador; en v2 el hash de la plantilla, los
+valores y el modo de renderizado): un pedido repetido se resuelve con un
+stat() en vez de un renderizado. La clave es también el ETag fuerte;
+FileResponse resuelve Range/If-Range y If-None-Match se responde con 304.
+
+`sweep` borra lo no usado dentro de la retención y, si el total supera el
+máximo, lo de uso más viejo.
+"""
+
+import hashlib
+import os
+import tempfile
+import threading
+import time
+from pathlib import Path
+from typing import Iterable, Optional
+
+from fastapi import Request
+from fastapi.responses import FileResponse, Response
+
+SWEEP_INTERVAL = 600
+
+
+def artifact_key(*parts: str) -> str:
+    return hashlib.sha256("\x1f".join(parts).encode("utf-8")).hexdigest()
+
+
+class ArtifactStore:
+    def __init__(self, root: Path, retention_seconds: float, max_bytes: int):
+        self.root = Path(root)
+        self.retention = retention_seconds
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._last_sweep = 0.0
+        self.root.mkdir(parents=True, exist_ok=True)
+
+    def path(self, key: str, ext: str) -> Path:
+        return self.root / key[:2] / f"{key}.{ext}"
+
+    def get(self, key: str, ext: str) -> Optional[Path]:
+        path = self.path(key, ext)
+        try:
+            os.utime(path)   # la retención cuenta desde el último uso
+        except FileNotFoundError:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return path
+
+    def put(self, key: str, ext: str, chunks: Iterable[bytes]) -> Path:
+        """Escribe los bloques de forma atómica (archivo temporal + rename)."""
+        path = self.path(key, ext)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=path.parent, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                for chunk in chunks:
+                    f.write(chunk)
+            os.replace(tmp, path)
+        except BaseException:
+            try:
+                os.remove(tmp)
+            except OSError:
+                pass
+            raise
+        self.maybe_sweep()
+        return path
+
+    def maybe_sweep(self) -> None:
+        now = time.time()
+        if now - self._last_sweep >= SWEEP_INTERVAL:
+            self._last_sweep = now
+            self.sweep()
+
+    def sweep(self) -> int:
+        """Borra vencidos y, si hace falta, los de uso más viejo. Devuelve cuántos borró."""
+        with self._lock:
+            now = time.time()
+            files = []
+            for path in self.root.glob("*/*"):
+                try:
+                    st = path.stat()
+                except FileNotFoundError:
+                    continue
+                files.append((st.st_mtime, st.st_size, path))
+
+            removed = 0
+            alive = []
+            for mtime, size, path in files:
+                if now - mtime > self.retention:
+                    path.unlink(missing_ok=True)
+                    removed += 1
+                else:
+                    alive.append((mtime, size, path))
+
+            total = sum(size for _, size, _ in alive)
+            for mtime, size, path in sorted(alive, key=lambda x: x[0]):
+                if total <= self.max_bytes:
+                    break
+                path.unlink(missing_ok=True)
+                total -= size
+                removed += 1
+            return removed
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / lookups, 3) if lookups else 0.0,
+            "retention_seconds": self.retention,
+            "max_bytes": self.max_bytes,
+        }
+
+
+def serve_artifact(request: Request, path: Path, key: str, media_type: str,
+                   filename: str, headers: Optional[dict] = None) -> Response:
+    """FileResponse con ETag fuerte; 304 si el cliente ya tiene esta versión."""
+    etag = f'"{key}"'
+    extra = {"ETag": etag, "Cache-Control": "private, max-age=0, must-revalidate", **(headers or {})}
+    if_none_match = request.headers.get("if-none-match", "")
+    if etag in [e.strip() for e in if_none_match.split(",")] or if_none_match.strip() == "*":
+        return Response(status_code=304, headers=extra)
+    return FileResponse(path, media_type=media_type, filename=filename, headers=extra)
@@ -0,0 +1,251 @@
+"""
+Métricas en formato de texto de Prometheus, sin dependencias (ambos backends).
+
+Contadores, medidores e histogramas se actualizan en memoria con un lock por
+métrica (una suma y, en los histogramas, una búsqueda binaria del bucket); el
+texto se arma recién cuando se consulta /metrics. Los recolectores leen en ese
+momento valores que ya llevan otros objetos (ej. hits/misses de los caches),
+así no suman costo al camino del pedido.
+
+MetricsMiddleware mide cada pedido HTTP: latencia por método y ruta (la
+plantilla de la ruta, ej. /api/chat/sessions/{session_id}, no la URL), total
+por estado y pedidos en curso.
+"""
+
+import bisect
+import math
+import threading
+import time
+from typing import Callable, Optional
+
+MEDIA_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+HTTP_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+LLM_BUCKETS = (0.1, 0.25, 0.5, 1, 2, 5, 10, 20, 30, 60, 120)
+DOCX_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names: tuple, values: tuple, extra: str = "") -> str:
+    parts = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _number(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(float(value)) if value != int(value) else str(int(value))
+
+
+class _Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, help: str, labels: tuple = ()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._lock = threading.Lock()
+
+    def _header(self) -> list[str]:
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, help: str, labels: tuple = ()):
+        super().__init__(name, help, labels)
+        self._values: dict[tuple, float] = {}
+
+    def inc(self, *label_values, amount: float = 1.0) -> None:
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0.0) + amount
+
+    def expose(self) -> list[str]:
+        with self._lock:
+            values = list(self._values.items())
+        return self._header() + [
+            f"{self.name}{_labels(self.labels, lv)} {_number(v)}" for lv, v in values
+        ]
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def dec(self, *label_values, amount: float = 1.0) -> None:
+        self.inc(*label_values, amount=-amount)
+
+    def set(self, *label_values, value: float) -> None:
+        with self._lock:
+            self._values[label_values] = value
+
+
+class _Timer:
+    __slots__ = ("_histogram", "_label_values", "_start")
+
+    def __init__(self, histogram: "Histogram", label_values: tuple):
+        self._histogram = histogram
+        self._label_values = label_values
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, *exc):
+        if exc_type is None:
+            self._histogram.observe(time.perf_counter() - self._start, *self._label_values)
+        return False
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labels: tuple = (), buckets: tuple = HTTP_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(sorted(buckets))
+        # etiquetas -> [conteo por bucket (no acumulado, el último es +Inf), suma, total]
+        self._series: dict[tuple, list] = {}
+
+    def observe(self, value: float, *label_values) -> None:
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][i] += 1
+            series[1] += value
+            series[2] += 1
+
+    def time(self, *label_values) -> _Timer:
+        """`with histogram.time("render"): ...` observa la duración del bloque si termina bien."""
+        return _Timer(self, label_values)
+
+    def expose(self) -> list[str]:
+        with self._lock:
+            series = [(lv, list(s[0]), s[1], s[2]) for lv, s in self._series.items()]
+        lines = self._header()
+        for lv, counts, total_sum, total in series:
+            cumulative = 0
+            for limit, count in zip(self.buckets + (math.inf,), counts):
+                cumulative += count
+                le = 'le="%s"' % _number(limit)
+                lines.append(f"{self.name}_bucket{_labels(self.labels, lv, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.labels, lv)} {_number(total_sum)}")
+            lines.append(f"{self.name}_count{_labels(self.labels, lv)} {total}")
+        return lines
+
+
+class Collector(_Metric):
+    """Métrica que se calcula al exponer: `fn()` devuelve {valores de etiquetas: valor}."""
+
+    def __init__(self, name: str, help: str, kind: str, labels: tuple, fn: Callable[[], dict]):
+        super().__init__(name, help, labels)
+        self.kind = kind
+        self.fn = fn
+
+    def expose(self) -> list[str]:
+        return self._header() + [
+            f"{self.name}{_labels(self.labels, lv)} {_number(v)}" for lv, v in self.fn().items()
+        ]
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics: list[_Metric] = []
+
+    def _add(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name: str, help: str, labels: tuple = ()) -> Counter:
+        return self._add(Counter(name, help, labels))
+
+    def gauge(self, name: str, help: str, labels: tuple = ()) -> Gauge:
+        return self._add(Gauge(name, help, labels))
+
+    def histogram(self, name: str, help: str, labels: tuple = (),
+                  buckets: tuple = HTTP_BUCKETS) -> Histogram:
+        return self._add(Histogram(name, help, labels, buckets))
+
+    def collector(self, name: str, help: str, kind: str, labels: tuple,
+                  fn: Callable[[], dict]) -> Collector:
+        return self._add(Collector(name, help, kind, labels, fn))
+
+    def expose(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.expose())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = MetricsRegistry()
+
+HTTP_DURATION = REGISTRY.histogram(
+    "http_request_duration_seconds", "Duración de los pedidos HTTP", ("method", "route"))
+HTTP_REQUESTS = REGISTRY.counter(
+    "http_requests_total", "Pedidos HTTP atendidos", ("method", "route", "status"))
+HTTP_IN_FLIGHT = REGISTRY.gauge(
+    "http_requests_in_flight", "Pedidos HTTP en curso")
+
+
+def cache_metrics(caches: Callable[[], dict]) -> None:
+    """
+    Registra hits, misses y hit ratio de los caches que devuelve `caches()`
+    ({nombre: objeto con .hits y .misses, o None si está desactivado}).
+    """
+    def values(attribute: Optional[str]):
+        def read():
+            result = {}
+            for name, cache in caches().items():
+                if cache is None:
+                    continue
+                if attribute:
+                    result[(name,)] = getattr(cache, attribute)
+                else:
+                    lookups = cache.hits + cache.misses
+                    result[(name,)] = cache.hits / lookups if lookups else 0.0
+            return result
+        return read
+
+    REGISTRY.collector("cache_hits_total", "Consultas resueltas por el cache", "counter",
+                       ("cache",), values("hits"))
+    REGISTRY.collector("cache_misses_total", "Consultas que el cache no pudo resolver", "counter",
+                       ("cache",), values("misses"))
+    REGISTRY.collector("cache_hit_ratio", "Fracción de consultas resueltas por el cache", "gauge",
+                       ("cache",), values(None))
+
+
+class MetricsMiddleware:
+    """Middleware ASGI: latencia, total por estado y pedidos HTTP en curso."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status = 500
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        HTTP_IN_FLIGHT.inc()
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            HTTP_IN_FLIGHT.dec()
+            # El router deja la ruta que atendió el pedido en el scope
+            route = getattr(scope.get("route"), "path", None) or "<sin ruta>"
+            HTTP_DURATION.observe(time.perf_counter() - start, scope["method"], route)
+            HTTP_REQUESTS.inc(scope["method"], route, str(status))
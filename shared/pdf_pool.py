@@ -0,0 +1,230 @@
+"""
+Conversión .docx -> .pdf con un pool de conversores precalentados.
+
+Arrancar LibreOffice headless tarda varios segundos; cada conversor
+(pdf_worker.py) mantiene un soffice abierto y conectado por UNO y se
+reutiliza entre pedidos, así la latencia de un PDF es sólo la conversión.
+
+- Los conversores libres esperan en una cola; un pedido toma el primero
+  disponible y espera (hasta `queue_timeout`) si están todos ocupados.
+- Cada trabajo tiene su timeout: si se cumple, el conversor se mata (con su
+  soffice) y se reemplaza.
+- Tras `max_jobs` conversiones un conversor se recicla; el reemplazo arranca
+  en segundo plano.
+- Un conversor que no arranca (al inicio o al reemplazarlo) se reintenta con
+  espera exponencial, de RETRY_BASE_DELAY hasta RETRY_MAX_DELAY segundos:
+  tras una caída de soffice el pool vuelve a su tamaño sin reiniciar la app.
+
+Si ningún conversor puede arrancar (falta LibreOffice o el módulo `uno`)
+`convert` lanza PdfUnavailable.
+"""
+
+import asyncio
+import json
+import logging
+import os
+import shutil
+import signal
+import subprocess
+import tempfile
+import uuid
+from pathlib import Path
+from typing import Optional
+
+WORKER_SCRIPT = Path(__file__).resolve().parent / "pdf_worker.py"
+RETRY_BASE_DELAY = 1.0
+RETRY_MAX_DELAY = 300.0
+
+log = logging.getLogger("autocontract.pdf")
+
+
+class PdfUnavailable(Exception):
+    pass
+
+
+class PdfConversionError(Exception):
+    pass
+
+
+class _Worker:
+    def __init__(self, number: int, profile: Path):
+        self.number = number
+        self.profile = profile
+        self.proc: Optional[asyncio.subprocess.Process] = None
+        self.jobs = 0
+        self.failures = 0   # arranques fallidos seguidos
+        self.retry: Optional[asyncio.Task] = None
+
+
+class PdfPool:
+    def __init__(self, workers: int, timeout: float, max_jobs: int, queue_timeout: float,
+                 start_timeout: float, python: str, soffice: str):
+        self.workers = workers
+        self.timeout = timeout
+        self.max_jobs = max_jobs
+        self.queue_timeout = queue_timeout
+        self.start_timeout = start_timeout
+        self.python = python
+        self.soffice = soffice
+        self.active = 0           # conversores vivos o arrancando
+        self.last_error = ""
+        self.conversions = 0
+        self.timeouts = 0
+        self.recycled = 0
+        self._idle: Optional[asyncio.Queue] = None
+        self._dir: Optional[Path] = None
+        self._workers: list[_Worker] = []
+
+    async def start(self) -> None:
+        """Arranca los conversores en paralelo; los que fallan quedan fuera del pool."""
+        if self._idle is not None or self.workers <= 0:
+            return
+        self._idle = asyncio.Queue()
+        self._dir = Path(tempfile.mkdtemp(prefix="pdf_pool_"))
+        self._workers = [_Worker(i, self._dir / f"profile_{i}") for i in range(self.workers)]
+        self.active = len(self._workers)
+        await asyncio.gather(*(self._start_and_release(w) for w in self._workers))
+
+    async def close(self) -> None:
+        for worker in self._workers:
+            if worker.retry is not None:
+                worker.retry.cancel()
+            await self._stop(worker)
+        self._workers = []
+        self._idle = None
+        self.active = 0
+        if self._dir is not None:
+            shutil.rmtree(self._dir, ignore_errors=True)
+            self._dir = None
+
+    @property
+    def available(self) -> bool:
+        return self._idle is not None and self.active > 0
+
+    async def convert(self, docx: bytes) -> bytes:
+        if not self.available:
+            raise PdfUnavailable(self.last_error or "La conversión a PDF no está habilitada")
+        try:
+            worker = await asyncio.wait_for(self._idle.get(), self.queue_timeout)
+        except asyncio.TimeoutError:
+            raise PdfUnavailable("Todos los conversores PDF están ocupados") from None
+
+        name = uuid.uuid4().hex
+        src = self._dir / f"{name}.docx"
+        dst = self._dir / f"{name}.pdf"
+        reusable = False
+        try:
+            await asyncio.to_thread(src.write_bytes, docx)
+            job = json.dumps({"src": str(src), "dst": str(dst)}) + "\n"
+            worker.proc.stdin.write(job.encode("utf-8"))
+            await worker.proc.stdin.drain()
+            try:
+                line = await asyncio.wait_for(worker.proc.stdout.readline(), self.timeout)
+            except asyncio.TimeoutError:
+                self.timeouts += 1
+                raise PdfConversionError(f"La conversión superó {self.timeout:.0f}s") from None
+            if not line:
+                raise PdfConversionError("El conversor terminó inesperadamente")
+
+            result = json.loads(line)
+            # Un documento que LibreOffice no pudo abrir no invalida el conversor
+            reusable = True
+            if not result.get("ok"):
+                raise PdfConversionError(result.get("error") or "Error de conversión")
+            pdf = await asyncio.to_thread(dst.read_bytes)
+            self.conversions += 1
+            return pdf
+        finally:
+            src.unlink(missing_ok=True)
+            dst.unlink(missing_ok=True)
+            worker.jobs += 1
+            if reusable and worker.jobs < self.max_jobs:
+                self._idle.put_nowait(worker)
+            else:
+                if reusable:
+                    self.recycled += 1
+                asyncio.create_task(self._replace(worker, force=not reusable))
+
+    async def _spawn(self, worker: _Worker) -> None:
+        kwargs = {}
+        if os.name != "nt":
+            kwargs["start_new_session"] = True   # para matar también al soffice hijo
+        worker.proc = await asyncio.create_subprocess_exec(
+            self.python, str(WORKER_SCRIPT), self.soffice, str(worker.profile),
+            stdin=asyncio.subprocess.PIPE, stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.DEVNULL, **kwargs,
+        )
+        worker.jobs = 0
+        try:
+            line = await asyncio.wait_for(worker.proc.stdout.readline(), self.start_timeout)
+        except asyncio.TimeoutError:
+            await self._stop(worker, force=True)
+            raise PdfUnavailable(f"El conversor no arrancó en {self.start_timeout:.0f}s") from None
+        if not line or not json.loads(line).get("ready"):
+            await self._stop(worker)
+            raise PdfUnavailable(
+                f"No se pudo iniciar el conversor ({self.python} con el módulo uno y {self.soffice})")
+
+    async def _start_and_release(self, worker: _Worker) -> None:
+        try:
+            await self._spawn(worker)
+        except (PdfUnavailable, OSError, ValueError) as e:
+            self.last_error = str(e)
+            self.active -= 1
+            delay = min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * 2 ** worker.failures)
+            worker.failures += 1
+            log.warning("Conversor no disponible", extra={"worker": worker.number, "error": str(e),
+                                                        "retry_in": delay})
+            if self._idle is not None:
+                worker.retry = asyncio.create_task(self._retry(worker, delay))
+            return
+        worker.failures = 0
+        if self._idle is not None:
+            self._idle.put_nowait(worker)
+
+    async def _retry(self, worker: _Worker, delay: float) -> None:
+        await asyncio.sleep(delay)
+        worker.retry = None
+        # El pool pudo cerrarse (o reiniciarse) mientras tanto
+        if self._idle is None or worker not in self._workers:
+            return
+        self.active += 1
+        await self._start_and_release(worker)
+
+    async def _replace(self, worker: _Worker, force: bool) -> None:
+        await self._stop(worker, force)
+        await self._start_and_release(worker)
+
+    async def _stop(self, worker: _Worker, force: bool = False) -> None:
+        """Cierra el conversor; con `force` (trabajo colgado) lo mata sin esperar."""
+        proc = worker.proc
+        worker.proc = None
+        if proc is None or proc.returncode is not None:
+            return
+        if not force:
+            try:
+                proc.stdin.close()   # el worker cierra soffice al ver EOF
+                await asyncio.wait_for(proc.wait(), 5)
+                return
+            except (asyncio.TimeoutError, OSError):
+                pass
+        if os.name == "nt":
+            subprocess.run(["taskkill", "/F", "/T", "/PID", str(proc.pid)], capture_output=True)
+        else:
+            try:
+                os.killpg(proc.pid, signal.SIGKILL)
+            except ProcessLookupError:
+                pass
+        await proc.wait()
+
+    def stats(self) -> dict:
+        return {
+            "workers": self.workers,
+            "active": self.active,
+            "idle": self._idle.qsize() if self._idle is not None else 0,
+            "conversions": self.conversions,
+            "timeouts": self.timeouts,
+            "recycled": self.recycled,
+            "retrying": sum(1 for w in self._workers if w.retry is not None),
+            "last_error": self.last_error,
+        }
@@ -0,0 +1,95 @@
+"""
+Proceso conversor .docx -> .pdf (lo lanza pdf_pool.py, no se usa solo).
+
+Se ejecuta con un Python que tenga el módulo `uno` de LibreOffice (el que
+trae LibreOffice o el del sistema con python3-uno). Arranca un soffice
+headless con su propio perfil, se conecta una vez por UNO y atiende
+trabajos: una línea JSON por stdin {"src": ..., "dst": ...} y una línea JSON
+por stdout con el resultado. Al cerrarse stdin cierra soffice.
+
+Uso: python pdf_worker.py <soffice> <directorio de perfil>
+"""
+
+import json
+import subprocess
+import sys
+import time
+import uuid
+
+import uno
+from com.sun.star.beans import PropertyValue
+from com.sun.star.connection import NoConnectException
+
+
+def _prop(name, value):
+    p = PropertyValue()
+    p.Name = name
+    p.Value = value
+    return p
+
+
+def _reply(data: dict) -> None:
+    sys.stdout.write(json.dumps(data) + "\n")
+    sys.stdout.flush()
+
+
+def _connect(soffice: str, profile: str):
+    pipe = f"pdf_worker_{uuid.uuid4().hex}"
+    proc = subprocess.Popen(
+        [soffice, "--headless", "--invisible", "--nologo", "--norestore", "--nodefault",
+         "--nolockcheck", "-env:UserInstallation=" + uno.systemPathToFileUrl(profile),
+         f"--accept=pipe,name={pipe};urp;StarOffice.ComponentContext"],
+        stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    local = uno.getComponentContext()
+    resolver = local.ServiceManager.createInstanceWithContext("com.sun.star.bridge.UnoUrlResolver", local)
+    # El proceso padre limita cuánto se espera el arranque
+    while True:
+        try:
+            ctx = resolver.resolve(f"uno:pipe,name={pipe};urp;StarOffice.ComponentContext")
+            break
+        except NoConnectException:
+            if proc.poll() is not None:
+                raise RuntimeError(f"soffice terminó al iniciar (código {proc.returncode})")
+            time.sleep(0.1)
+    desktop = ctx.ServiceManager.createInstanceWithContext("com.sun.star.frame.Desktop", ctx)
+    return proc, desktop
+
+
+def _convert(desktop, src: str, dst: str) -> None:
+    doc = desktop.loadComponentFromURL(
+        uno.systemPathToFileUrl(src), "_blank", 0,
+        (_prop("Hidden", True), _prop("ReadOnly", True)),
+    )
+    try:
+        doc.storeToURL(uno.systemPathToFileUrl(dst), (_prop("FilterName", "writer_pdf_Export"),))
+    finally:
+        doc.close(True)
+
+
+def main() -> None:
+    soffice, profile = sys.argv[1], sys.argv[2]
+    proc, desktop = _connect(soffice, profile)
+    _reply({"ready": True})
+
+    try:
+        for line in sys.stdin:
+            job = json.loads(line)
+            try:
+                _convert(desktop, job["src"], job["dst"])
+                _reply({"ok": True})
+            except Exception as e:
+                _reply({"ok": False, "error": str(e)})
+    finally:
+        try:
+            desktop.terminate()
+        except Exception:
+            pass
+        try:
+            proc.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+
+
+if __name__ == "__main__":
+    main()
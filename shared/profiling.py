@@ -0,0 +1,162 @@
+"""
+Perfilado opt-in de pedidos puntuales.
+
+Para ver dónde se va el tiempo de un pedido que tarda (generate, export a
+.docx, extract), se repite con el header `X-Profile: <token>`; cada backend
+toma el token de su propia variable (PROFILING_TOKEN en v1,
+V2_PROFILING_TOKEN en v2):
+
+    curl -H "X-Profile: $PROFILING_TOKEN" -H "Content-Type: application/json" \\
+         -d @pedido.json http://localhost:8000/api/export-docx -o contrato.docx
+
+Ese pedido corre bajo cProfile (determinístico). Al terminar se guardan en el
+directorio configurado el perfil completo (<id>.prof, para snakeviz o pstats)
+y un resumen en texto (<id>.txt), y se loguea una línea "perfil" con las
+funciones que más tiempo propio consumieron. El id vuelve en el header
+X-Profile-Id.
+
+- Sin token el middleware no se instala: no cuesta nada.
+- Se perfila un pedido por vez; si llega otro mientras tanto se atiende normal
+  y responde `X-Profile: ocupado`.
+- El perfil cubre el hilo del event loop, así que puede incluir trabajo de
+  otros pedidos que corrieron en paralelo: conviene usarlo con poca carga. Lo
+  que se manda a un hilo sólo se mide si se envuelve con in_thread(); lo que
+  corre en otros procesos (filas de /api/generate-batch, conversión a PDF) no
+  queda en el perfil.
+"""
+
+import cProfile
+import hmac
+import io
+import pstats
+import sys
+import threading
+import time
+from contextvars import ContextVar
+from pathlib import Path
+from typing import Callable, Optional
+
+from starlette.concurrency import run_in_threadpool
+
+from shared import structured_log
+
+log = structured_log.get_logger("profile")
+
+# Desde 3.12 cProfile usa sys.monitoring: el perfil del event loop ya ve todos
+# los hilos y no se puede activar un segundo perfilador a la vez
+_PER_THREAD = sys.version_info < (3, 12)
+
+
+class _Profile:
+    def __init__(self):
+        self.main = cProfile.Profile()
+        self.threads: list[cProfile.Profile] = []
+        self.lock = threading.Lock()
+
+
+_current: ContextVar[Optional[_Profile]] = ContextVar("current_profile", default=None)
+
+
+def in_thread(func: Callable) -> Callable:
+    """
+    Para run_in_threadpool / asyncio.to_thread: si el pedido se está
+    perfilando, la función corre con su propio cProfile y el resultado se suma
+    al perfil del pedido. Fuera de un pedido perfilado devuelve la misma función.
+    """
+    profile = _current.get()
+    if profile is None or not _PER_THREAD:
+        return func
+
+    def profiled(*args, **kwargs):
+        thread_profiler = cProfile.Profile()
+        try:
+            return thread_profiler.runcall(func, *args, **kwargs)
+        finally:
+            with profile.lock:
+                profile.threads.append(thread_profiler)
+
+    return profiled
+
+
+def summary(stats: pstats.Stats, top: int) -> str:
+    """Las `top` funciones con más tiempo propio y las de más tiempo acumulado."""
+    out = io.StringIO()
+    stats.stream = out
+    stats.strip_dirs()
+    out.write("=== Tiempo propio (tottime) ===\n")
+    stats.sort_stats(pstats.SortKey.TIME).print_stats(top)
+    out.write("=== Tiempo acumulado (cumtime) ===\n")
+    stats.sort_stats(pstats.SortKey.CUMULATIVE).print_stats(top)
+    return out.getvalue()
+
+
+def _hotspots(stats: pstats.Stats, count: int) -> list[str]:
+    rows = sorted(stats.stats.items(), key=lambda item: item[1][2], reverse=True)[:count]
+    return [f"{func} ({filename}:{line}) {data[2] * 1000:.1f}ms"
+            for (filename, line, func), data in rows]
+
+
+class ProfilingMiddleware:
+    """Middleware ASGI: perfila los pedidos que traen X-Profile con el token de admin."""
+
+    def __init__(self, app, token: str, directory: Path, top: int = 25):
+        self.app = app
+        self.token = token.encode()
+        self.directory = Path(directory)
+        self.top = top
+        self._busy = threading.Lock()
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        requested = dict(scope.get("headers") or ()).get(b"x-profile")
+        if requested is None or not hmac.compare_digest(requested, self.token):
+            await self.app(scope, receive, send)
+            return
+
+        if not self._busy.acquire(blocking=False):
+            await self.app(scope, receive, self._with_header(send, b"x-profile", b"ocupado"))
+            return
+
+        profile_id = f"{time.strftime('%Y%m%d-%H%M%S')}-{structured_log.request_id.get()}"
+        profile = _Profile()
+        token = _current.set(profile)
+        start = time.perf_counter()
+        try:
+            profile.main.enable()
+            try:
+                await self.app(scope, receive, self._with_header(send, b"x-profile-id", profile_id.encode()))
+            finally:
+                profile.main.disable()
+        finally:
+            _current.reset(token)
+            self._busy.release()
+            duration = time.perf_counter() - start
+            await run_in_threadpool(self._save, profile_id, scope, profile, duration)
+
+    @staticmethod
+    def _with_header(send, name: bytes, value: bytes):
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                message = {**message, "headers": [*message.get("headers", []), (name, value)]}
+            await send(message)
+        return send_wrapper
+
+    def _save(self, profile_id: str, scope, profile: _Profile, duration: float) -> None:
+        stats = pstats.Stats(profile.main)
+        for thread_profiler in profile.threads:
+            stats.add(thread_profiler)
+        try:
+            self.directory.mkdir(parents=True, exist_ok=True)
+            stats.dump_stats(self.directory / f"{profile_id}.prof")
+            header = (f"{scope['method']} {scope['path']} - {duration * 1000:.1f} ms "
+                      f"({len(profile.threads)} tareas en hilos)\n\n")
+            (self.directory / f"{profile_id}.txt").write_text(
+                header + summary(stats, self.top), encoding="utf-8")
+        except OSError as e:
+            log.error("No se pudo guardar el perfil", extra={"profile_id": profile_id, "error": str(e)})
+        log.info("perfil", extra={
+            "profile_id": profile_id, "path": scope["path"], "duration_ms": round(duration * 1000, 1),
+            "hotspots": _hotspots(stats, 5),
+        })
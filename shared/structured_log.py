@@ -0,0 +1,183 @@
+"""
+Logging estructurado y no bloqueante, común a los dos backends.
+
+- Cada registro sale como una línea JSON (LOG_FORMAT=json, por defecto) o
+  como texto legible (LOG_FORMAT=text), con hora, nivel, servicio (v1 o v2),
+  logger, id de correlación del pedido, mensaje y los campos pasados en
+  `extra`. El esquema es el mismo en los dos backends, así los logs se
+  pueden juntar y filtrar por `service`.
+- Quien loguea no escribe: el registro se encola (QueueHandler) y un hilo
+  aparte (QueueListener) lo formatea y lo escribe en stderr.
+- CorrelationMiddleware toma el id del header X-Request-ID (o genera uno), lo
+  deja en una ContextVar para todos los registros del pedido y lo devuelve en
+  la respuesta.
+- Las trazas detalladas (por placeholder, por párrafo) se emiten en DEBUG y
+  sólo si LOG_LEVEL=DEBUG o si el pedido salió sorteado por LOG_SAMPLE
+  (fracción de pedidos con traza completa). En el código van detrás de
+  trace_enabled(), así cuando están apagadas no se arma ni el registro.
+"""
+
+import atexit
+import copy
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import re
+import sys
+import time
+import uuid
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from typing import Optional
+
+ROOT = "autocontract"
+VALID_ID_RE = re.compile(r'[A-Za-z0-9._-]{1,64}')
+
+request_id: ContextVar[str] = ContextVar("request_id", default="-")
+_trace: ContextVar[bool] = ContextVar("trace", default=False)
+
+# Atributos propios de LogRecord; el resto son los campos de `extra`
+_STANDARD = set(vars(logging.makeLogRecord({}))) | {"message", "asctime", "request_id", "taskName"}
+
+_service = "-"
+_level = logging.INFO
+_sample = 0.0
+_listener: Optional[logging.handlers.QueueListener] = None
+
+
+def get_logger(name: str) -> logging.Logger:
+    return logging.getLogger(f"{ROOT}.{name}")
+
+
+def trace_enabled() -> bool:
+    """True si el pedido en curso emite trazas detalladas."""
+    return _trace.get()
+
+
+def _fields(record: logging.LogRecord) -> dict:
+    return {k: v for k, v in vars(record).items() if k not in _STANDARD}
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        data = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "service": _service,
+            "logger": record.name,
+            "request_id": getattr(record, "request_id", "-"),
+            "msg": record.getMessage(),
+            **_fields(record),
+        }
+        if record.exc_text:
+            data["exception"] = record.exc_text
+        return json.dumps(data, ensure_ascii=False, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        clock = datetime.fromtimestamp(record.created).strftime("%H:%M:%S.%f")[:-3]
+        extra = " ".join(f"{k}={v!r}" for k, v in _fields(record).items())
+        line = (f"{clock} {record.levelname:<7} {_service} [{getattr(record, 'request_id', '-')}] "
+                f"{record.name.removeprefix(ROOT + '.')}: {record.getMessage()}"
+                f"{' ' + extra if extra else ''}")
+        return f"{line}\n{record.exc_text}" if record.exc_text else line
+
+
+class _QueueHandler(logging.handlers.QueueHandler):
+    """
+    En el hilo del pedido sólo se resuelve lo que no puede esperar: el mensaje
+    (los argumentos podrían cambiar después), el traceback y el id de
+    correlación. Formatear y escribir queda para el hilo del listener.
+    """
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        return (record.levelno >= _level or _trace.get()) and super().filter(record)
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        record.request_id = request_id.get()
+        return record
+
+
+def configure(service: str, level: Optional[str] = None, fmt: Optional[str] = None,
+              sample: Optional[float] = None) -> None:
+    """Instala la cola y el listener en el logger raíz de la app (una sola vez)."""
+    global _service, _level, _sample, _listener
+    _service = service
+    _level = logging.getLevelName((level or os.getenv("LOG_LEVEL", "INFO")).upper())
+    if not isinstance(_level, int):
+        _level = logging.INFO
+    _sample = sample if sample is not None else float(os.getenv("LOG_SAMPLE", "0"))
+    fmt = (fmt or os.getenv("LOG_FORMAT", "json")).lower().strip()
+
+    root = logging.getLogger(ROOT)
+    # DEBUG en el logger para que pasen las trazas sorteadas; el nivel real lo filtra la cola
+    root.setLevel(logging.DEBUG if _sample > 0 else _level)
+    root.propagate = False
+    if _listener is not None:
+        return
+
+    output = logging.StreamHandler(sys.stderr)
+    output.setFormatter(TextFormatter() if fmt == "text" else JsonFormatter())
+    log_queue: queue.SimpleQueue = queue.SimpleQueue()
+    root.addHandler(_QueueHandler(log_queue))
+    _listener = logging.handlers.QueueListener(log_queue, output, respect_handler_level=True)
+    _listener.start()
+    atexit.register(stop)
+
+
+def stop() -> None:
+    """Vacía la cola y detiene el hilo de escritura."""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+class CorrelationMiddleware:
+    """
+    Middleware ASGI: id de correlación por pedido, sorteo de la traza y una
+    línea de acceso (método, ruta, estado, duración) al terminar.
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self.log = get_logger("http")
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        received = dict(scope.get("headers") or ()).get(b"x-request-id", b"").decode("latin-1")
+        rid = received if VALID_ID_RE.fullmatch(received) else uuid.uuid4().hex[:16]
+        id_token = request_id.set(rid)
+        trace_token = _trace.set(_level <= logging.DEBUG or (_sample > 0 and random.random() < _sample))
+        status = 500
+        start = time.perf_counter()
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                message = {**message, "headers": [*message.get("headers", []), (b"x-request-id", rid.encode())]}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            self.log.info("pedido", extra={
+                "method": scope["method"], "path": scope["path"], "status": status,
+                "duration_ms": round((time.perf_counter() - start) * 1000, 1),
+            })
+            _trace.reset(trace_token)
+            request_id.reset(id_token)
@@ -0,0 +1,113 @@
+"""
+Reescritura de un .docx a nivel zip.
+
+Sólo se recomprimen los miembros que cambian (las partes XML con
+placeholders); el resto (imágenes, fuentes, estilos...) se copia tal cual
+desde el archivo original, sin descomprimir ni volver a comprimir.
+La salida se produce en bloques para poder transmitirla directamente.
+"""
+
+import io
+import struct
+import zipfile
+import zlib
+from typing import Iterator
+
+CHUNK_SIZE = 64 * 1024
+
+_LOCAL_HEADER = struct.Struct("<4s2B4HL2L2H")
+_CENTRAL_HEADER = struct.Struct("<4s4B4HL2L5H2L")
+_END_RECORD = struct.Struct("<4s4H2LH")
+_DATA_DESCRIPTOR_SIG = b"PK\x07\x08"
+_FLAG_DATA_DESCRIPTOR = 0x08
+_FLAG_UTF8 = 0x800
+_ZIP32_LIMIT = 0xFFFFFFFF
+
+
+def _dos_datetime(date_time: tuple) -> tuple[int, int]:
+    year, month, day, hour, minute, second = date_time
+    dos_date = (max(year, 1980) - 1980) << 9 | month << 5 | day
+    dos_time = hour << 11 | minute << 5 | second // 2
+    return dos_time, dos_date
+
+
+def _encoded_name(info: zipfile.ZipInfo) -> bytes:
+    if info.flag_bits & _FLAG_UTF8:
+        return info.filename.encode("utf-8")
+    try:
+        return info.filename.encode("cp437")
+    except UnicodeEncodeError:
+        return info.filename.encode("utf-8")
+
+
+def _raw_member(source: bytes, info: zipfile.ZipInfo) -> memoryview:
+    """Header local + datos comprimidos (+ data descriptor) tal como están en el origen."""
+    start = info.header_offset
+    name_len, extra_len = struct.unpack_from("<HH", source, start + 26)
+    end = start + _LOCAL_HEADER.size + name_len + extra_len + info.compress_size
+    if info.flag_bits & _FLAG_DATA_DESCRIPTOR:
+        end += 16 if source[end:end + 4] == _DATA_DESCRIPTOR_SIG else 12
+    return memoryview(source)[start:end]
+
+
+def iter_rewritten_zip(source: bytes, replaced: dict[str, bytes],
+                       compresslevel: int = 6) -> Iterator[bytes]:
+    """
+    Devuelve el zip `source` con los miembros de `replaced` (nombre → contenido
+    nuevo) recomprimidos y el resto copiado en crudo. No soporta zip64: una
+    plantilla .docx nunca se acerca a esos tamaños.
+    """
+    infos = zipfile.ZipFile(io.BytesIO(source)).infolist()
+    if len(infos) >= 0xFFFF or len(source) > _ZIP32_LIMIT:
+        raise ValueError("El archivo requiere zip64; use el renderizado python-docx")
+    return _iter_members(source, infos, replaced, compresslevel)
+
+
+def _iter_members(source: bytes, infos: list, replaced: dict[str, bytes],
+                  compresslevel: int) -> Iterator[bytes]:
+    offset = 0
+    central = []
+
+    for info in infos:
+        name = _encoded_name(info)
+        dos_time, dos_date = _dos_datetime(info.date_time)
+
+        if info.filename in replaced:
+            data = replaced[info.filename]
+            compressor = zlib.compressobj(compresslevel, zlib.DEFLATED, -15)
+            compressed = compressor.compress(data) + compressor.flush()
+            crc = zlib.crc32(data)
+            flags = info.flag_bits & _FLAG_UTF8
+            header = _LOCAL_HEADER.pack(
+                b"PK\x03\x04", 20, 0, flags, zipfile.ZIP_DEFLATED, dos_time, dos_date,
+                crc, len(compressed), len(data), len(name), 0,
+            ) + name
+            central.append(_CENTRAL_HEADER.pack(
+                b"PK\x01\x02", 20, info.create_system, 20, 0, flags, zipfile.ZIP_DEFLATED,
+                dos_time, dos_date, crc, len(compressed), len(data),
+                len(name), 0, 0, 0, info.internal_attr, info.external_attr, offset,
+            ) + name)
+            yield header
+            for i in range(0, len(compressed), CHUNK_SIZE):
+                yield compressed[i:i + CHUNK_SIZE]
+            offset += len(header) + len(compressed)
+        else:
+            raw = _raw_member(source, info)
+            central.append(_CENTRAL_HEADER.pack(
+                b"PK\x01\x02", info.create_version, info.create_system,
+                info.extract_version, info.reserved, info.flag_bits, info.compress_type,
+                dos_time, dos_date, info.CRC, info.compress_size, info.file_size,
+                len(name), len(info.extra), len(info.comment), 0,
+                info.internal_attr, info.external_attr, offset,
+            ) + name + info.extra + info.comment)
+            for i in range(0, len(raw), CHUNK_SIZE):
+                yield bytes(raw[i:i + CHUNK_SIZE])
+            offset += len(raw)
+
+    directory = b"".join(central)
+    if offset > _ZIP32_LIMIT:
+        raise ValueError("El archivo generado requiere zip64")
+    yield directory
+    yield _END_RECORD.pack(
+        b"PK\x05\x06", 0, 0, len(central), len(central), len(directory), offset, 0,
+    )
@@ -7,17 +7,47 @@ Sin IA en generación.
 import re
 import io
 import os
+import sys
+import csv
+import json
+import asyncio
+import hashlib
+import shutil
+import tempfile
+import threading
+import zipfile
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
 from pathlib import Path
-from fastapi import FastAPI, UploadFile, File, HTTPException, Request
+from fastapi import FastAPI, UploadFile, File, Form, HTTPException, Request
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import StreamingResponse, JSONResponse
+from fastapi.responses import StreamingResponse, JSONResponse, Response
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
 from docx import Document
 from docx.oxml.ns import qn
-from typing import Optional
+from docx.opc.constants import CONTENT_TYPE as CT, RELATIONSHIP_TYPE as RT
+from docx.opc.part import PartFactory, XmlPart
+from docx.text.paragraph import Paragraph
+from typing import Iterator, Optional
+from contextlib import contextmanager
 import copy
-import traceback
+
+# Módulos compartidos con v1 (ver shared/)
+sys.path.insert(0, str(Path(__file__).resolve().parents[2]))
+
+from docx_zip import iter_rewritten_zip
+from shared import metrics, profiling, structured_log
+from shared.artifact_store import ArtifactStore, artifact_key, serve_artifact
+from shared.pdf_pool import PdfPool, PdfUnavailable
+
+# Logging estructurado, con la escritura fuera del hilo del pedido (ver shared/structured_log.py)
+structured_log.configure("v2")
+log = structured_log.get_logger("api")
+log_docx = structured_log.get_logger("docx")
+log_generate = structured_log.get_logger("generate")
+log_batch = structured_log.get_logger("batch")
 
 app = FastAPI(title="AutoContract V2")
 
@@ -27,12 +57,25 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+# Perfilado opt-in: sólo los pedidos con `X-Profile: <V2_PROFILING_TOKEN>` (ver shared/profiling.py)
+PROFILING_TOKEN = os.getenv("V2_PROFILING_TOKEN", "").strip()
+if PROFILING_TOKEN:
+    app.add_middleware(
+        profiling.ProfilingMiddleware,
+        token=PROFILING_TOKEN,
+        directory=Path(os.getenv("V2_PROFILING_DIR", str(Path(__file__).parent / "cache" / "profiles"))),
+        top=int(os.getenv("V2_PROFILING_TOP", "25")),
+    )
+# Id de correlación por pedido y línea de acceso (ver shared/structured_log.py)
+app.add_middleware(structured_log.CorrelationMiddleware)
+# Latencia y pedidos en curso para /metrics (ver shared/metrics.py)
+app.add_middleware(metrics.MetricsMiddleware)
 
 # ─── Exception Handlers ──────────────────────────────────────────────────────
 
 @app.exception_handler(HTTPException)
 async def http_exception_handler(request: Request, exc: HTTPException):
-    print(f"[ERROR] HTTP {exc.status_code}: {exc.detail}")
+    log.warning("Error HTTP", extra={"status": exc.status_code, "detail": exc.detail})
     return JSONResponse(
         status_code=exc.status_code,
         content={"error": "HTTP Error", "detail": str(exc.detail)},
@@ -41,8 +84,7 @@ async def http_exception_handler(request: Request, exc: HTTPException):
 @app.exception_handler(Exception)
 async def global_exception_handler(request: Request, exc: Exception):
     error_msg = f"Error inesperado: {str(exc)}"
-    print(f"[CRITICAL] {error_msg}")
-    traceback.print_exc()
+    log.error(error_msg, exc_info=exc)
     return JSONResponse(
         status_code=500,
         content={"error": "Internal Server Error", "detail": error_msg},
@@ -52,7 +94,9 @@ async def global_exception_handler(request: Request, exc: Exception):
 
 class GenerateRequest(BaseModel):
     values: dict[str, str]          # { "LOCADOR_NOMBRE": "Juan García", ... }
+    template_id: Optional[str] = None  # devuelto por /api/extract; si falta se usa la última subida
     optional_empty: list[str] = []  # placeholders marcados como vacíos opcionalmente
+    format: str = "docx"            # "docx" o "pdf"
 
 
 # ─── Utilidades docx ─────────────────────────────────────────────────────────
@@ -63,207 +107,573 @@ PLACEHOLDER_RE = re.compile(r'\{\{([A-Z0-9_]+)\}\}')
 def _replace_in_paragraph(para, replacements: dict):
     """
     Reemplaza placeholders en un párrafo preservando el formato original.
-    Verificable mediante log en consola.
+    Verificable con la traza (LOG_LEVEL=DEBUG o LOG_SAMPLE).
+    Devuelve (matches del texto original, texto resultante del párrafo).
+
+    Se lee la lista de runs una sola vez y se arma una tabla de offsets; todos
+    los matches se aplican en una única pasada hacia adelante, así el costo es
+    lineal en la cantidad de runs aunque Word haya partido el texto en cientos.
+    El valor queda en el run donde empieza el placeholder (hereda su estilo),
+    el run donde termina conserva el resto y los intermedios se eliminan.
     """
-    if not replacements:
-        return
+    runs = para.runs
+    texts = [r.text for r in runs]
+    full_text = "".join(texts)
 
-    full_text = "".join(r.text for r in para.runs)
     matches = list(PLACEHOLDER_RE.finditer(full_text))
-    if not matches:
-        return
+    hits = [(m.start(), m.end(), replacements[m.group(1)])
+            for m in matches
+            if m.group(1) in replacements]
+    if not hits:
+        return matches, full_text
+
+    # Log de verificación pedido por el usuario; por párrafo, así que sólo con traza
+    if structured_log.trace_enabled():
+        log_docx.debug("V2 DOCX REPLACE RUN-LEVEL v1", extra={"runs": len(runs), "hits": len(hits)})
+
+    # ends[i] = offset (en full_text) donde termina el run i
+    ends = []
+    pos = 0
+    for text in texts:
+        pos += len(text)
+        ends.append(pos)
+
+    out = [[] for _ in runs]   # fragmentos del nuevo texto de cada run
+    removed = []
+    emit_idx = 0               # run dueño del próximo fragmento sin reemplazar
+    run_idx = 0
+    cursor = 0                 # primer carácter de full_text aún no emitido
+
+    def emit_until(end):
+        nonlocal emit_idx, cursor
+        while cursor < end:
+            while ends[emit_idx] <= cursor:
+                emit_idx += 1
+            stop = min(end, ends[emit_idx])
+            out[emit_idx].append(full_text[cursor:stop])
+            cursor = stop
+
+    for start, end, value in hits:
+        emit_until(start)
+        while ends[run_idx] <= start:
+            run_idx += 1
+        first_idx = run_idx
+        out[first_idx].append(value)
+        while ends[run_idx] < end:
+            run_idx += 1
+        removed.extend(range(first_idx + 1, run_idx))
+        cursor = end
+    emit_until(len(full_text))
+
+    removed_set = set(removed)
+    result = []
+    for i, run in enumerate(runs):
+        if i in removed_set:
+            # Eliminar runs intermedios físicamente del XML
+            el = run._element
+            if el.getparent() is not None:
+                el.getparent().remove(el)
+            continue
+        new_text = "".join(out[i])
+        result.append(new_text)
+        if new_text != texts[i]:
+            run.text = new_text
 
-    # Log de verificación pedido por el usuario
-    print("V2 DOCX REPLACE RUN-LEVEL v1")
+    return matches, "".join(result)
 
-    # Procesar de atrás hacia adelante para no invalidar offsets de texto
-    for match in reversed(matches):
-        placeholder_name = match.group(1)
-        if placeholder_name not in replacements:
-            continue
-        
-        replacement_text = replacements[placeholder_name]
-        start_idx, end_idx = match.span()
-
-        # Identificar runs afectados
-        affected_indices = []
-        current_pos = 0
-        for i, run in enumerate(para.runs):
-            run_len = len(run.text)
-            if current_pos < end_idx and current_pos + run_len > start_idx:
-                affected_indices.append(i)
-            current_pos += run_len
-
-        if not affected_indices:
-            continue
 
-        first_idx = affected_indices[0]
-        last_idx = affected_indices[-1]
-        
-        first_run = para.runs[first_idx]
-        last_run = para.runs[last_idx]
-
-        # Calcular offsets relativos al inicio de sus respectivos runs
-        pos_before_first = sum(len(para.runs[i].text) for i in range(first_idx))
-        rel_start = start_idx - pos_before_first
-        
-        pos_before_last = sum(len(para.runs[i].text) for i in range(last_idx))
-        rel_end = end_idx - pos_before_last
-
-        prefix = first_run.text[:rel_start]
-        suffix = last_run.text[rel_end:]
-
-        if first_idx == last_idx:
-            # Caso simple: un solo run (el estilo se mantiene naturalmente)
-            first_run.text = prefix + replacement_text + suffix
-        else:
-            # Caso complejo: el estilo se hereda del first_run
-            first_run.text = prefix + replacement_text
-            last_run.text = suffix
-            
-            # Eliminar runs intermedios físicamente del XML
-            # Recolectamos elementos primero para evitar problemas con la lista dinámica runs
-            elements_to_remove = [para.runs[i]._element for i in range(first_idx + 1, last_idx)]
-            for el in elements_to_remove:
-                if el.getparent() is not None:
-                    el.getparent().remove(el)
+# Footnotes y endnotes no tienen clase propia en python-docx: se cargan como
+# XmlPart para poder recorrerlas y que sus cambios se serialicen al guardar.
+PartFactory.part_type_for.setdefault(CT.WML_FOOTNOTES, XmlPart)
+PartFactory.part_type_for.setdefault(CT.WML_ENDNOTES, XmlPart)
+
+
+def iter_paragraphs(doc: Document) -> Iterator[tuple[str, Paragraph]]:
+    """
+    Recorre cada párrafo del documento exactamente una vez, en orden:
+    cuerpo (incluye tablas anidadas y cuadros de texto), headers/footers,
+    footnotes y endnotes. Devuelve (partname, párrafo).
+
+    Los headers/footers se toman por parte, así una parte compartida entre
+    secciones se recorre una sola vez y no se crean definiciones nuevas.
+    """
+    parts = [doc.part]
+    seen = {doc.part.partname}
+
+    for sect_pr in doc.element.body.iter(qn('w:sectPr')):
+        for ref in sect_pr:
+            if ref.tag not in (qn('w:headerReference'), qn('w:footerReference')):
+                continue
+            rel = doc.part.rels.get(ref.get(qn('r:id')))
+            if rel is None or rel.is_external or rel.target_part.partname in seen:
+                continue
+            seen.add(rel.target_part.partname)
+            parts.append(rel.target_part)
+
+    for rel in doc.part.rels.values():
+        if rel.reltype in (RT.FOOTNOTES, RT.ENDNOTES) and not rel.is_external:
+            if rel.target_part.partname not in seen and isinstance(rel.target_part, XmlPart):
+                seen.add(rel.target_part.partname)
+                parts.append(rel.target_part)
+
+    for part in parts:
+        part_name = str(part.partname)
+        # Se materializa la lista: reemplazar modifica el árbol durante el recorrido
+        for p in list(part.element.iter(qn('w:p'))):
+            yield part_name, Paragraph(p, part)
+
+
+def _paragraph_text(para) -> str:
+    return "".join(r.text for r in para.runs)
 
 
 def extract_placeholders(doc: Document) -> list[str]:
     """Extrae todos los {{PLACEHOLDERS}} únicos del documento en orden de aparición."""
     seen = set()
     ordered = []
-
-    def _scan_text(text: str):
-        for match in PLACEHOLDER_RE.finditer(text):
+    for _, para in iter_paragraphs(doc):
+        for match in PLACEHOLDER_RE.finditer(_paragraph_text(para)):
             name = match.group(1)
             if name not in seen:
                 seen.add(name)
                 ordered.append(name)
+    return ordered
 
-    # Párrafos del cuerpo principal
-    for para in doc.paragraphs:
-        _scan_text(''.join(r.text for r in para.runs))
-
-    # Tablas
-    for table in doc.tables:
-        for row in table.rows:
-            for cell in row.cells:
-                for para in cell.paragraphs:
-                    _scan_text(''.join(r.text for r in para.runs))
-
-    # Headers y footers
-    for section in doc.sections:
-        for hf in [section.header, section.footer,
-                   section.even_page_header, section.even_page_footer,
-                   section.first_page_header, section.first_page_footer]:
-            if hf is not None:
-                for para in hf.paragraphs:
-                    _scan_text(''.join(r.text for r in para.runs))
 
-    return ordered
+def process_document(doc: Document, replacements: dict) -> dict:
+    """
+    Reemplaza y verifica en una sola pasada por un documento sin compilar
+    (los endpoints usan la plantilla compilada, ver compile_template).
+    Devuelve el reporte combinado:
+      placeholders: encontrados en la plantilla, en orden de aparición
+      replaced:     los que recibieron valor
+      remaining:    los que siguen presentes en el documento final
+    """
+    found: dict[str, None] = {}
+    replaced: dict[str, None] = {}
+    remaining = set()
+
+    for _, para in iter_paragraphs(doc):
+        matches, new_text = _replace_in_paragraph(para, replacements)
+        for match in matches:
+            found.setdefault(match.group(1))
+            if match.group(1) in replacements:
+                replaced.setdefault(match.group(1))
+        if "{{" in new_text:
+            remaining.update(m.group(0) for m in PLACEHOLDER_RE.finditer(new_text))
+
+    return {
+        "placeholders": list(found),
+        "replaced": list(replaced),
+        "remaining": sorted(remaining),
+    }
 
 
 def replace_placeholders(doc: Document, replacements: dict) -> Document:
     """Reemplaza placeholders en el documento conservando formato."""
+    process_document(doc, replacements)
+    return doc
 
-    def process_para(para):
-        _replace_in_paragraph(para, replacements)
-
-    # Body
-    for para in doc.paragraphs:
-        process_para(para)
-
-    # Tables
-    for table in doc.tables:
-        for row in table.rows:
-            for cell in row.cells:
-                for para in cell.paragraphs:
-                    process_para(para)
-
-    # Headers / Footers
-    for section in doc.sections:
-        for hf in [section.header, section.footer,
-                   section.even_page_header, section.even_page_footer,
-                   section.first_page_header, section.first_page_footer]:
-            if hf is not None:
-                for para in hf.paragraphs:
-                    process_para(para)
 
-    return doc
+# ─── Plantilla compilada ─────────────────────────────────────────────────────
+#
+# La plantilla se parsea y normaliza una sola vez (en /api/extract): cada
+# placeholder queda contenido en un único run y se registra su ubicación
+# (parte, párrafo, run, span). Generar un contrato consiste entonces en
+# empalmar los valores en esos runs y serializar, sin volver a abrir el zip.
 
+@dataclass
+class PlaceholderSlot:
+    """Run de la plantilla compilada que contiene uno o más placeholders."""
+    part: str                          # partname, ej. '/word/document.xml'
+    paragraph: int                     # índice del párrafo dentro de la parte
+    run: int                           # índice del run dentro del párrafo
+    text: str                          # texto original del run
+    spans: list[tuple[int, int, str]]  # (inicio, fin, NOMBRE) dentro de `text`
+    element: object                    # <w:r> original en el árbol compilado
 
-def check_for_remaining_placeholders(doc: Document) -> list[str]:
-    """Busca si quedaron placeholders sin reemplazar en el documento final."""
-    remaining = []
 
-    def _scan(text):
-        for match in PLACEHOLDER_RE.finditer(text):
-            remaining.append(match.group(0))
+@dataclass
+class CompiledTemplate:
+    sha256: str
+    filename: str
+    doc: Document
+    placeholders: list[str]
+    slots: list[PlaceholderSlot]
+    parts: dict = field(default_factory=dict)   # partname -> parte con placeholders
+    lock: threading.Lock = field(default_factory=threading.Lock, repr=False)
 
-    for para in doc.paragraphs:
-        _scan("".join(r.text for r in para.runs))
 
-    for table in doc.tables:
-        for row in table.rows:
-            for cell in row.cells:
-                for para in cell.paragraphs:
-                    _scan("".join(r.text for r in para.runs))
+def template_hash(content: bytes) -> str:
+    return hashlib.sha256(content).hexdigest()
 
-    return list(set(remaining))
 
+def compile_template(content: bytes, filename: str) -> CompiledTemplate:
+    """Parsea la plantilla una vez y registra dónde vive cada placeholder."""
+    doc = Document(io.BytesIO(content))
+    placeholders: list[str] = []
+    seen = set()
+    slots: list[PlaceholderSlot] = []
 
-# ─── Endpoints ────────────────────────────────────────────────────────────────
+    para_counts: dict[str, int] = {}
 
-# Almacenamiento temporal en memoria de la plantilla cargada (MVP)
-_template_store: dict = {}
+    for part_name, para in iter_paragraphs(doc):
+        p_idx = para_counts.get(part_name, 0)
+        para_counts[part_name] = p_idx + 1
+
+        full_text = _paragraph_text(para)
+        if "{{" not in full_text:
+            continue
+        matches = list(PLACEHOLDER_RE.finditer(full_text))
+        if not matches:
+            continue
+
+        for match in matches:
+            if match.group(1) not in seen:
+                seen.add(match.group(1))
+                placeholders.append(match.group(1))
+
+        # Normalizar: reemplazar cada placeholder por sí mismo une los runs
+        # partidos en el primero, con su formato.
+        _replace_in_paragraph(para, {m.group(1): m.group(0) for m in matches})
+
+        for r_idx, run in enumerate(para.runs):
+            text = run.text
+            spans = [(m.start(), m.end(), m.group(1)) for m in PLACEHOLDER_RE.finditer(text)]
+            if spans:
+                slots.append(PlaceholderSlot(part_name, p_idx, r_idx, text, spans, run._r))
+
+    slot_parts = {slot.part for slot in slots}
+    parts = {str(part.partname): part
+             for part in doc.part.package.iter_parts()
+             if str(part.partname) in slot_parts}
+
+    return CompiledTemplate(
+        sha256=template_hash(content),
+        filename=filename,
+        doc=doc,
+        placeholders=placeholders,
+        slots=slots,
+        parts=parts,
+    )
+
+
+def _splice(slot: PlaceholderSlot, replacements: dict) -> str:
+    parts = []
+    pos = 0
+    for start, end, name in slot.spans:
+        if name in replacements:
+            parts.append(slot.text[pos:start])
+            parts.append(replacements[name])
+            pos = end
+    parts.append(slot.text[pos:])
+    return "".join(parts)
+
+
+@contextmanager
+def _spliced(compiled: CompiledTemplate, replacements: dict):
+    """
+    Sustituye los runs registrados por copias con los valores empalmados y los
+    restaura al salir, así la plantilla compilada queda intacta. Se toma el
+    lock de la plantilla durante todo el bloque.
+    """
+    with compiled.lock:
+        swapped = []
+        try:
+            for slot in compiled.slots:
+                text = _splice(slot, replacements)
+                if text == slot.text:
+                    continue
+                clone = copy.deepcopy(slot.element)
+                clone.text = text
+                slot.element.getparent().replace(slot.element, clone)
+                swapped.append((slot.element, clone))
+            yield
+        finally:
+            for original, clone in swapped:
+                clone.getparent().replace(clone, original)
+
+
+def _remaining_placeholders(compiled: CompiledTemplate, replacements: dict) -> list[str]:
+    return sorted({
+        "{{%s}}" % name
+        for slot in compiled.slots
+        for _, _, name in slot.spans
+        if name not in replacements
+    })
+
+
+def render_compiled(compiled: CompiledTemplate, replacements: dict) -> tuple[io.BytesIO, list[str]]:
+    """
+    Genera el .docx con python-docx empalmando los valores en los runs registrados.
+    Devuelve (docx, placeholders sin reemplazar).
+    """
+    output = io.BytesIO()
+    with _spliced(compiled, replacements):
+        compiled.doc.save(output)
+    output.seek(0)
+    return output, _remaining_placeholders(compiled, replacements)
+
+
+def render_compiled_zip(compiled: CompiledTemplate, content: bytes,
+                        replacements: dict) -> tuple[Iterator[bytes], list[str]]:
+    """
+    Genera el .docx a nivel zip: sólo se serializan y recomprimen las partes
+    con placeholders; el resto se copia en crudo desde `content` (la plantilla
+    original). Devuelve (iterador de bloques, placeholders sin reemplazar).
+    """
+    with _spliced(compiled, replacements):
+        replaced = {name.lstrip('/'): part.blob for name, part in compiled.parts.items()}
+    return iter_rewritten_zip(content, replaced), _remaining_placeholders(compiled, replacements)
+
+
+# Modo de renderizado: "zip" (sólo reescribe las partes con placeholders) o
+# "docx" (python-docx guarda el paquete completo)
+RENDER_MODE = os.getenv("V2_RENDER_MODE", "zip").lower().strip()
+
+
+def render_template(compiled: CompiledTemplate, content: bytes,
+                    replacements: dict) -> tuple[Iterator[bytes], list[str]]:
+    """Renderiza según RENDER_MODE; devuelve bloques del .docx y los sin reemplazar."""
+    if RENDER_MODE == "docx":
+        output, remaining = render_compiled(compiled, replacements)
+        return iter([output.getvalue()]), remaining
+    return render_compiled_zip(compiled, content, replacements)
+
+
+# ─── Registro de plantillas ──────────────────────────────────────────────────
+
+@dataclass
+class TemplateEntry:
+    template_id: str
+    filename: str
+    content: bytes
+    compiled: CompiledTemplate
+    size: int   # costo estimado en memoria: bytes crudos + XML descomprimido
+
+
+def _estimate_size(content: bytes) -> int:
+    """Aproxima la memoria de una entrada: el archivo más sus partes descomprimidas."""
+    with zipfile.ZipFile(io.BytesIO(content)) as zf:
+        unpacked = sum(info.file_size for info in zf.infolist())
+    return len(content) + unpacked
+
+
+class TemplateRegistry:
+    """
+    Plantillas cargadas, indexadas por ID (prefijo del SHA-256 del archivo).
+    Cada entrada guarda los bytes y la forma compilada; cuando el total supera
+    `max_bytes` se descartan las menos usadas recientemente (LRU).
+    """
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self._entries: OrderedDict[str, TemplateEntry] = OrderedDict()
+        self._total = 0
+        self._lock = threading.Lock()
+        self._last_upload: Optional[str] = None
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def id_for(content: bytes) -> str:
+        return template_hash(content)[:16]
+
+    def get(self, template_id: str) -> Optional[TemplateEntry]:
+        with self._lock:
+            entry = self._entries.get(template_id)
+            if entry is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+                self._entries.move_to_end(template_id)
+            return entry
+
+    def latest(self) -> Optional[TemplateEntry]:
+        """La última plantilla subida (no la última usada: get() reordena el LRU)."""
+        with self._lock:
+            if self._last_upload is None:
+                return None
+            return self._entries.get(self._last_upload)
+
+    def put(self, entry: TemplateEntry) -> None:
+        with self._lock:
+            old = self._entries.pop(entry.template_id, None)
+            if old is not None:
+                self._total -= old.size
+            self._entries[entry.template_id] = entry
+            self._last_upload = entry.template_id
+            self._total += entry.size
+            # La entrada recién agregada nunca se descarta, aunque exceda el límite
+            while self._total > self.max_bytes and len(self._entries) > 1:
+                _, evicted = self._entries.popitem(last=False)
+                self._total -= evicted.size
+                log.info("Plantilla descartada", extra={"template": evicted.filename,
+                                                    "template_id": evicted.template_id})
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"templates": len(self._entries), "bytes": self._total, "max_bytes": self.max_bytes}
+
+
+# parse: compilar la plantilla (/api/extract); render: armar el .docx y
+# escribirlo en el almacén (en modo zip las partes se generan mientras se
+# escriben, no se pueden medir por separado); pdf: convertirlo y guardarlo
+DOCX_STAGE_DURATION = metrics.REGISTRY.histogram(
+    "docx_stage_duration_seconds", "Duración de cada etapa de la generación",
+    ("stage",), metrics.DOCX_BUCKETS)
+
+TEMPLATE_CACHE_MB = int(os.getenv("V2_TEMPLATE_CACHE_MB", "256"))
+_registry = TemplateRegistry(max_bytes=TEMPLATE_CACHE_MB * 1024 * 1024)
+
+
+def _compile_upload(content: bytes, filename: str) -> tuple[CompiledTemplate, int]:
+    with DOCX_STAGE_DURATION.time("parse"):
+        compiled = compile_template(content, filename)
+    return compiled, _estimate_size(content)
 
 
 @app.post("/api/extract")
 async def extract(file: UploadFile = File(...)):
     """
     Recibe un .docx, extrae {{PLACEHOLDERS}} únicos y los devuelve.
-    También guarda la plantilla en memoria para la generación posterior.
+    También guarda la plantilla en memoria (compilada) para la generación posterior.
     """
     if not file.filename.endswith('.docx'):
         raise HTTPException(400, detail="Solo se aceptan archivos .docx")
 
     content = await file.read()
+    template_id = TemplateRegistry.id_for(content)
 
-    try:
-        doc = Document(io.BytesIO(content))
-    except Exception as e:
-        print(f"[EXTRACT] Error de lectura docx: {e}")
-        raise HTTPException(400, detail=f"No se pudo leer el archivo .docx: {e}")
+    entry = _registry.get(template_id)
+    if entry is None:
+        try:
+            compiled, size = await asyncio.to_thread(profiling.in_thread(_compile_upload), content, file.filename)
+        except Exception as e:
+            log.warning("Error de lectura docx", extra={"template": file.filename, "error": str(e)})
+            raise HTTPException(400, detail=f"No se pudo leer el archivo .docx: {e}")
+    else:
+        compiled, size = entry.compiled, entry.size
 
-    placeholders = extract_placeholders(doc)
+    placeholders = compiled.placeholders
 
     if not placeholders:
-        print(f"[EXTRACT] Documento sin placeholders: {file.filename}")
+        log.info("Documento sin placeholders", extra={"template": file.filename})
         raise HTTPException(422, detail="El documento no contiene placeholders {{...}}. "
                                         "Asegúrese de usar el formato {{NOMBRE_CAMPO}}.")
 
-    # Guardar template en memoria
-    _template_store['bytes'] = content
-    _template_store['filename'] = file.filename
+    # Guardar template en el registro (bytes + forma compilada)
+    _registry.put(TemplateEntry(template_id, file.filename, content, compiled, size))
 
-    print(f"[EXTRACT] '{file.filename}' -> {len(placeholders)} placeholders: {placeholders}")
+    log.info("Plantilla extraída", extra={"template": file.filename, "template_id": template_id,
+                                          "placeholders": len(placeholders)})
 
     return {
+        "template_id": template_id,
         "filename": file.filename,
         "placeholders": placeholders,
         "count": len(placeholders),
     }
 
 
+def resolve_template(template_id: Optional[str]) -> TemplateEntry:
+    """Plantilla pedida por id o, sin id, la última subida con /api/extract (compatibilidad)."""
+    if template_id:
+        entry = _registry.get(template_id)
+        if entry is None:
+            raise HTTPException(404, detail="La plantilla no está cargada o fue descartada. "
+                                            "Vuelva a subirla con /api/extract.")
+    else:
+        entry = _registry.latest()
+        if entry is None:
+            raise HTTPException(400, detail="No hay plantilla cargada. Use /api/extract primero.")
+    return entry
+
+
+# ─── Documentos generados ────────────────────────────────────────────────────
+# Se guardan en disco por hash (plantilla, valores, modo): repetir la descarga
+# cuesta un stat(). Ver shared/artifact_store.py.
+
+ARTIFACT_DIR = Path(os.getenv("V2_ARTIFACT_DIR", str(Path(__file__).parent / "cache" / "artifacts")))
+_artifacts = ArtifactStore(
+    ARTIFACT_DIR,
+    retention_seconds=float(os.getenv("V2_ARTIFACT_RETENTION_HOURS", "72")) * 3600,
+    max_bytes=int(float(os.getenv("V2_ARTIFACT_MAX_MB", "500")) * 1024 * 1024),
+)
+
+DOCX_MEDIA_TYPE = 'application/vnd.openxmlformats-officedocument.wordprocessingml.document'
+PDF_MEDIA_TYPE = 'application/pdf'
+
+# Conversores .docx -> .pdf precalentados (ver shared/pdf_pool.py); V2_PDF_WORKERS=0 los desactiva
+_pdf_pool = PdfPool(
+    workers=int(os.getenv("V2_PDF_WORKERS", "2")),
+    timeout=float(os.getenv("V2_PDF_TIMEOUT", "60")),
+    max_jobs=int(os.getenv("V2_PDF_MAX_JOBS", "200")),
+    queue_timeout=float(os.getenv("V2_PDF_QUEUE_TIMEOUT", "30")),
+    start_timeout=float(os.getenv("V2_PDF_START_TIMEOUT", "60")),
+    python=os.getenv("V2_PDF_PYTHON", "").strip() or sys.executable,
+    soffice=os.getenv("V2_SOFFICE_PATH", "").strip() or shutil.which("soffice") or "soffice",
+)
+_pdf_pool_start = None
+
+metrics.cache_metrics(lambda: {"templates": _registry, "artifacts": _artifacts})
+
+
+@app.on_event("startup")
+async def sweep_artifacts():
+    await asyncio.get_running_loop().run_in_executor(None, _artifacts.sweep)
+
+
+@app.on_event("startup")
+async def start_pdf_pool():
+    # En segundo plano: soffice tarda en arrancar y no debe demorar el inicio de la API
+    global _pdf_pool_start
+    _pdf_pool_start = asyncio.create_task(_pdf_pool.start())
+
+
+@app.on_event("shutdown")
+async def close_pdf_pool():
+    await _pdf_pool.close()
+
+
+def output_key(entry: TemplateEntry, replacements: dict, fmt: str = "docx") -> str:
+    return artifact_key(fmt, RENDER_MODE, entry.compiled.sha256,
+                        json.dumps(replacements, ensure_ascii=False, sort_keys=True))
+
+
+@app.get("/api/artifacts/{key}")
+async def download_artifact(key: str, request: Request):
+    """Vuelve a descargar un documento ya generado (admite Range e If-None-Match)."""
+    if not re.fullmatch(r'[0-9a-f]{64}', key):
+        raise HTTPException(404, detail="Documento inexistente")
+    for ext, media_type in (("docx", DOCX_MEDIA_TYPE), ("pdf", PDF_MEDIA_TYPE)):
+        if not _artifacts.path(key, ext).exists():
+            continue
+        path = _artifacts.get(key, ext)
+        if path is not None:
+            return serve_artifact(request, path, key, media_type, f"contrato.{ext}")
+    raise HTTPException(404, detail="Documento inexistente o vencido")
+
+
+def _render_to_store(entry: TemplateEntry, replacements: dict, key: str) -> tuple[Path, list[str]]:
+    """Renderiza y guarda el .docx; CPU y disco, se corre fuera del event loop."""
+    with DOCX_STAGE_DURATION.time("render"):
+        output, remaining = render_template(entry.compiled, entry.content, replacements)
+        return _artifacts.put(key, "docx", output), remaining
+
+
 @app.post("/api/generate")
-async def generate(request: GenerateRequest):
+async def generate(request: GenerateRequest, http_request: Request):
     """
-    Genera el .docx final reemplazando placeholders con los valores provistos.
+    Genera el .docx final (o .pdf con `format="pdf"`) reemplazando
+    placeholders con los valores provistos.
     Campos opcionales marcados como vacíos → se reemplazan por ''.
     """
-    if 'bytes' not in _template_store:
-        raise HTTPException(400, detail="No hay plantilla cargada. Use /api/extract primero.")
+    fmt = request.format.lower().strip()
+    if fmt not in ("docx", "pdf"):
+        raise HTTPException(400, detail="Formato inválido: use 'docx' o 'pdf'.")
+
+    entry = resolve_template(request.template_id)
 
     # Construir dict de reemplazos
     replacements = {}
@@ -274,45 +684,269 @@ async def generate(request: GenerateRequest):
     for ph in request.optional_empty:
         replacements[ph] = ''
 
-    print(f"[GENERATE] Reemplazando {len(replacements)} placeholders...")
-    for k, v in replacements.items():
-        preview = v[:40] + ('...' if len(v) > 40 else '')
-        print(f"  {{{{ {k} }}}} -> '{preview}'")
+    if structured_log.trace_enabled():
+        for k, v in replacements.items():
+            preview = v[:40] + ('...' if len(v) > 40 else '')
+            log_generate.debug("Reemplazo", extra={"placeholder": k, "value": preview})
 
+    key = output_key(entry, replacements, fmt)
+    path = _artifacts.get(key, fmt)
+    cached = False
     try:
-        doc = Document(io.BytesIO(_template_store['bytes']))
-        doc = replace_placeholders(doc, replacements)
-        
+        if path is None:
+            docx_key = output_key(entry, replacements)
+            docx_path = _artifacts.get(docx_key, "docx") if fmt == "pdf" else None
+            if docx_path is None:
+                docx_path, remaining = await asyncio.to_thread(profiling.in_thread(_render_to_store), entry, replacements, docx_key)
+            else:
+                remaining = _remaining_placeholders(entry.compiled, replacements)
+            if fmt == "pdf":
+                with DOCX_STAGE_DURATION.time("pdf"):
+                    pdf = await _pdf_pool.convert(await asyncio.to_thread(docx_path.read_bytes))
+                    path = await asyncio.to_thread(profiling.in_thread(_artifacts.put), key, "pdf", [pdf])
+            else:
+                path = docx_path
+        else:
+            remaining = _remaining_placeholders(entry.compiled, replacements)
+            cached = True
+
         # Validación post-generación
-        remaining = check_for_remaining_placeholders(doc)
         if remaining:
-            print(f"[GENERATE] ADVERTENCIA: Quedaron placeholders sin reemplazar: {remaining}")
-            
+            log_generate.warning("Quedaron placeholders sin reemplazar", extra={"remaining": remaining})
+
+    except PdfUnavailable as e:
+        raise HTTPException(503, detail=f"Conversión a PDF no disponible: {e}")
     except Exception as e:
-        print(f"[GENERATE] Error crítico durante la generación: {e}")
-        traceback.print_exc()
+        log_generate.exception("Error crítico durante la generación")
         raise HTTPException(500, detail=f"Error al generar el documento: {e}")
 
-    # Serializar a bytes
-    output = io.BytesIO()
-    doc.save(output)
-    output.seek(0)
+    original_name = entry.filename or 'contrato.docx'
+    out_name = original_name.replace('.docx', f'_COMPLETADO.{fmt}')
 
-    original_name = _template_store.get('filename', 'contrato.docx')
-    out_name = original_name.replace('.docx', '_COMPLETADO.docx')
+    log_generate.info("Documento generado", extra={"template_id": entry.template_id, "format": fmt,
+                                          "placeholders": len(replacements), "cached": cached})
 
-    print(f"[GENERATE] OK -> '{out_name}'")
-
-    return StreamingResponse(
-        output,
-        media_type='application/vnd.openxmlformats-officedocument.wordprocessingml.document',
+    return serve_artifact(
+        http_request, path, key, PDF_MEDIA_TYPE if fmt == "pdf" else DOCX_MEDIA_TYPE, out_name,
         headers={
-            'Content-Disposition': f'attachment; filename="{out_name}"',
-            'X-Unreplaced-Placeholders': ",".join(remaining) if remaining else ""
+            'X-Unreplaced-Placeholders': ",".join(remaining) if remaining else "",
+            'X-Artifact-Id': key,
         }
     )
 
 
+# ─── Generación por lotes ─────────────────────────────────────────────────────
+#
+# Renderizar con python-docx es CPU-bound: las filas de un lote se reparten en
+# un pool de procesos. Cada worker compila la plantilla una vez (la lee de un
+# archivo temporal) y la reutiliza para todas las filas que le toquen.
+
+BATCH_WORKERS = int(os.getenv("V2_BATCH_WORKERS", "0")) or os.cpu_count() or 2
+BATCH_MAX_ROWS = int(os.getenv("V2_BATCH_MAX_ROWS", "1000"))
+BATCH_NAME_COLUMN = "ARCHIVO"   # columna opcional con el nombre del archivo de salida
+
+_batch_pool: Optional[ProcessPoolExecutor] = None
+
+# Cache por proceso worker: template_id -> (CompiledTemplate, bytes originales)
+_worker_templates: OrderedDict = OrderedDict()
+_WORKER_CACHE_SIZE = 4
+
+
+def _get_batch_pool() -> ProcessPoolExecutor:
+    global _batch_pool
+    if _batch_pool is None:
+        _batch_pool = ProcessPoolExecutor(max_workers=BATCH_WORKERS)
+    return _batch_pool
+
+
+@app.on_event("shutdown")
+def shutdown_batch_pool():
+    global _batch_pool
+    if _batch_pool is not None:
+        _batch_pool.shutdown(wait=True, cancel_futures=True)
+        _batch_pool = None
+
+
+def _render_batch_row(template_id: str, template_path: str, replacements: dict) -> tuple[bytes, list[str]]:
+    """Se ejecuta en el worker: renderiza una fila y devuelve (docx, sin reemplazar)."""
+    cached = _worker_templates.get(template_id)
+    if cached is None:
+        with open(template_path, "rb") as f:
+            content = f.read()
+        cached = (compile_template(content, os.path.basename(template_path)), content)
+        _worker_templates[template_id] = cached
+        while len(_worker_templates) > _WORKER_CACHE_SIZE:
+            _worker_templates.popitem(last=False)
+    else:
+        _worker_templates.move_to_end(template_id)
+    chunks, remaining = render_template(cached[0], cached[1], replacements)
+    return b"".join(chunks), remaining
+
+
+def parse_batch_rows(content: bytes, filename: str) -> list[dict[str, str]]:
+    """
+    Lee las filas del lote: JSONL (un objeto por línea) o CSV con encabezado.
+    El delimitador del CSV se detecta (',', ';' o tabulación).
+    """
+    text = content.decode("utf-8-sig")
+    if filename.lower().endswith((".jsonl", ".ndjson")):
+        rows = []
+        for n, line in enumerate(text.splitlines(), 1):
+            if not line.strip():
+                continue
+            try:
+                obj = json.loads(line)
+            except json.JSONDecodeError as e:
+                raise ValueError(f"Línea {n}: JSON inválido ({e})")
+            if not isinstance(obj, dict):
+                raise ValueError(f"Línea {n}: se esperaba un objeto JSON")
+            rows.append({str(k): "" if v is None else str(v) for k, v in obj.items()})
+        return rows
+
+    try:
+        dialect = csv.Sniffer().sniff(text[:4096], delimiters=",;\t")
+    except csv.Error:
+        dialect = csv.excel
+    reader = csv.DictReader(io.StringIO(text), dialect=dialect)
+    return [{k.strip(): (v or "") for k, v in row.items() if k} for row in reader]
+
+
+def _batch_filename(row: dict, index: int, base: str, used: set) -> str:
+    name = (row.get(BATCH_NAME_COLUMN) or "").strip() or f"{base}_{index:03d}"
+    name = re.sub(r'[\\/:*?"<>|]+', "_", name)
+    if not name.lower().endswith(".docx"):
+        name += ".docx"
+    candidate, n = name, 2
+    while candidate.lower() in used:
+        candidate = f"{name[:-5]}_{n}.docx"
+        n += 1
+    used.add(candidate.lower())
+    return candidate
+
+
+class _ZipStream(io.RawIOBase):
+    """Destino no posicionable para ZipFile: acumula lo escrito hasta drenarlo."""
+
+    def __init__(self):
+        self._chunks: list[bytes] = []
+
+    def writable(self):
+        return True
+
+    def write(self, b):
+        self._chunks.append(bytes(b))
+        return len(b)
+
+    def drain(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+def batch_replacements(row: dict, optional_empty: list[str]) -> dict:
+    """
+    Reemplazos de una fila con la misma regla que /api/generate: las celdas
+    vacías y los opcionales marcados como vacíos se reemplazan por ''.
+    """
+    replacements = {k: v.strip() for k, v in row.items() if k != BATCH_NAME_COLUMN}
+    for ph in optional_empty:
+        replacements.setdefault(ph, '')
+    return replacements
+
+
+async def _stream_batch(entry: TemplateEntry, rows: list[dict], optional_empty: list[str]):
+    """Genera el ZIP a medida que terminan las filas; cierra con reporte.json."""
+    loop = asyncio.get_running_loop()
+    pool = _get_batch_pool()
+
+    fd, template_path = tempfile.mkstemp(suffix=".docx")
+    with os.fdopen(fd, "wb") as f:
+        f.write(entry.content)
+
+    async def render_row(index: int, name: str, replacements: dict):
+        try:
+            data, remaining = await loop.run_in_executor(
+                pool, _render_batch_row, entry.template_id, template_path, replacements)
+            return index, name, data, remaining, None
+        except Exception as e:
+            return index, name, None, [], e
+
+    base = entry.filename.rsplit(".", 1)[0]
+    used: set = set()
+    tasks = []
+    for i, row in enumerate(rows, 1):
+        replacements = batch_replacements(row, optional_empty)
+        name = _batch_filename(row, i, base, used)
+        tasks.append(asyncio.ensure_future(render_row(i, name, replacements)))
+
+    report = []
+    sink = _ZipStream()
+    try:
+        with zipfile.ZipFile(sink, "w", zipfile.ZIP_DEFLATED) as zf:
+            for next_done in asyncio.as_completed(tasks):
+                i, name, data, remaining, error = await next_done
+                if error is not None:
+                    log_batch.warning("Fila con error", extra={"row": i, "error": str(error)})
+                    report.append({"fila": i, "archivo": None, "error": str(error), "sin_reemplazar": []})
+                    continue
+                # El .docx ya viene comprimido: se guarda tal cual
+                zf.writestr(name, data, compress_type=zipfile.ZIP_STORED)
+                report.append({"fila": i, "archivo": name, "error": None, "sin_reemplazar": remaining})
+                yield sink.drain()
+
+            report.sort(key=lambda r: r["fila"])
+            zf.writestr("reporte.json", json.dumps(report, ensure_ascii=False, indent=2))
+        yield sink.drain()
+        log_batch.info("Lote terminado", extra={"rows": len(report),
+                                            "errors": sum(1 for r in report if r['error'])})
+    finally:
+        for task in tasks:
+            task.cancel()
+        try:
+            os.remove(template_path)
+        except OSError:
+            pass
+
+
+@app.post("/api/generate-batch")
+async def generate_batch(rows: UploadFile = File(...), template_id: Optional[str] = Form(None),
+                         optional_empty: str = Form("")):
+    """
+    Genera un contrato por fila (CSV o JSONL) a partir de una plantilla cargada.
+    Devuelve un ZIP que se transmite a medida que se renderizan las filas e
+    incluye reporte.json con los placeholders sin reemplazar de cada fila.
+    Las celdas vacías se reemplazan por ''; `optional_empty` (separados por
+    coma) lista placeholders sin columna que también van vacíos.
+    """
+    entry = resolve_template(template_id)
+
+    try:
+        parsed = parse_batch_rows(await rows.read(), rows.filename or "")
+    except (UnicodeDecodeError, ValueError, csv.Error) as e:
+        raise HTTPException(400, detail=f"No se pudieron leer las filas del lote: {e}")
+
+    if not parsed:
+        raise HTTPException(400, detail="El lote no contiene filas.")
+    if len(parsed) > BATCH_MAX_ROWS:
+        raise HTTPException(413, detail=f"El lote supera el máximo de {BATCH_MAX_ROWS} filas.")
+
+    log_batch.info("Lote iniciado", extra={"template": entry.filename, "template_id": entry.template_id,
+                                           "rows": len(parsed), "workers": BATCH_WORKERS})
+
+    out_name = entry.filename.replace('.docx', '_LOTE.zip')
+    return StreamingResponse(
+        _stream_batch(entry, parsed, [ph.strip() for ph in optional_empty.split(",") if ph.strip()]),
+        media_type="application/zip",
+        headers={'Content-Disposition': f'attachment; filename="{out_name}"'},
+    )
+
+
+@app.get("/metrics", include_in_schema=False)
+async def metrics_endpoint():
+    """Métricas del proceso en formato de texto de Prometheus (ver shared/metrics.py)."""
+    return Response(metrics.REGISTRY.expose(), media_type=metrics.MEDIA_TYPE)
+
+
 # ─── Static files (frontend) ─────────────────────────────────────────────────
 FRONTEND_DIR = Path(__file__).parent.parent / "frontend"
 if FRONTEND_DIR.exists():
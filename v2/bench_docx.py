@@ -0,0 +1,349 @@
+"""
+Benchmark y regresión del motor docx de V2 sobre plantillas sintéticas.
+
+Genera plantillas desde unos pocos párrafos hasta cientos de páginas, con runs
+muy partidos, tablas grandes, headers/footers con placeholders e imágenes, y
+mide para cada tamaño:
+  - extract_placeholders y replace_placeholders (python-docx, sin compilar),
+  - compile_template y render_template en los dos modos (zip y docx),
+  - /api/generate de punta a punta (p50/p95 y pedidos por segundo),
+  - el pico de memoria de cada fase (tracemalloc, en una pasada aparte; cuenta
+    sólo lo que asigna Python, no los árboles de lxml: para eso está rss_max_mb,
+    el máximo del proceso, donde el sistema lo informa).
+También verifica que no queden placeholders y que los dos modos de render
+produzcan el mismo texto que replace_placeholders.
+
+Los resultados se guardan en JSON (--salida). Con --umbrales se comparan contra
+máximos absolutos y con --base contra una corrida anterior (--tolerancia);
+si algo se pasa el script termina con código 1, para cortar un deploy.
+
+Ejecutar desde la raíz del repo:
+    python v2/bench_docx.py --paginas 1,10,50,200 --salida bench_docx.json
+    python v2/bench_docx.py --umbrales v2/bench_umbrales.json --base bench_docx_anterior.json
+"""
+import argparse
+import asyncio
+import io
+import json
+import os
+import platform
+import random
+import struct
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+import zlib
+from datetime import datetime, timezone
+from typing import Optional
+
+from docx import Document
+from docx.shared import Cm
+
+# Sin conversores PDF ni artefactos de corridas anteriores: cada generate renderiza.
+# Sólo advertencias en el log, para que no se mezcle con la tabla.
+os.environ.setdefault("LOG_LEVEL", "WARNING")
+os.environ.setdefault("V2_PDF_WORKERS", "0")
+os.environ.setdefault("V2_ARTIFACT_DIR", tempfile.mkdtemp(prefix="bench_docx_"))
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'backend'))
+import main  # noqa: E402
+
+PARRAFOS_POR_PAGINA = 8
+PALABRAS = ("el locatario se obliga a abonar la suma pactada en el domicilio del locador dentro de "
+            "los primeros diez días de cada mes sin necesidad de interpelación previa alguna").split()
+CAMPOS = [f"CAMPO_{i:02d}" for i in range(60)] + ["LOCADOR_NOMBRE", "LOCATARIO_NOMBRE", "CIUDAD"]
+
+
+def _png(ancho: int, alto: int, rng: random.Random) -> bytes:
+    """PNG RGB con ruido, sin depender de Pillow (no comprime casi nada, como una foto)."""
+    def chunk(tipo, datos):
+        return struct.pack(">I", len(datos)) + tipo + datos + struct.pack(">I", zlib.crc32(tipo + datos))
+    filas = b"".join(b"\x00" + rng.randbytes(ancho * 3) for _ in range(alto))
+    return (b"\x89PNG\r\n\x1a\n" + chunk(b"IHDR", struct.pack(">IIBBBBB", ancho, alto, 8, 2, 0, 0, 0))
+            + chunk(b"IDAT", zlib.compress(filas)) + chunk(b"IEND", b""))
+
+
+def _texto(rng: random.Random, palabras: int, campos: int) -> str:
+    partes = [rng.choice(PALABRAS) for _ in range(palabras)]
+    for _ in range(campos):
+        partes.insert(rng.randrange(len(partes) + 1), "{{%s}}" % rng.choice(CAMPOS))
+    return " ".join(partes) + "."
+
+
+def _parrafo(destino, texto: str, rng: random.Random, partido: bool):
+    """Párrafo en runs de 1-3 caracteres (`partido`) o de a palabras, con formato alternado."""
+    para = destino.add_paragraph()
+    pos = 0
+    while pos < len(texto):
+        if partido:
+            paso = rng.randint(1, 3)
+        else:
+            fin = texto.find(" ", pos + rng.randint(5, 40))
+            paso = (fin if fin != -1 else len(texto)) - pos
+        run = para.add_run(texto[pos:pos + paso])
+        run.bold = rng.random() < 0.1
+        pos += paso
+    return para
+
+
+def build_template(paginas: int, semilla: int = 0) -> bytes:
+    """
+    Plantilla de `paginas` páginas (cada una ~PARRAFOS_POR_PAGINA párrafos y un
+    salto de página). Un 20% de los párrafos está partido carácter a carácter;
+    cada 10 páginas hay una tabla de 25x4 y cada 20 una imagen. Con 1 página
+    son unos pocos párrafos, un header, un footer y una imagen.
+    """
+    rng = random.Random(semilla)
+    doc = Document()
+    section = doc.sections[0]
+    section.header.paragraphs[0].text = "Contrato {{CAMPO_00}} - Locador: {{LOCADOR_NOMBRE}}"
+    footer = section.footer.paragraphs[0]
+    for trozo in ("Firmado en {{", "CIU", "DAD", "}} - ejemplar {{CAMPO_01}}"):
+        footer.add_run(trozo)
+
+    for pagina in range(paginas):
+        if pagina % 20 == 0:
+            doc.add_picture(io.BytesIO(_png(160, 120, rng)), width=Cm(6))
+        for _ in range(PARRAFOS_POR_PAGINA):
+            _parrafo(doc, _texto(rng, rng.randint(40, 80), rng.randint(0, 3)), rng, rng.random() < 0.2)
+        if pagina % 10 == 9:
+            tabla = doc.add_table(rows=25, cols=4)
+            tabla.style = 'Table Grid'
+            for fila in tabla.rows:
+                for celda in fila.cells:
+                    celda.text = _texto(rng, rng.randint(2, 6), int(rng.random() < 0.3))
+        if pagina < paginas - 1:
+            doc.add_page_break()
+
+    buf = io.BytesIO()
+    doc.save(buf)
+    return buf.getvalue()
+
+
+def _valores(nombres, n: int = 0) -> dict:
+    # `n` distinto en cada generate para que no se sirva el artefacto ya generado
+    return {name: f"Valor {name.lower()} nº {n}" for name in nombres}
+
+
+def _textos(doc) -> list[str]:
+    return [main._paragraph_text(p) for _, p in main.iter_paragraphs(doc)]
+
+
+def _mejor(fn, repeticiones: int) -> tuple[float, object]:
+    """Mejor tiempo (segundos) de `repeticiones` corridas y el resultado de la última."""
+    mejor, resultado = float("inf"), None
+    for _ in range(repeticiones):
+        t0 = time.perf_counter()
+        resultado = fn()
+        mejor = min(mejor, time.perf_counter() - t0)
+    return mejor, resultado
+
+
+def _pico_mb(fn) -> float:
+    tracemalloc.start()
+    try:
+        fn()
+        return round(tracemalloc.get_traced_memory()[1] / 2**20, 1)
+    finally:
+        tracemalloc.stop()
+
+
+def _percentil(orden: list[float], p: float) -> float:
+    k = max(0, min(len(orden) - 1, int(round(p / 100 * len(orden) + 0.5)) - 1))
+    return orden[k]
+
+
+async def _generates(content: bytes, nombres: list[str], cantidad: int, concurrencia: int) -> dict:
+    import httpx
+
+    transporte = httpx.ASGITransport(app=main.app)
+    async with httpx.AsyncClient(transport=transporte, base_url="http://bench", timeout=600) as cliente:
+        resp = await cliente.post("/api/extract", files={"file": ("bench.docx", content)})
+        resp.raise_for_status()
+        template_id = resp.json()["template_id"]
+        tiempos = []
+        sem = asyncio.Semaphore(concurrencia)
+
+        async def uno(n):
+            async with sem:
+                t0 = time.perf_counter()
+                r = await cliente.post("/api/generate", json={"template_id": template_id,
+                                                              "values": _valores(nombres, n)})
+                r.raise_for_status()
+                tiempos.append(time.perf_counter() - t0)
+
+        inicio = time.perf_counter()
+        await asyncio.gather(*(uno(n) for n in range(cantidad)))
+        total = time.perf_counter() - inicio
+
+    orden = sorted(tiempos)
+    return {
+        "generate_p50_ms": round(_percentil(orden, 50) * 1000, 1),
+        "generate_p95_ms": round(_percentil(orden, 95) * 1000, 1),
+        "generate_req_s": round(cantidad / total, 2),
+    }
+
+
+def medir(paginas: int, args) -> dict:
+    content = build_template(paginas, semilla=paginas)
+    doc = Document(io.BytesIO(content))
+    nombres = main.extract_placeholders(doc)
+    valores = _valores(nombres)
+    caso = {
+        "paginas": paginas,
+        "plantilla_kb": round(len(content) / 1024, 1),
+        "parrafos": sum(1 for _ in main.iter_paragraphs(doc)),
+        "runs": sum(len(p.runs) for _, p in main.iter_paragraphs(doc)),
+        "placeholders": len(nombres),
+    }
+    rep = args.repeticiones
+
+    t, _ = _mejor(lambda: Document(io.BytesIO(content)), rep)
+    caso["parse_ms"] = t * 1000
+
+    def extraer():
+        return main.extract_placeholders(Document(io.BytesIO(content)))
+    t, encontrados = _mejor(extraer, rep)
+    caso["extract_ms"] = t * 1000 - caso["parse_ms"]
+
+    def reemplazar():
+        return main.replace_placeholders(Document(io.BytesIO(content)), valores)
+    t, reemplazado = _mejor(reemplazar, rep)
+    caso["replace_ms"] = t * 1000 - caso["parse_ms"]
+
+    t, _ = _mejor(lambda: reemplazado.save(io.BytesIO()), rep)
+    caso["save_ms"] = t * 1000
+
+    t, compilada = _mejor(lambda: main.compile_template(content, "bench.docx"), rep)
+    caso["compile_ms"] = t * 1000
+
+    # El zip se arma recién al consumir los bloques
+    t, salida_zip = _mejor(lambda: b"".join(main.render_compiled_zip(compilada, content, valores)[0]), rep)
+    caso["render_zip_ms"] = t * 1000
+
+    t, (salida_docx, _) = _mejor(lambda: main.render_compiled(compilada, valores), rep)
+    caso["render_docx_ms"] = t * 1000
+
+    # Regresión: mismo resultado por los tres caminos y sin placeholders
+    esperado = _textos(reemplazado)
+    errores = []
+    if set(encontrados) != set(nombres):
+        errores.append("extract_placeholders no devolvió los mismos placeholders")
+    if any("{{" in texto for texto in esperado):
+        errores.append("replace_placeholders dejó placeholders sin reemplazar")
+    if _textos(Document(io.BytesIO(salida_zip))) != esperado:
+        errores.append("render zip difiere de replace_placeholders")
+    if _textos(Document(salida_docx)) != esperado:
+        errores.append("render docx difiere de replace_placeholders")
+    caso["errores"] = errores
+
+    caso.update(asyncio.run(_generates(content, nombres, args.generates, args.concurrencia)))
+
+    if not args.sin_memoria:
+        caso["pico_extract_mb"] = _pico_mb(extraer)
+        caso["pico_replace_mb"] = _pico_mb(lambda: reemplazar().save(io.BytesIO()))
+        caso["pico_compile_mb"] = _pico_mb(lambda: main.compile_template(content, "bench.docx"))
+        caso["pico_render_mb"] = _pico_mb(
+            lambda: b"".join(main.render_compiled_zip(compilada, content, _valores(nombres, -1))[0]))
+
+    return {k: round(v, 1) if isinstance(v, float) else v for k, v in caso.items()}
+
+
+def _git_commit() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except OSError:
+        return ""
+
+
+def _rss_max_mb() -> Optional[float]:
+    try:
+        import resource
+    except ImportError:   # Windows
+        return None
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux lo informa en KB, macOS en bytes
+    return round(maxrss / (2**20 if sys.platform == "darwin" else 2**10), 1)
+
+
+def verificar(resultado: dict, umbrales: dict, base: dict, tolerancia: float) -> list[str]:
+    """
+    Fallas contra los máximos absolutos (umbrales["maximos"][paginas][métrica])
+    y contra la corrida base: métricas *_ms y *_mb más de `tolerancia` peores,
+    o *_req_s más de `tolerancia` menores.
+    """
+    fallas = []
+    base_por_paginas = {str(c["paginas"]): c for c in (base or {}).get("casos", [])}
+    for caso in resultado["casos"]:
+        clave = str(caso["paginas"])
+        for error in caso["errores"]:
+            fallas.append(f"{clave} páginas: {error}")
+        for metrica, maximo in (umbrales or {}).get("maximos", {}).get(clave, {}).items():
+            if metrica in caso and caso[metrica] > maximo:
+                fallas.append(f"{clave} páginas: {metrica} = {caso[metrica]} supera el máximo {maximo}")
+        anterior = base_por_paginas.get(clave, {})
+        for metrica, valor in caso.items():
+            previo = anterior.get(metrica)
+            if not isinstance(previo, (int, float)) or not previo or metrica == "paginas":
+                continue
+            if metrica.endswith(("_ms", "_mb")) and valor > previo * (1 + tolerancia):
+                fallas.append(f"{clave} páginas: {metrica} {previo} -> {valor} (+{valor / previo - 1:.0%})")
+            elif metrica.endswith("_req_s") and valor < previo * (1 - tolerancia):
+                fallas.append(f"{clave} páginas: {metrica} {previo} -> {valor} ({valor / previo - 1:.0%})")
+    return fallas
+
+
+def main_bench():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--paginas", default="1,10,50,200", help="tamaños de plantilla (lista)")
+    parser.add_argument("--repeticiones", type=int, default=3, help="se toma el mejor tiempo")
+    parser.add_argument("--generates", type=int, default=20, help="pedidos a /api/generate por tamaño")
+    parser.add_argument("--concurrencia", type=int, default=4)
+    parser.add_argument("--sin-memoria", action="store_true", help="no medir picos de memoria")
+    parser.add_argument("--salida", default="bench_docx.json", help="resultados en JSON")
+    parser.add_argument("--umbrales", help="JSON con máximos por tamaño (ver v2/bench_umbrales.json)")
+    parser.add_argument("--base", help="resultados de una corrida anterior para comparar")
+    parser.add_argument("--tolerancia", type=float, default=None,
+                        help="empeoramiento admitido contra --base (default: el de --umbrales o 0.25)")
+    args = parser.parse_args()
+
+    umbrales = json.load(open(args.umbrales, encoding="utf-8")) if args.umbrales else {}
+    base = json.load(open(args.base, encoding="utf-8")) if args.base else {}
+    tolerancia = args.tolerancia if args.tolerancia is not None else umbrales.get("tolerancia", 0.25)
+
+    columnas = ("paginas", "runs", "extract_ms", "replace_ms", "save_ms", "compile_ms",
+                "render_zip_ms", "generate_p50_ms", "generate_req_s", "pico_replace_mb")
+    print(" ".join(f"{c:>15}" for c in columnas))
+    casos = []
+    for paginas in [int(x) for x in args.paginas.split(",")]:
+        caso = medir(paginas, args)
+        casos.append(caso)
+        print(" ".join(f"{caso.get(c, '-'):>15}" for c in columnas))
+
+    resultado = {
+        "fecha": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "commit": _git_commit(),
+        "python": platform.python_version(),
+        "plataforma": platform.platform(),
+        "cpus": os.cpu_count(),
+        "render_mode": main.RENDER_MODE,
+        "rss_max_mb": _rss_max_mb(),
+        "casos": casos,
+    }
+    with open(args.salida, "w", encoding="utf-8") as f:
+        json.dump(resultado, f, indent=2, ensure_ascii=False)
+    print(f"\nResultados en {args.salida}")
+
+    fallas = verificar(resultado, umbrales, base, tolerancia)
+    for falla in fallas:
+        print(f"❌ {falla}")
+    if fallas:
+        sys.exit(1)
+    print("✅ Sin regresiones")
+
+
+if __name__ == "__main__":
+    main_bench()
@@ -0,0 +1,115 @@
+"""
+Benchmark de _replace_in_paragraph: implementación actual vs. la anterior
+(que recorría los runs por cada match) sobre párrafos partidos en muchos runs.
+Además verifica que ambas produzcan exactamente los mismos runs.
+
+Ejecutar desde la raíz del repo: python v2/bench_replace.py [--runs 25,100,300]
+"""
+import argparse
+import contextlib
+import io
+import os
+import random
+import sys
+import time
+
+from docx import Document
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'backend'))
+import main  # noqa: E402
+
+
+def _replace_in_paragraph_legacy(para, replacements: dict):
+    """Implementación previa, conservada sólo como referencia para comparar."""
+    full_text = "".join(r.text for r in para.runs)
+    matches = list(main.PLACEHOLDER_RE.finditer(full_text))
+    for match in reversed(matches):
+        if match.group(1) not in replacements:
+            continue
+        replacement_text = replacements[match.group(1)]
+        start_idx, end_idx = match.span()
+
+        affected_indices = []
+        current_pos = 0
+        for i, run in enumerate(para.runs):
+            run_len = len(run.text)
+            if current_pos < end_idx and current_pos + run_len > start_idx:
+                affected_indices.append(i)
+            current_pos += run_len
+        if not affected_indices:
+            continue
+
+        first_idx, last_idx = affected_indices[0], affected_indices[-1]
+        first_run, last_run = para.runs[first_idx], para.runs[last_idx]
+        rel_start = start_idx - sum(len(para.runs[i].text) for i in range(first_idx))
+        rel_end = end_idx - sum(len(para.runs[i].text) for i in range(last_idx))
+        prefix, suffix = first_run.text[:rel_start], last_run.text[rel_end:]
+
+        if first_idx == last_idx:
+            first_run.text = prefix + replacement_text + suffix
+        else:
+            first_run.text = prefix + replacement_text
+            last_run.text = suffix
+            for el in [para.runs[i]._element for i in range(first_idx + 1, last_idx)]:
+                el.getparent().remove(el)
+
+
+def build_paragraph(doc, n_runs: int, rng: random.Random):
+    """Párrafo con ~n_runs runs de 1-3 caracteres, con placeholders partidos."""
+    text = []
+    length = 0
+    while length < n_runs * 2:
+        text.append(rng.choice(["lorem ", "ipsum ", "{{CAMPO_%d}} " % rng.randint(0, 9), "dolor, "]))
+        length += len(text[-1])
+    full = "".join(text)
+    para = doc.add_paragraph()
+    pos = 0
+    while pos < len(full):
+        step = rng.randint(1, 3)
+        para.add_run(full[pos:pos + step])
+        pos += step
+    return para
+
+
+def _time(fn, doc_bytes, replacements, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        doc = Document(io.BytesIO(doc_bytes))
+        t0 = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            for para in doc.paragraphs:
+                fn(para, replacements)
+        best = min(best, time.perf_counter() - t0)
+    return best, doc
+
+
+def main_bench():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--runs", default="25,100,300", help="runs por párrafo (lista)")
+    parser.add_argument("--parrafos", type=int, default=3)
+    parser.add_argument("--repeat", type=int, default=1)
+    args = parser.parse_args()
+
+    replacements = {"CAMPO_%d" % i: "Valor número %d" % i for i in range(8)}  # 8 y 9 quedan sin valor
+    print(f"{'runs/párrafo':>13} {'anterior (ms)':>14} {'actual (ms)':>12} {'speedup':>8}")
+
+    for n_runs in [int(x) for x in args.runs.split(",")]:
+        rng = random.Random(n_runs)
+        doc = Document()
+        for _ in range(args.parrafos):
+            build_paragraph(doc, n_runs, rng)
+        buf = io.BytesIO()
+        doc.save(buf)
+
+        t_old, doc_old = _time(_replace_in_paragraph_legacy, buf.getvalue(), replacements, args.repeat)
+        t_new, doc_new = _time(main._replace_in_paragraph, buf.getvalue(), replacements, args.repeat)
+
+        runs_old = [[r.text for r in p.runs] for p in doc_old.paragraphs]
+        runs_new = [[r.text for r in p.runs] for p in doc_new.paragraphs]
+        assert runs_old == runs_new, f"Resultados distintos con {n_runs} runs"
+
+        print(f"{n_runs:>13} {t_old * 1000:>14.1f} {t_new * 1000:>12.1f} {t_old / t_new:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main_bench()
@@ -7,6 +7,7 @@ const API = '';
 
 const state = {
     placeholders: [],   // lista de strings: ['LOCADOR_NOMBRE', ...]
+    templateId: null,   // ID devuelto por /api/extract
     lastBlob: null,     // blob del docx generado
     lastFilename: '',
 };
@@ -187,6 +188,7 @@ async function handleExtract() {
         }
 
         state.placeholders = data.placeholders;
+        state.templateId = data.template_id;
         console.log(`[EXTRACT] ${data.count} placeholders:`, data.placeholders);
 
         hideLoading();
@@ -299,7 +301,7 @@ async function handleGenerate() {
         const res = await fetch(url, {
             method: 'POST',
             headers: { 'Content-Type': 'application/json' },
-            body: JSON.stringify({ values, optional_empty: optionalEmpty }),
+            body: JSON.stringify({ values, optional_empty: optionalEmpty, template_id: state.templateId }),
         });
 
         uiLog(`Status Code: ${res.status}`);